@@ -1,8 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, abort
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, abort, send_from_directory, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta
-import json, pytz, os, re, uuid, base64, requests, logging, sys
-from matrixCalculator import compute_matrix
+from concurrent.futures import ThreadPoolExecutor
+import json, pytz, os, re, uuid, hashlib, requests, logging, sys, time, threading
+from matrixCalculator import compute_matrix, compute_matrix_range, compute_corridor_matrices, fetch_train_data, search_trips, pair_lookup, SEAT_TYPES
 from request_queue import RequestQueue
+from result_store import ResultStore
+from rate_limiter import RateLimiter, MemoryBucketStore, SqliteBucketStore
+from static_assets import AssetManifest
+from compression import ResponseCompressor, negotiate_encoding
+from matrix_fragments import MatrixFragmentCache
+from matrix_codec import encode_columnar, populated_seat_types
+from suggest_index import SuggestIndex
+from corridor_cache import CorridorCache
+from corridor_index import CorridorIndex
+from watch import WatchManager
+from journey_solver import JourneySolver
+from matrix_export import export_chunks, EXPORT_FORMATS
+from snapshot_store import SnapshotStore
+from credential_cache import CredentialCache, AUTH_ERRORS
+from upstream import api_url, upstream_get, upstream_stats
+from tracing import TRACER, span, traced_iter
+
+APP_INIT_STARTED = time.perf_counter()
 
 app = Flask(__name__)
 app.secret_key = "super_secret_key"
@@ -17,8 +37,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-RESULT_CACHE = {}
-
 @app.before_request
 def redirect_to_new_site():
     return redirect('https://trainseat.onrender.com/sunset', code=302)
@@ -115,40 +133,23 @@ def get_user_device_info():
 with open('config.json', 'r', encoding='utf-8') as config_file:
     CONFIG = json.load(config_file)
 
-with open('static/js/script.js', 'r', encoding='utf-8') as js_file:
-    SCRIPT_JS_CONTENT = js_file.read()
-with open('static/css/styles.css', 'r', encoding='utf-8') as css_file:
-    STYLES_CSS_CONTENT = css_file.read()
+# Only the addresses appended by our own proxies are trusted; anything to their left in
+# X-Forwarded-For was sent by the client
+if CONFIG.get("proxy_fix_hops", 1):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=CONFIG.get("proxy_fix_hops", 1))
 
-default_banner_path = 'static/images/sample_banner.png'
-DEFAULT_BANNER_IMAGE = ""
-if os.path.exists(default_banner_path):
-    try:
-        with open(default_banner_path, 'rb') as img_file:
-            encoded_image = base64.b64encode(img_file.read()).decode('utf-8')
-            DEFAULT_BANNER_IMAGE = f"data:image/png;base64,{encoded_image}"
-    except Exception:
-        pass
+ASSETS = AssetManifest(app.static_folder)
+app.jinja_env.globals['asset_url'] = ASSETS.url_for
 
-instruction_image_path = 'static/images/instruction.png'
-DEFAULT_INSTRUCTION_IMAGE = ""
-if os.path.exists(instruction_image_path):
-    try:
-        with open(instruction_image_path, 'rb') as img_file:
-            encoded_image = base64.b64encode(img_file.read()).decode('utf-8')
-            DEFAULT_INSTRUCTION_IMAGE = f"data:image/png;base64,{encoded_image}"
-    except Exception:
-        pass
+RESPONSE_COMPRESSOR = ResponseCompressor(
+    min_size=CONFIG.get("compression_min_size", 1024),
+    gzip_level=CONFIG.get("compression_gzip_level", 6),
+    brotli_quality=CONFIG.get("compression_brotli_quality", 5)
+)
 
-mobile_instruction_image_path = 'static/images/mobile_instruction.png'
-DEFAULT_MOBILE_INSTRUCTION_IMAGE = ""
-if os.path.exists(mobile_instruction_image_path):
-    try:
-        with open(mobile_instruction_image_path, 'rb') as img_file:
-            encoded_image = base64.b64encode(img_file.read()).decode('utf-8')
-            DEFAULT_MOBILE_INSTRUCTION_IMAGE = f"data:image/png;base64,{encoded_image}"
-    except Exception:
-        pass
+DEFAULT_BANNER_IMAGE = ASSETS.url_for('images/sample_banner.png')
+DEFAULT_INSTRUCTION_IMAGE = ASSETS.url_for('images/instruction.png')
+DEFAULT_MOBILE_INSTRUCTION_IMAGE = ASSETS.url_for('images/mobile_instruction.png')
 
 def configure_request_queue():
     max_concurrent = CONFIG.get("queue_max_concurrent", 1)
@@ -156,33 +157,172 @@ def configure_request_queue():
     batch_cleanup_threshold = CONFIG.get("queue_batch_cleanup_threshold", 10)
     cleanup_interval = CONFIG.get("queue_cleanup_interval", 30)
     heartbeat_timeout = CONFIG.get("queue_heartbeat_timeout", 90)
+    result_memory_limit = int(CONFIG.get("queue_result_memory_limit_mb", 64) * 1024 * 1024)
+    result_spill_dir = CONFIG.get("queue_result_spill_dir") or None
+    max_queue_depth = CONFIG.get("queue_max_depth", 40)
+    max_predicted_wait = CONFIG.get("queue_max_predicted_wait", 300)
     
     return RequestQueue(
         max_concurrent=max_concurrent, 
         cooldown_period=cooldown_period,
         batch_cleanup_threshold=batch_cleanup_threshold,
         cleanup_interval=cleanup_interval,
-        heartbeat_timeout=heartbeat_timeout
+        heartbeat_timeout=heartbeat_timeout,
+        result_memory_limit=result_memory_limit,
+        result_spill_dir=result_spill_dir,
+        max_queue_depth=max_queue_depth,
+        max_predicted_wait=max_predicted_wait
     )
 
 request_queue = configure_request_queue()
 
+TRACER.enabled = bool(CONFIG.get("tracing_enabled", True))
+TRACER.max_traces = CONFIG.get("tracing_max_traces", 200)
+
+RESULT_CACHE = ResultStore(max_bytes=int(CONFIG.get("result_cache_memory_limit_mb", 16) * 1024 * 1024))
+MATRIX_RESULTS = ResultStore(max_bytes=int(CONFIG.get("matrix_results_memory_limit_mb", 32) * 1024 * 1024))
+RECENT_RESULTS = ResultStore(max_bytes=int(CONFIG.get("recent_results_memory_limit_mb", 1) * 1024 * 1024))
+
+def configure_snapshot_store():
+    directory = CONFIG.get("snapshot_store_dir")
+    if not directory:
+        return None
+    return SnapshotStore(
+        directory,
+        max_segment_bytes=int(CONFIG.get("snapshot_segment_max_mb", 64) * 1024 * 1024),
+        queue_size=CONFIG.get("snapshot_queue_size", 256),
+        batch_size=CONFIG.get("snapshot_batch_size", 32)
+    )
+
+SNAPSHOTS = configure_snapshot_store()
+
+def probe_credentials(auth_token, device_key):
+    # One search on a busy corridor; only whether it raises an auth error matters. A slow
+    # upstream times out, which the cache counts as inconclusive rather than holding the worker.
+    probe_date = (datetime.now(pytz.timezone('Asia/Dhaka')) + timedelta(days=1)).strftime('%d-%b-%Y')
+    search_trips(
+        probe_date,
+        CONFIG.get("credential_probe_from", "Dhaka"),
+        CONFIG.get("credential_probe_to", "Chattogram"),
+        auth_token,
+        device_key,
+        timeout=CONFIG.get("credential_probe_timeout", 3)
+    )
+
+CREDENTIALS = CredentialCache(
+    probe_credentials,
+    ttl=CONFIG.get("credential_cache_ttl", 300),
+    invalid_ttl=CONFIG.get("credential_invalid_ttl", 3600)
+) if CONFIG.get("credential_preflight_enabled", True) else None
+
+def record_credential_outcome(auth_token, device_key, error=None):
+    # What a computation learned about the credentials, for the next pre-flight check
+    if not CREDENTIALS:
+        return
+    if error in AUTH_ERRORS:
+        CREDENTIALS.mark_invalid(auth_token, device_key, error)
+    elif error is None:
+        CREDENTIALS.mark_valid(auth_token, device_key)
+
+def publish_result(result):
+    MATRIX_RESULTS.put(result["version"], result)
+    if SNAPSHOTS:
+        # Queued for the background writer; never waits on disk
+        SNAPSHOTS.record(result)
+    RECENT_RESULTS.put(f"{result['train_model']}:{result['date']}", {"version": result["version"], "computed_at": time.time()})
+
+def get_recent_result(train_model, journey_date_str, max_age=None):
+    recent = RECENT_RESULTS.get(f"{train_model}:{journey_date_str}")
+    if not recent or (max_age is not None and time.time() - recent["computed_at"] > max_age):
+        return None, None
+    result = MATRIX_RESULTS.get(recent["version"])
+    if not result:
+        return None, None
+    return result, recent["computed_at"]
+
+def configure_rate_limiter():
+    limits = {
+        "expensive": (CONFIG.get("rate_limit_expensive_burst", 6), CONFIG.get("rate_limit_expensive_per_minute", 4)),
+        "cheap": (CONFIG.get("rate_limit_cheap_burst", 90), CONFIG.get("rate_limit_cheap_per_minute", 120))
+    }
+    store_path = CONFIG.get("rate_limit_store_path")
+    store = SqliteBucketStore(store_path) if store_path else MemoryBucketStore()
+    return RateLimiter(limits, store)
+
+rate_limiter = configure_rate_limiter()
+
+RATE_LIMITED_ENDPOINTS = {
+    'matrix': 'expensive',
+    'search_trains': 'expensive',
+    'queue_status': 'cheap',
+    'queue_heartbeat': 'cheap',
+    'matrix_view': 'cheap',
+    'api_matrix': 'cheap',
+    'api_matrix_seat_type': 'cheap',
+    'api_journey': 'cheap',
+    'api_export': 'cheap',
+    'api_history': 'cheap',
+    'api_suggest': 'cheap',
+    'watch_create': 'expensive',
+    'watch_status': 'cheap'
+}
+
 with open('trains_en.json', 'r') as f:
     trains_data = json.load(f)
     trains_full = trains_data['trains']
-    trains = [train['train_name'] for train in trains_data['trains']]
 
 with open('stations_en.json', 'r') as f:
     stations_data = json.load(f)
     stations = stations_data['stations']
 
+SUGGEST_INDEX = SuggestIndex.from_data(trains_full, stations)
+SUGGEST_MAX_LIMIT = 50
+# An empty query browses the whole list; it is one cached response, so it need not be capped as tightly
+SUGGEST_BROWSE_MAX_LIMIT = 500
+
+CORRIDOR_CACHE = CorridorCache(ttl=CONFIG.get("search_trains_cache_ttl", 21600))
+CORRIDOR_INDEX = CorridorIndex(
+    trains_full,
+    fetch_train_data,
+    snapshot_path=CONFIG.get("corridor_index_path", "corridor_index.json"),
+    refresh_interval=CONFIG.get("corridor_index_refresh_hours", 24) * 3600
+)
+
+WATCHES = WatchManager(
+    search_trips,
+    min_interval=CONFIG.get("watch_min_interval", 60),
+    max_interval=CONFIG.get("watch_max_interval", 600),
+    ttl=CONFIG.get("watch_ttl_hours", 24) * 3600,
+    max_subscriptions=CONFIG.get("watch_max_subscriptions", 1000),
+    max_segments=CONFIG.get("watch_max_segments", 20),
+    webhook_hosts=CONFIG.get("watch_webhook_hosts", ["127.0.0.1", "localhost", "::1"]),
+    store_path=CONFIG.get("watch_store_path")
+)
+
+def init_worker():
+    # Called once per worker after fork (gunicorn.conf.py post_worker_init). Nothing at import
+    # starts a thread, so a --preload master has none to lose when it forks.
+    started = time.perf_counter()
+    request_queue.start()
+    if CONFIG.get("corridor_index_enabled", True):
+        CORRIDOR_INDEX.ensure_refresher()
+    if CONFIG.get("watch_store_path"):
+        # Watches outlive a worker restart there, so one worker has to be ready to take over polling
+        WATCHES.ensure_scheduler()
+    threading.Thread(target=ASSETS.warm, daemon=True).start()
+    if TRACER.enabled and CONFIG.get("tracing_profiler_enabled", False) and not TRACER.profiler:
+        TRACER.enable_profiler(
+            interval=CONFIG.get("tracing_profiler_interval_ms", 10) / 1000,
+            keep_slowest=CONFIG.get("tracing_profiler_slowest", 5)
+        )
+    STARTUP_TIMINGS["worker_init_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"Worker {os.getpid()} initialised in {STARTUP_TIMINGS['worker_init_ms']} ms")
+
 def check_maintenance():
     if CONFIG.get("is_maintenance", 0):
         return render_template(
             'notice.html',
-            message=CONFIG.get("maintenance_message", ""),
-            styles_css=STYLES_CSS_CONTENT,
-            script_js=SCRIPT_JS_CONTENT
+            message=CONFIG.get("maintenance_message", "")
         )
     return None
 
@@ -219,11 +359,103 @@ def block_cloudflare_noise():
     if request.path.startswith('/cdn-cgi/'):
         return '', 404
 
+def get_client_ip():
+    # remote_addr is the address ProxyFix took from the trusted hops of X-Forwarded-For
+    return request.remote_addr or 'unknown'
+
+@app.before_request
+def enforce_rate_limit():
+    if not CONFIG.get("rate_limit_enabled", True):
+        return None
+    
+    bucket = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if not bucket or (bucket == 'expensive' and request.method != 'POST'):
+        return None
+    
+    auth_token = request.form.get('auth_token', '')
+    if not auth_token and request.is_json:
+        # Any JSON body gets here before the view validates it
+        data = request.get_json(silent=True)
+        auth_token = data.get('auth_token') if isinstance(data, dict) else None
+        auth_token = auth_token if isinstance(auth_token, str) else ''
+    
+    retry_after = rate_limiter.check(bucket, get_client_ip(), auth_token.strip() or None)
+    if not retry_after:
+        return None
+    
+    logger.warning(f"Rate limit exceeded - Endpoint: {request.endpoint}, Bucket: {bucket} | Retry after {retry_after}s")
+    message = f"Too many requests. Please try again in {retry_after} seconds."
+    as_json = request.endpoint != 'matrix' or wants_json_response()
+    return retry_later_response("RATE_LIMITED", message, retry_after, 429, as_json)
+
 @app.after_request
 def set_cache_headers(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    if response.cache_control.public:
+        return response
+    if ('ETag' in response.headers and response.mimetype == 'application/json') or response.status_code == 304:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    elif response.mimetype in ('text/html', 'application/json'):
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    return response
+
+@app.after_request
+def compress_response(response):
+    if not CONFIG.get("compression_enabled", True):
+        return response
+    return RESPONSE_COMPRESSOR.compress_response(response, request.headers.get('Accept-Encoding'), request.path)
+
+def stream_page(template_name, trace=None, **context):
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(64)
+    return app.response_class(stream_with_context(traced_iter(trace, "render.stream", stream)), mimetype='text/html')
+
+MATRIX_FRAGMENTS = MatrixFragmentCache(
+    app.jinja_env,
+    max_entries=CONFIG.get("matrix_fragment_cache_size", 64),
+    eager_seat_types=CONFIG.get("matrix_eager_seat_types", 1)
+)
+
+JOURNEY_SOLVER = JourneySolver(max_entries=CONFIG.get("journey_solver_cache_size", 256))
+
+def render_matrix_page(result, form_values, trace=None, **extra):
+    with TRACER.activate(trace), span("render.fragments"):
+        fragments = MATRIX_FRAGMENTS.get(result)
+    return stream_page(
+        'matrix.html',
+        trace=trace,
+        **result,
+        fragments=fragments,
+        form_values=form_values,
+        **extra
+    )
+
+def render_result_page(result, form_values, trace=None):
+    if result.get("corridor"):
+        return stream_page('matrix_corridor.html', trace=trace, **result, form_values=form_values)
+    if result.get("range"):
+        return stream_page('matrix_range.html', trace=trace, **result, form_values=form_values)
+    return render_matrix_page(result, form_values, trace=trace)
+
+@app.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    logical_path = ASSETS.resolve(filename)
+    if not logical_path:
+        abort(404)
+    
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    variant = ASSETS.variant(logical_path, encoding)
+    if variant is not None:
+        response = app.response_class(variant, mimetype=ASSETS.mimetype(logical_path))
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(app.static_folder, logical_path, max_age=31536000)
+    
+    if ASSETS.compressible(logical_path):
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     return response
 
 @app.route('/ads.txt')
@@ -265,9 +497,7 @@ def android():
         'android.html',
         message=android_message,
         app_version=app_version,
-        CONFIG=config,
-        styles_css=STYLES_CSS_CONTENT,
-        script_js=SCRIPT_JS_CONTENT
+        CONFIG=config
     )
 
 @app.route('/test-android-detection')
@@ -310,9 +540,7 @@ def admin():
     return render_template(
         'admin.html',
         app_version=app_version,
-        CONFIG=config,
-        styles_css=STYLES_CSS_CONTENT,
-        script_js=SCRIPT_JS_CONTENT
+        CONFIG=config
     )
 
 @app.route('/admin/verify', methods=['POST'])
@@ -425,12 +653,7 @@ def home():
         max_date=max_date.strftime("%Y-%m-%d"),
         bst_midnight_utc=bst_midnight_utc,
         show_disclaimer=True,
-        form_values=form_values,
-        trains=trains,
-        trains_full=trains_full,
-        stations=stations,
-        styles_css=STYLES_CSS_CONTENT,
-        script_js=SCRIPT_JS_CONTENT
+        form_values=form_values
     )
 
 @app.route('/matrix', methods=['GET', 'POST'])
@@ -442,11 +665,16 @@ def matrix():
     if request.method == 'GET':
         abort(404)
 
-    train_model_full = request.form.get('train_model', '').strip()
+    # Several train_models (from "Compare all trains") make a corridor batch for one date
+    batch_trains_full = list(dict.fromkeys(
+        name.strip() for name in request.form.getlist('train_models') if name.strip()
+    ))[:CONFIG.get("matrix_batch_max_trains", 8)]
+    train_model_full = request.form.get('train_model', '').strip() or (batch_trains_full[0] if batch_trains_full else '')
     journey_date_str = request.form.get('date', '').strip()
     
     device_type, browser = get_user_device_info()
-    logger.info(f"Train Matrix Request - Train: '{train_model_full}', Date: '{journey_date_str}' | Device: {device_type}, Browser: {browser}")
+    requested_trains = ', '.join(batch_trains_full) if len(batch_trains_full) > 1 else train_model_full
+    logger.info(f"Train Matrix Request - Train: '{requested_trains}', Date: '{journey_date_str}' | Device: {device_type}, Browser: {browser}")
 
     if not train_model_full or not journey_date_str:
         session['error'] = "Both Train Name and Journey Date are required."
@@ -459,52 +687,102 @@ def matrix():
         session['error'] = "Invalid date format. Use DD-MMM-YYYY (e.g. 15-Nov-2024)."
         return redirect(url_for('home'))
 
-    model_match = re.match(r'.*\((\d+)\)$', train_model_full)
-    if model_match:
-        train_model = model_match.group(1)
-    else:
-        train_model = train_model_full.split('(')[0].strip()
+    range_days = min(max(request.form.get('range_days', 1, type=int) or 1, 1), CONFIG.get("matrix_range_max_days", 10))
+
+    train_model = parse_train_model(train_model_full)
 
     try:
         form_values = {
             'train_model': train_model_full,
             'date': journey_date_str
         }
+        if range_days > 1:
+            form_values['range_days'] = range_days
         session['form_values'] = form_values
         session['form_submitted'] = True
 
+        if len(batch_trains_full) > 1:
+            form_values['train_models'] = batch_trains_full
+            request_func = process_corridor_request
+            params = {
+                'train_models': [parse_train_model(name) for name in batch_trains_full],
+                'journey_date_str': journey_date_str,
+                'api_date_format': api_date_format
+            }
+        elif range_days > 1:
+            # Dates past the 10-day booking window have no seats to look up
+            bst_today = datetime.now(pytz.timezone('Asia/Dhaka')).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+            booking_window_end = bst_today + timedelta(days=10)
+            request_func = process_matrix_range_request
+            params = {
+                'train_model': train_model,
+                'journey_dates': [
+                    (date_obj + timedelta(days=day)).strftime('%d-%b-%Y')
+                    for day in range(range_days)
+                    if date_obj + timedelta(days=day) <= booking_window_end
+                ] or [journey_date_str]
+            }
+        else:
+            request_func = process_matrix_request
+            params = {
+                'train_model': train_model,
+                'journey_date_str': journey_date_str,
+                'api_date_format': api_date_format
+            }
+        params.update({
+            'form_values': form_values,
+            'auth_token': request.form.get('auth_token', ''),
+            'device_key': request.form.get('device_key', '')
+        })
+
+        # Shed load before spending an upstream probe on a request that would be turned away anyway
         if CONFIG.get("queue_enabled", True):
-            request_id = request_queue.add_request(
-                process_matrix_request,
-                {
-                    'train_model': train_model,
-                    'journey_date_str': journey_date_str,
-                    'api_date_format': api_date_format,
-                    'form_values': form_values,
-                    'auth_token': request.form.get('auth_token', ''),
-                    'device_key': request.form.get('device_key', '')
-                }
-            )
+            retry_after = request_queue.check_admission()
+            if retry_after:
+                return busy_response(train_model, journey_date_str, form_values, retry_after)
+
+        if CREDENTIALS:
+            auth_error = CREDENTIALS.check(params['auth_token'], params['device_key'])
+            if auth_error:
+                logger.info(f"Matrix request rejected before queueing - Train: '{train_model}', Date: '{journey_date_str}' | {auth_error}")
+                session['error'] = auth_error
+                return redirect(url_for('home'))
+
+        if CONFIG.get("queue_enabled", True):
+            request_id, retry_after = request_queue.add_request(request_func, params)
+            if not request_id:
+                return busy_response(train_model, journey_date_str, form_values, retry_after)
+            
+            trace = TRACER.get(request_id)
+            if trace:
+                trace.attrs.update(train=train_model, date=journey_date_str, days=range_days)
             
             session['queue_request_id'] = request_id
             return redirect(url_for('queue_wait'))
         else:
-            auth_token = request.form.get('auth_token', '')
-            device_key = request.form.get('device_key', '')
-            result = process_matrix_request(train_model, journey_date_str, api_date_format, form_values, auth_token, device_key)
+            result_id = str(uuid.uuid4())
+            trace = TRACER.start(request_func.__name__, trace_id=result_id, train=train_model, date=journey_date_str, days=range_days)
+            with TRACER.activate(trace):
+                result = request_func(**params)
+            TRACER.finish(trace, "failed" if "error" in result else "completed")
             
             if "error" in result:
                 session['error'] = result["error"]
                 return redirect(url_for('home'))
             
-            result_id = str(uuid.uuid4())
-            RESULT_CACHE[result_id] = result["result"]
+            RESULT_CACHE.put(result_id, result["result"])
             session['result_id'] = result_id
             return redirect(url_for('matrix_result'))
     except Exception as e:
         session['error'] = f"{str(e)}"
         return redirect(url_for('home'))
 
+def parse_train_model(train_model_full):
+    model_match = re.match(r'.*\((\d+)\)$', train_model_full)
+    if model_match:
+        return model_match.group(1)
+    return train_model_full.split('(')[0].strip()
+
 def process_matrix_request(train_model, journey_date_str, api_date_format, form_values, auth_token, device_key):
     try:
         if not auth_token or not device_key:
@@ -514,13 +792,97 @@ def process_matrix_request(train_model, journey_date_str, api_date_format, form_
         if not result or 'stations' not in result:
             return {"error": "No data received. Please try a different train or date."}
         
+        publish_result(result)
+        record_credential_outcome(auth_token, device_key)
         return {"success": True, "result": result, "form_values": form_values}
     except Exception as e:
         error_msg = str(e)
+        record_credential_outcome(auth_token, device_key, error_msg)
         if error_msg in ["AUTH_TOKEN_EXPIRED", "AUTH_DEVICE_KEY_EXPIRED"]:
             return {"error": error_msg}
         return {"error": error_msg}
 
+def process_matrix_range_request(train_model, journey_dates, form_values, auth_token, device_key):
+    try:
+        if not auth_token or not device_key:
+            return {"error": "AUTH_CREDENTIALS_REQUIRED"}
+        
+        result = compute_matrix_range(
+            train_model,
+            journey_dates,
+            auth_token,
+            device_key,
+            max_calls_per_second=CONFIG.get("matrix_range_max_calls_per_second", 10)
+        )
+        # Each date is published on its own so that /matrix_view, /api/matrix and the
+        # degraded-mode fallback can serve it like a single-date matrix
+        for date_result in result.pop("results").values():
+            publish_result(date_result)
+        record_credential_outcome(auth_token, device_key)
+        return {"success": True, "result": result, "form_values": form_values}
+    except Exception as e:
+        record_credential_outcome(auth_token, device_key, str(e))
+        return {"error": str(e)}
+
+def process_corridor_request(train_models, journey_date_str, api_date_format, form_values, auth_token, device_key):
+    try:
+        if not auth_token or not device_key:
+            return {"error": "AUTH_CREDENTIALS_REQUIRED"}
+        
+        result = compute_corridor_matrices(
+            train_models,
+            journey_date_str,
+            api_date_format,
+            auth_token,
+            device_key,
+            max_calls_per_second=CONFIG.get("matrix_batch_max_calls_per_second", 10)
+        )
+        for train_result in result.pop("results").values():
+            publish_result(train_result)
+        
+        savings = result["savings"]
+        logger.info(f"Corridor batch - Trains: {', '.join(train_models)}, Date: '{journey_date_str}' | "
+                    f"{savings['batched_calls']} seat lookups instead of {savings['separate_calls']} ({savings['saved_percent']}% saved)")
+        record_credential_outcome(auth_token, device_key)
+        return {"success": True, "result": result, "form_values": form_values}
+    except Exception as e:
+        record_credential_outcome(auth_token, device_key, str(e))
+        return {"error": str(e)}
+
+def wants_json_response():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+def busy_response(train_model, journey_date_str, form_values, retry_after):
+    logger.warning(f"Admission rejected - Train: '{train_model}', Date: '{journey_date_str}' | Retry after {retry_after}s")
+    
+    cached_result, computed_at = get_recent_result(train_model, journey_date_str, CONFIG.get("queue_degraded_max_age", 900))
+    if cached_result:
+        if wants_json_response():
+            return jsonify({"success": True, "cached": True, "computed_at": int(computed_at), "result": encode_columnar(cached_result)})
+        
+        computed_at = datetime.fromtimestamp(computed_at, pytz.timezone('Asia/Dhaka'))
+        return render_matrix_page(
+            cached_result,
+            form_values,
+            cached_notice=f"We are handling a lot of requests right now, so this matrix was generated earlier at {computed_at.strftime('%I:%M %p')} and may be out of date. Please try again in about {retry_after} seconds for fresh availability."
+        )
+    
+    message = f"We are handling a lot of requests right now. Please try again in about {retry_after} seconds."
+    return retry_later_response("SERVER_BUSY", message, retry_after, 503, wants_json_response())
+
+def retry_later_response(error_code, message, retry_after, status_code, as_json):
+    if as_json:
+        response = jsonify({"error": error_code, "message": message, "retry_after": retry_after})
+    else:
+        response = app.make_response(render_template(
+            'notice.html',
+            message=message
+        ))
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/queue_wait')
 def queue_wait():
     maintenance_response = check_maintenance()
@@ -549,9 +911,7 @@ def queue_wait():
         'queue.html',
         request_id=request_id,
         status=status, 
-        form_values=form_values,
-        styles_css=STYLES_CSS_CONTENT,
-        script_js=SCRIPT_JS_CONTENT
+        form_values=form_values
     )
 
 @app.route('/queue_status/<request_id>')
@@ -637,13 +997,7 @@ def show_results_with_id(request_id):
     if session.get('queue_request_id') == request_id:
         session.pop('queue_request_id', None)
     
-    return render_template(
-        'matrix.html',
-        **result,
-        form_values=form_values,
-        styles_css=STYLES_CSS_CONTENT,
-        script_js=SCRIPT_JS_CONTENT
-    )
+    return render_result_page(result, form_values, trace=TRACER.get(request_id))
 
 @app.route('/matrix_result')
 def matrix_result():
@@ -658,22 +1012,328 @@ def matrix_result():
     if not result:
         return redirect(url_for('home'))
 
-    return render_template(
-        'matrix.html',
-        **result,
-        form_values=form_values,
-        styles_css=STYLES_CSS_CONTENT,
-        script_js=SCRIPT_JS_CONTENT
+    return render_result_page(result, form_values, trace=TRACER.get(result_id))
+
+@app.route('/matrix_view/<version>')
+def matrix_view(version):
+    maintenance_response = check_maintenance()
+    if maintenance_response:
+        return maintenance_response
+
+    result = MATRIX_RESULTS.get(version)
+    if not result:
+        session['error'] = "This matrix has expired. Please search again."
+        return redirect(url_for('home'))
+
+    form_values = {
+        'train_model': result['train_name'],
+        'date': result['date']
+    }
+    return render_matrix_page(result, form_values)
+
+@app.route('/api/matrix')
+@app.route('/api/matrix/<version>')
+def api_matrix(version=None):
+    if version is None:
+        train_model = request.args.get('train', '').strip()
+        journey_date_str = request.args.get('date', '').strip()
+        result, _ = get_recent_result(train_model, journey_date_str)
+    else:
+        result = MATRIX_RESULTS.get(version)
+    
+    if not result:
+        return jsonify({"error": "Matrix not found or expired"}), 404
+    
+    return etagged_json(result["version"], lambda: encode_columnar(result))
+
+@app.route('/api/matrix/<version>/<seat_type>')
+def api_matrix_seat_type(version, seat_type):
+    result = MATRIX_RESULTS.get(version)
+    if not result or seat_type not in populated_seat_types(result):
+        return jsonify({"error": "Matrix not found or expired"}), 404
+    
+    def build_payload():
+        encoded = encode_columnar(result, [seat_type])
+        return {
+            "version": version,
+            "seat_type": seat_type,
+            "layout": encoded["layout"],
+            "matrix": encoded["matrices"][seat_type],
+            "table_html": str(MATRIX_FRAGMENTS.get_table(result, seat_type))
+        }
+    
+    return etagged_json(f"{version}-{seat_type}", build_payload)
+
+@app.route('/api/export')
+@app.route('/api/export/<version>')
+def api_export(version=None):
+    export_format = request.args.get('format', 'csv').strip().lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    if version is not None:
+        versions = [version]
+    else:
+        versions = [v.strip() for value in request.args.getlist('versions') for v in value.split(',') if v.strip()]
+        # train and date may repeat: the latest matrix of every train on every date
+        for train_model in request.args.getlist('train'):
+            for journey_date_str in request.args.getlist('date'):
+                recent = RECENT_RESULTS.get(f"{train_model.strip()}:{journey_date_str.strip()}")
+                if recent:
+                    versions.append(recent["version"])
+
+    max_results = CONFIG.get("export_max_results", 50)
+    versions = list(dict.fromkeys(versions))
+    if len(versions) > max_results:
+        return jsonify({"error": f"An export can include at most {max_results} matrices"}), 400
+    available = [v for v in versions if v in MATRIX_RESULTS]
+    if not available:
+        return jsonify({"error": "Matrix not found or expired"}), 404
+
+    def results():
+        # Fetched one at a time as the download proceeds; one that expires meanwhile is left out
+        for v in available:
+            result = MATRIX_RESULTS.get(v)
+            if result:
+                yield result
+
+    chunks = export_chunks(results(), export_format, rows_per_chunk=CONFIG.get("export_rows_per_chunk", 500))
+    response = app.response_class(chunks, mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="seat-matrix-{available[0] if len(available) == 1 else len(available)}.{export_format}"'
+    response.headers['X-Export-Matrices'] = str(len(available))
+    response.headers['X-Export-Missing'] = str(len(versions) - len(available))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/watch', methods=['POST'])
+def watch_create():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    result = MATRIX_RESULTS.get(str(data.get('version', '')))
+    if not result:
+        return jsonify({"error": "Matrix not found or expired"}), 404
+    
+    station_order = {station: index for index, station in enumerate(result["stations"])}
+    segments = []
+    if not isinstance(data.get('segments') or [], list):
+        return jsonify({"error": "Each segment must be a [from, to] pair"}), 400
+    for segment in data.get('segments') or []:
+        if not isinstance(segment, (list, tuple)) or len(segment) != 2:
+            return jsonify({"error": "Each segment must be a [from, to] pair"}), 400
+        from_city, to_city = segment
+        if station_order.get(from_city, len(station_order)) >= station_order.get(to_city, -1):
+            return jsonify({"error": f"{from_city} → {to_city} is not a segment of this train"}), 400
+        segments.append((from_city, to_city))
+    
+    seat_types = data.get('seat_types') or populated_seat_types(result) or SEAT_TYPES
+    if any(seat_type not in SEAT_TYPES for seat_type in seat_types):
+        return jsonify({"error": "Unknown seat type"}), 400
+    
+    # Watching stops at the end of the journey date (Bangladesh time)
+    journey_end = pytz.timezone('Asia/Dhaka').localize(datetime.strptime(result["date"], '%d-%b-%Y') + timedelta(days=1))
+    try:
+        subscription = WATCHES.subscribe(
+            result["train_model"],
+            result["date"],
+            {segment: pair_lookup(result["station_dates"], *segment) for segment in dict.fromkeys(segments)},
+            seat_types,
+            {
+                (from_city, to_city): {
+                    seat_type: cell["online"] + cell["offline"]
+                    for seat_type in seat_types
+                    for cell in [result["fare_matrices"][seat_type][from_city][to_city]]
+                }
+                for from_city, to_city in segments
+            },
+            str(data.get('auth_token', '')).strip(),
+            str(data.get('device_key', '')).strip(),
+            webhook_url=data.get('webhook_url') or None,
+            expires_at=journey_end.timestamp()
+        )
+    except Exception as e:
+        error_msg = str(e)
+        return jsonify({"error": error_msg}), 401 if error_msg == "AUTH_CREDENTIALS_REQUIRED" else 400
+    
+    logger.info(f"Watch created - Train: '{result['train_model']}', Date: '{result['date']}', Segments: {len(segments)}")
+    return jsonify({
+        **subscription.describe(),
+        "status_url": url_for('watch_status', subscription_id=subscription.id),
+        "events_url": url_for('watch_events', subscription_id=subscription.id)
+    }), 201
+
+@app.route('/watch/<subscription_id>', methods=['GET', 'DELETE'])
+def watch_status(subscription_id):
+    if request.method == 'DELETE':
+        if not WATCHES.unsubscribe(subscription_id):
+            return jsonify({"error": "Watch not found or expired"}), 404
+        return jsonify({"success": True})
+    
+    subscription = WATCHES.get(subscription_id)
+    if not subscription:
+        return jsonify({"error": "Watch not found or expired"}), 404
+    return jsonify(subscription.describe())
+
+@app.route('/watch/<subscription_id>/events')
+def watch_events(subscription_id):
+    if not WATCHES.get(subscription_id):
+        return jsonify({"error": "Watch not found or expired"}), 404
+    
+    last_event_id = request.headers.get('Last-Event-ID', 0, type=int)
+    # A sync worker held by a stream serves nobody else, so there the stream is a short poll:
+    # pending events are sent at once and EventSource reconnects after the retry delay
+    stream_seconds = CONFIG.get("watch_stream_seconds", 300) if get_worker_mode() != 'sync' else 0
+    retry_ms = 5000 if stream_seconds else CONFIG.get("watch_poll_retry_ms", 10000)
+    
+    def stream(last_event_id):
+        # EventSource reconnects with Last-Event-ID and picks up where it left off
+        deadline = time.monotonic() + stream_seconds
+        yield f"retry: {retry_ms}\n\n"
+        if not stream_seconds:
+            events, _ = WATCHES.wait_events(subscription_id, last_event_id, timeout=0)
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            return
+        while time.monotonic() < deadline:
+            timeout = min(15, deadline - time.monotonic())
+            events, still_open = WATCHES.wait_events(subscription_id, last_event_id, timeout=max(timeout, 0))
+            for event in events:
+                last_event_id = event["id"]
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            if not still_open:
+                return
+            if not events:
+                yield ": keepalive\n\n"
+    
+    response = app.response_class(stream_with_context(stream(last_event_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/journey/<version>')
+def api_journey(version):
+    result = MATRIX_RESULTS.get(version)
+    if not result:
+        return jsonify({"error": "Matrix not found or expired"}), 404
+    
+    origin = request.args.get('from', '').strip()
+    destination = request.args.get('to', '').strip()
+    seat_types = [seat_type for seat_type in request.args.get('seat_types', '').split(',') if seat_type]
+    try:
+        answer = JOURNEY_SOLVER.solve(result, origin, destination, seat_types or None)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    
+    etag = hashlib.sha256(json.dumps([version, origin, destination, answer["seat_types"]]).encode("utf-8")).hexdigest()[:20]
+    return etagged_json(etag, lambda: answer)
+
+@app.route('/api/history')
+def api_history():
+    if not SNAPSHOTS:
+        return jsonify({"error": "Snapshot history is not enabled"}), 404
+    
+    train_model = request.args.get('train', '').strip()
+    from_city = request.args.get('from', '').strip()
+    to_city = request.args.get('to', '').strip()
+    if not train_model or not from_city or not to_city:
+        return jsonify({"error": "train, from and to are required"}), 400
+    try:
+        days = min(float(request.args.get('days', 10)), CONFIG.get("snapshot_history_max_days", 60))
+    except ValueError:
+        return jsonify({"error": "days must be a number"}), 400
+    
+    points = SNAPSHOTS.curve(
+        train_model, from_city, to_city,
+        seat_type=request.args.get('seat_type', '').strip() or None,
+        journey_date=request.args.get('date', '').strip() or None,
+        since=time.time() - days * 86400
     )
+    return jsonify({"train_model": train_model, "from": from_city, "to": to_city, "days": days, "points": points})
+
+@app.route('/api/suggest')
+def api_suggest():
+    kind = request.args.get('kind') or None
+    if kind not in (None, 'train', 'station'):
+        return jsonify({"error": "kind must be train or station"}), 400
+    
+    query = request.args.get('q', '')
+    max_limit = SUGGEST_MAX_LIMIT if query.strip() else SUGGEST_BROWSE_MAX_LIMIT
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), max_limit)
+    except ValueError:
+        limit = 10
+    
+    exclude = request.args.get('exclude') or None
+    
+    response = etagged_json(SUGGEST_INDEX.version, lambda: {
+        "query": query,
+        "kind": kind,
+        "results": SUGGEST_INDEX.suggest(query, kind, limit, exclude)
+    })
+    response.cache_control.public = True
+    response.cache_control.max_age = CONFIG.get("suggest_cache_max_age", 3600)
+    return response
+
+def etagged_json(etag, build_payload):
+    # Weak, since the same payload is sent as identity, gzip or br bodies
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag, weak=True)
+    return response
+
+def get_worker_mode():
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            return 'gevent'
+    except ImportError:
+        pass
+    return 'sync'
 
 @app.route('/queue_stats')
 def queue_stats():
     try:
         stats = request_queue.get_queue_stats()
+        stats["rate_limiter"] = rate_limiter.get_stats()
+        stats["matrix_fragments"] = MATRIX_FRAGMENTS.stats()
+        stats["journey_solver"] = JOURNEY_SOLVER.stats()
+        stats["suggest_index"] = SUGGEST_INDEX.stats()
+        stats["search_trains"] = CORRIDOR_CACHE.stats()
+        stats["corridor_index"] = CORRIDOR_INDEX.stats()
+        stats["worker_mode"] = get_worker_mode()
+        stats["startup"] = STARTUP_TIMINGS
+        stats["tracing"] = TRACER.stats()
+        stats["upstream"] = upstream_stats()
+        stats["watch"] = WATCHES.stats()
+        if SNAPSHOTS:
+            stats["snapshots"] = SNAPSHOTS.stats()
+        if CREDENTIALS:
+            stats["credentials"] = CREDENTIALS.stats()
         return jsonify(stats)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/debug/traces')
+def debug_traces():
+    if not session.get('isAdmin', False):
+        abort(403)
+    
+    trace_id = request.args.get('id')
+    if trace_id:
+        trace = TRACER.get(trace_id)
+        if not trace:
+            return jsonify({"error": "Trace not found or evicted"}), 404
+        return jsonify(trace.to_dict())
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), TRACER.max_traces)
+    if request.args.get('slowest'):
+        traces = TRACER.slowest(limit)
+    else:
+        traces = TRACER.recent(limit)
+    return jsonify({"traces": traces, "stats": TRACER.stats()})
+
 @app.route('/queue_cleanup', methods=['POST'])
 def queue_cleanup():
     try:
@@ -705,10 +1365,6 @@ def search_trains():
         if not origin or not destination:
             return jsonify({"error": "Both origin and destination are required"}), 400
         
-        if not auth_token or not device_key:
-            return jsonify({"error": "AUTH_CREDENTIALS_REQUIRED"}), 401
-    
-        
         today = datetime.now()
         date1 = today + timedelta(days=8)
         date2 = today + timedelta(days=9)
@@ -716,25 +1372,74 @@ def search_trains():
         date1_str = date1.strftime('%d-%b-%Y')
         date2_str = date2.strftime('%d-%b-%Y')
         
-        trains_day1 = fetch_trains_for_date(origin, destination, date1_str, auth_token, device_key)
-        trains_day2 = fetch_trains_for_date(origin, destination, date2_str, auth_token, device_key)
+        started = time.perf_counter()
+        cached = CORRIDOR_CACHE.get(origin, destination, [date1_str, date2_str])
+        if cached:
+            CORRIDOR_CACHE.record(True, time.perf_counter() - started)
+            logger.info(f"Train Search served from cache - From: '{origin}', To: '{destination}'")
+            return jsonify({
+                "success": True,
+                "trains": cached["trains"],
+                "dates": cached["dates"],
+                "source": "cache"
+            })
+        
+        if CONFIG.get("corridor_index_enabled", True):
+            CORRIDOR_INDEX.ensure_refresher()
+            indexed_trains = CORRIDOR_INDEX.query(origin, destination, [date1, date2])
+            if indexed_trains:
+                CORRIDOR_CACHE.record(False, time.perf_counter() - started)
+                CORRIDOR_CACHE.put(origin, destination, indexed_trains, [date1_str, date2_str])
+                logger.info(f"Train Search answered from corridor index - From: '{origin}', To: '{destination}', Trains: {len(indexed_trains)}")
+                return jsonify({
+                    "success": True,
+                    "trains": indexed_trains,
+                    "dates": [date1_str, date2_str],
+                    "source": "index"
+                })
+        
+        if not auth_token or not device_key:
+            return jsonify({"error": "AUTH_CREDENTIALS_REQUIRED"}), 401
+        
+        # The live search costs no more than a probe, so only credentials already known to be expired are turned away
+        auth_error = CREDENTIALS.check(auth_token, device_key, probe=False, queued=False) if CREDENTIALS else None
+        if auth_error:
+            return jsonify({"error": auth_error}), 401
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_day1 = executor.submit(fetch_trains_for_date, origin, destination, date1_str, auth_token, device_key)
+            future_day2 = executor.submit(fetch_trains_for_date, origin, destination, date2_str, auth_token, device_key)
+            trains_day1 = future_day1.result()
+            trains_day2 = future_day2.result()
         
         common_trains = get_common_trains(trains_day1, trains_day2)
+        if CREDENTIALS:
+            CREDENTIALS.mark_valid(auth_token, device_key)
+        
+        elapsed = time.perf_counter() - started
+        CORRIDOR_CACHE.record(False, elapsed)
+        logger.info(f"Train Search fetched in {elapsed * 1000:.0f} ms - From: '{origin}', To: '{destination}', Trains: {len(common_trains)}")
+        
+        if common_trains:
+            CORRIDOR_CACHE.put(origin, destination, common_trains, [date1_str, date2_str])
         
         return jsonify({
             "success": True,
             "trains": common_trains,
-            "dates": [date1_str, date2_str]
+            "dates": [date1_str, date2_str],
+            "source": "live"
         })
         
     except Exception as e:
         error_msg = str(e)
         if error_msg in ["AUTH_TOKEN_EXPIRED", "AUTH_DEVICE_KEY_EXPIRED"]:
+            if CREDENTIALS:
+                CREDENTIALS.mark_invalid(auth_token, device_key, error_msg, queued=False)
             return jsonify({"error": error_msg}), 401
         return jsonify({"error": error_msg}), 500
 
 def fetch_trains_for_date(origin, destination, date_str, auth_token, device_key):
-    url = "https://railspaapi.shohoz.com/v1.0/web/bookings/search-trips-v2"
+    url = api_url("bookings/search-trips-v2")
     params = {
         'from_city': origin,
         'to_city': destination,
@@ -751,7 +1456,7 @@ def fetch_trains_for_date(origin, destination, date_str, auth_token, device_key)
     
     while retry_count < max_retries:
         try:
-            response = requests.get(url, headers=headers, params=params, timeout=10)
+            response = upstream_get(url, headers=headers, params=params, timeout=10)
             
             if response.status_code == 429:
                 try:
@@ -897,9 +1602,13 @@ def page_not_found(e):
     maintenance_response = check_maintenance()
     if maintenance_response:
         return maintenance_response
-    return render_template('404.html', styles_css=STYLES_CSS_CONTENT, script_js=SCRIPT_JS_CONTENT), 404
+    return render_template('404.html'), 404
+
+STARTUP_TIMINGS = {"app_init_ms": round((time.perf_counter() - APP_INIT_STARTED) * 1000, 1), "worker_init_ms": None}
+logger.info(f"App module initialised in {STARTUP_TIMINGS['app_init_ms']} ms")
 
 if __name__ == "__main__":
+    init_worker()
     app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=False)
 else:
     if not app.debug:
@@ -0,0 +1,104 @@
+import argparse, json, os, statistics, sys, threading, time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_upstream import start_server, add_upstream_arguments, upstream_options
+
+def submit(app_module, client, train_name, journey_date, auth_token, timeout):
+    # -> (outcome, seconds until the user saw it)
+    start = time.perf_counter()
+    response = client.post("/matrix", data={
+        "train_model": train_name,
+        "date": journey_date,
+        "auth_token": auth_token,
+        "device_key": "bench-device"
+    })
+    if not response.headers.get("Location", "").endswith("/queue_wait"):
+        with client.session_transaction() as session:
+            return ("rejected_early" if session.get("error", "").startswith("AUTH_") else "other"), time.perf_counter() - start
+
+    with client.session_transaction() as session:
+        request_id = session["queue_request_id"]
+    queue = app_module.request_queue
+    while time.perf_counter() - start < timeout:
+        queue.update_heartbeat(request_id)
+        status = queue.get_request_status(request_id) or {}
+        if status.get("status") in ("completed", "failed"):
+            result = queue.get_request_result(request_id) or {}
+            error = result.get("error", "")
+            return ("queued_auth_failure" if error.startswith("AUTH_") else "queued_" + ("failure" if error else "ok")), time.perf_counter() - start
+        time.sleep(0.02)
+    return "timeout", time.perf_counter() - start
+
+def run(app_module, server, users, args, preflight):
+    app_module.CREDENTIALS = app_module.CredentialCache(app_module.probe_credentials) if preflight else None
+    server.reset_stats()
+    outcomes = []
+    lock = threading.Lock()
+    journey_date = (datetime.now() + timedelta(days=2)).strftime("%d-%b-%Y")
+    train_names = server.train_names()
+
+    def user(index, auth_token):
+        client = app_module.app.test_client()
+        for attempt in range(args.attempts):
+            outcome, seconds = submit(app_module, client, train_names[index % len(train_names)], journey_date, auth_token, args.timeout)
+            with lock:
+                outcomes.append((auth_token.startswith("expired"), outcome, seconds))
+
+    threads = [threading.Thread(target=user, args=(index, token)) for index, token in enumerate(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes, time.perf_counter() - start, server.call_stats()["total"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Matrix submissions with a share of expired credentials, with and without the pre-flight check")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--expired-share", type=float, default=0.3)
+    parser.add_argument("--attempts", type=int, default=2, help="Submissions per user with the same credentials")
+    parser.add_argument("--timeout", type=float, default=120)
+    add_upstream_arguments(parser, latency_ms=30)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, **upstream_options(args))
+    os.environ["HARNESS_CONFIG"] = json.dumps({"queue_enabled": True, "queue_cooldown_period": 0, "queue_max_concurrent": 2,
+                                               "queue_max_depth": 0, "queue_max_predicted_wait": 0})
+    import upstream
+    upstream.API_BASE_URL = base_url.rstrip('/')
+    import harness_app
+    app_module = harness_app.app_module
+
+    expired_users = round(args.users * args.expired_share)
+    users = [f"expired-{i}" if i < expired_users else f"valid-{i}" for i in range(args.users)]
+    print(f"{args.users} users ({expired_users} with expired tokens), {args.attempts} submissions each, "
+          f"queue of 2 concurrent, upstream latency {args.latency_ms:g} ms")
+    print(f"\n  {'':12s} {'queue slots':>11s} {'wasted':>7s} {'rejected early':>15s} {'expired: error after':>21s} {'upstream calls':>15s} {'wall s':>7s}")
+
+    failures = []
+    for label, preflight in (("no check", False), ("pre-flight", True)):
+        outcomes, wall, calls = run(app_module, server, users, args, preflight)
+        queued = [o for o in outcomes if o[1].startswith("queued")]
+        wasted = sum(1 for o in outcomes if o[1] == "queued_auth_failure")
+        early = sum(1 for o in outcomes if o[1] == "rejected_early")
+        expired_seconds = [seconds for expired, _, seconds in outcomes if expired]
+        print(f"  {label:12s} {len(queued):11d} {wasted:7d} {early:15d} {statistics.median(expired_seconds) * 1000:17.0f} ms "
+              f"{calls:15d} {wall:7.1f}")
+        if preflight:
+            print(f"\n  credential cache: {json.dumps(app_module.CREDENTIALS.stats())}")
+            if wasted:
+                failures.append(f"{wasted} queue slots still went to expired credentials")
+        if any(o[1] in ("timeout", "other", "queued_failure") for o in outcomes if not o[0]):
+            failures.append(f"{label}: valid users did not all get their matrix")
+
+    server.shutdown()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
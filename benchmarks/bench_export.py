@@ -0,0 +1,70 @@
+import argparse, csv, io, os, sys, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import make_result
+from matrix_export import EXPORT_COLUMNS, export_chunks, export_rows
+
+def buffered_csv(results):
+    # Building the whole file before sending it, as a plain Response(body) would
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([row for result in results for row in export_rows(result)])
+    return output.getvalue()
+
+def measure(func):
+    # Peak memory allocated while producing the export, on top of the results themselves
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_chunk, size = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, first_chunk, peak
+
+def streamed(results, export_format):
+    def run():
+        start = time.perf_counter()
+        first_chunk, size = None, 0
+        for chunk in export_chunks(results, export_format):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            size += len(chunk)
+        return first_chunk, size
+    return run
+
+def buffered(results):
+    def run():
+        start = time.perf_counter()
+        body = buffered_csv(results)
+        return time.perf_counter() - start, len(body)
+    return run
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamed vs buffered matrix export: time to first byte and peak memory")
+    parser.add_argument("--stations", type=int, nargs="+", default=[20, 60, 120])
+    parser.add_argument("--dates", type=int, default=4, help="Matrices per batch export")
+    args = parser.parse_args()
+
+    print(f"{'stations':>8s} {'rows':>9s} {'mode':>14s} {'size MB':>8s} {'total ms':>9s} {'first chunk ms':>15s} {'peak KB':>9s}")
+    peaks = []
+    for n_stations in args.stations:
+        results = [make_result(n_stations, seed=day) for day in range(args.dates)]
+        rows = sum(1 for result in results for _ in export_rows(result))
+        for label, func in (("csv stream", streamed(results, "csv")), ("ndjson stream", streamed(results, "ndjson")),
+                            ("csv buffered", buffered(results))):
+            size, elapsed, first_chunk, peak = measure(func)
+            if label == "csv stream":
+                peaks.append(peak)
+            print(f"{n_stations:8d} {rows:9d} {label:>14s} {size / 1e6:8.2f} {elapsed * 1000:9.1f} "
+                  f"{first_chunk * 1000:15.2f} {peak / 1024:9.0f}")
+
+    # The streamed peak should not grow with the size of the export
+    if max(peaks) > min(peaks) * 2 + 64 * 1024:
+        print("FAIL: streamed export memory grew with the matrix size")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse, os, random, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import make_result
+from matrix_codec import populated_seat_types
+from journey_solver import JourneySolver, BOOKING_CHARGE, leg_tables, solve
+
+def sell_out(result, share, seed):
+    # Empties a share of the cells so that most journeys need a split or a change of class
+    rng = random.Random(seed)
+    for matrix in result["fare_matrices"].values():
+        for row in matrix.values():
+            for cell in row.values():
+                if rng.random() < share:
+                    cell["online"] = 0
+    return result
+
+def browser_search(origin, destination, stations, fare_matrices, seat_types):
+    # Port of findRoutes / findMixedRoutes from matrix.html: breadth-first, so the first
+    # itinerary found has the fewest legs, with the path copied on every push
+    queue = [(origin, [], 0)]
+    visited = set()
+    while queue:
+        current, path, total = queue.pop(0)
+        if current in visited:
+            continue
+        visited.add(current)
+        if current == destination:
+            return path, total
+        for next_station in stations[stations.index(current) + 1:]:
+            for seat_type in seat_types:
+                cell = fare_matrices[seat_type][current].get(next_station)
+                if cell and cell["online"] > 0:
+                    cost = cell["fare"] + cell["vat_amount"] + BOOKING_CHARGE
+                    queue.append((next_station, path + [(current, next_station, seat_type)], total + cost))
+                    break
+    return None
+
+def timed(func):
+    start = time.perf_counter()
+    value = func()
+    return value, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Split-journey DP vs the browser's breadth-first search, over every origin/destination pair")
+    parser.add_argument("--stations", type=int, nargs="+", default=[40, 60])
+    parser.add_argument("--sold-out", type=float, default=0.9, help="Share of cells with no online seats")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    worse = 0
+    for n_stations in args.stations:
+        result = sell_out(make_result(n_stations, seed=args.seed), args.sold_out, args.seed)
+        stations = result["stations"]
+        seat_types = populated_seat_types(result)
+        pairs = [(origin, destination) for i, origin in enumerate(stations) for destination in stations[i + 1:]]
+
+        def run_browser():
+            answers = {}
+            for origin, destination in pairs:
+                per_type = [browser_search(origin, destination, stations, result["fare_matrices"], [seat_type]) for seat_type in seat_types]
+                answers[(origin, destination)] = (per_type, browser_search(origin, destination, stations, result["fare_matrices"], seat_types))
+            return answers
+
+        def run_dp():
+            tables = leg_tables(result, seat_types)
+            index = {station: i for i, station in enumerate(stations)}
+            return {
+                (origin, destination): solve(tables, seat_types, index[origin], index[destination])
+                for origin, destination in pairs
+            }
+
+        solver = JourneySolver(max_entries=len(pairs))
+        browser, browser_seconds = timed(run_browser)
+        _, dp_seconds = timed(run_dp)
+        answers, cold_seconds = timed(lambda: {pair: solver.solve(result, *pair) for pair in pairs})
+        _, warm_seconds = timed(lambda: [solver.solve(result, *pair) for pair in pairs])
+
+        found = cheaper = 0
+        savings = []
+        for pair in pairs:
+            mixed = answers[pair]["mixed"]["cheapest"]
+            bfs = browser[pair][1]
+            if bfs is None:
+                continue
+            found += 1
+            if mixed["total"] > bfs[1] + 0.01:
+                worse += 1
+            elif mixed["total"] < bfs[1] - 0.01:
+                cheaper += 1
+                savings.append(bfs[1] - mixed["total"])
+
+        print(f"\n{n_stations} stations, {len(pairs)} origin/destination pairs, {len(seat_types)} seat types, "
+              f"{args.sold_out:.0%} of cells sold out")
+        print(f"  browser BFS (per seat type + mixed)  {browser_seconds * 1000:9.1f} ms  {browser_seconds / len(pairs) * 1e6:8.1f} us/pair")
+        print(f"  DP, mixed (3 objectives)             {dp_seconds * 1000:9.1f} ms  {dp_seconds / len(pairs) * 1e6:8.1f} us/pair")
+        print(f"  JourneySolver, cold (all objectives) {cold_seconds * 1000:9.1f} ms  {cold_seconds / len(pairs) * 1e6:8.1f} us/pair")
+        print(f"  JourneySolver, memoised              {warm_seconds * 1000:9.1f} ms  {warm_seconds / len(pairs) * 1e6:8.1f} us/pair")
+        if savings:
+            print(f"  mixed itineraries: DP cheaper on {cheaper} of {found} pairs, "
+                  f"saving {statistics.mean(savings):.0f} BDT on average (max {max(savings):.0f})")
+
+    if worse:
+        print(f"FAIL: {worse} DP itineraries cost more than the breadth-first ones")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
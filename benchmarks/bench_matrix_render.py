@@ -0,0 +1,41 @@
+import argparse, os, sys, time, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from synthetic import make_result
+import app as app_module
+
+def render_once(result):
+    with app_module.app.test_request_context('/show_results/bench'):
+        response = app_module.render_matrix_page(result, {"train_model": result["train_name"], "date": result["date"]})
+        return sum(len(chunk) for chunk in response.response)
+
+def measure(result, iterations, clear_cache):
+    timings = []
+    size = 0
+    for _ in range(iterations):
+        if clear_cache:
+            app_module.MATRIX_FRAGMENTS.clear()
+        start = time.perf_counter()
+        size = render_once(result)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, size
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark matrix.html rendering per request")
+    parser.add_argument("--stations", type=int, default=40)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    result = make_result(args.stations)
+    render_once(result)
+
+    for label, clear_cache in (("uncached (every request renders tables)", True), ("cached fragments", False)):
+        timings, size = measure(result, args.iterations, clear_cache)
+        print(f"{label:42s} median {statistics.median(timings):8.2f} ms  "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:8.2f} ms  html {size / 1024:.0f} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse, contextlib, heapq, io, math, os, random, statistics, sys, threading, time, tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from request_queue import RequestQueue
+
+class VirtualClock:
+    def __init__(self, start=1_700_000_000.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+class TimedLock:
+    # Drop-in for RequestQueue.lock that records how long callers wait for it and hold it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquired_at = 0.0
+        self.waits = []
+        self.holds = []
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = time.perf_counter()
+            self.waits.append(self.acquired_at - start)
+        return acquired
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+def stub_request(clock, service_time):
+    # Stands in for process_matrix_request: takes service_time of virtual time
+    clock.sleep(service_time)
+    return {"success": True, "result": {"stations": []}}
+
+def percentile(ordered, fraction):
+    return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)]
+
+def describe(samples):
+    ordered = sorted(samples)
+    return (len(ordered), statistics.fmean(ordered) * 1e6, percentile(ordered, 0.5) * 1e6,
+            percentile(ordered, 0.99) * 1e6, ordered[-1] * 1e6)
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"  {'':24s} {'count':>9s} {'mean us':>9s} {'p50 us':>9s} {'p99 us':>9s} {'max us':>10s}")
+    for name, samples in rows:
+        if samples:
+            count, mean, p50, p99, peak = describe(samples)
+            print(f"  {name:24s} {count:9d} {mean:9.1f} {p50:9.1f} {p99:9.1f} {peak:10.1f}")
+
+def simulate(args):
+    # Single-threaded discrete-event run on virtual time: arrivals, polls with heartbeats,
+    # explicit cancels, silent abandonment (left to heartbeat expiry) and the worker.
+    rng = random.Random(args.seed)
+    clock = VirtualClock()
+    queue = RequestQueue(cooldown_period=args.cooldown, cleanup_interval=args.cleanup_interval,
+                         heartbeat_timeout=args.heartbeat_timeout, max_queue_depth=0, max_predicted_wait=0,
+                         clock=clock.time, sleep=clock.sleep, autostart=False)
+    queue.lock = TimedLock()
+    timings = defaultdict(list)
+
+    def timed(name, func, *func_args):
+        start = time.perf_counter()
+        value = func(*func_args)
+        timings[name].append(time.perf_counter() - start)
+        return value
+
+    events = []
+    sequence = 0
+
+    def schedule(at, kind, client=None):
+        nonlocal sequence
+        sequence += 1
+        heapq.heappush(events, (at, sequence, kind, client))
+
+    arrival = clock.now
+    for client in range(args.requests):
+        arrival += rng.expovariate(args.arrival_rate)
+        schedule(arrival, "arrive", client)
+    schedule(clock.now, "worker")
+    schedule(clock.now + args.cleanup_interval, "cleanup")
+
+    clients = {}
+    outcomes = defaultdict(int)
+    waits = []
+    peak_depth = 0
+    arrivals_left = args.requests
+
+    while events:
+        at, _, kind, client = heapq.heappop(events)
+        clock.now = max(clock.now, at)
+
+        if kind == "arrive":
+            arrivals_left -= 1
+            request_id, _ = timed("add_request", queue.add_request, stub_request, {"clock": clock, "service_time": args.service_time})
+            clients[client] = (request_id, clock.now, rng.expovariate(1 / args.patience))
+            peak_depth = max(peak_depth, len(queue.queue))
+            schedule(clock.now + rng.uniform(0, args.poll_interval), "poll", client)
+
+        elif kind == "poll":
+            request_id, arrived, patience = clients[client]
+            if clock.now - arrived > patience:
+                if rng.random() < args.cancel_share:
+                    timed("cancel_request", queue.cancel_request, request_id)
+                    outcomes["cancelled"] += 1
+                else:
+                    outcomes["went_silent"] += 1
+                del clients[client]
+                continue
+            timed("update_heartbeat", queue.update_heartbeat, request_id)
+            status = timed("get_request_status", queue.get_request_status, request_id)
+            if status is None:
+                outcomes["lost"] += 1
+                del clients[client]
+            elif status["status"] in ("completed", "failed"):
+                timed("get_request_result", queue.get_request_result, request_id)
+                outcomes[status["status"]] += 1
+                waits.append(clock.now - arrived)
+                del clients[client]
+            else:
+                schedule(clock.now + args.poll_interval, "poll", client)
+
+        elif kind == "worker":
+            if timed("process_batch", queue.process_batch):
+                schedule(clock.now, "worker")
+            elif arrivals_left or clients or queue.queue:
+                # Idle: the real worker sleeps a second and expires old results
+                timed("cleanup_old_entries", queue._cleanup_old_entries)
+                schedule(clock.now + 1, "worker")
+
+        elif kind == "cleanup":
+            timed("enhanced_cleanup", queue._enhanced_cleanup)
+            with queue.lock:
+                if queue.cancelled_requests:
+                    timed("batch_remove_cancelled", queue._batch_remove_cancelled)
+            if arrivals_left or clients or queue.queue:
+                schedule(clock.now + args.cleanup_interval, "cleanup")
+
+    # Everything left should expire: unanswered heartbeats and uncollected results
+    clock.sleep(max(args.heartbeat_timeout, queue.result_ttl) + 1)
+    queue.force_cleanup()
+    return queue, timings, outcomes, waits, peak_depth, clock
+
+def contention(args):
+    # Real threads on the real clock: pollers hammer status and heartbeats while the worker drains
+    queue = RequestQueue(cooldown_period=0, max_queue_depth=0, max_predicted_wait=0, autostart=False)
+    queue.lock = TimedLock()
+    request_ids = [queue.add_request(lambda: {"success": True}, {})[0] for _ in range(args.contention_waiters)]
+    queue.lock.waits.clear()
+    queue.lock.holds.clear()
+    poll_latencies = []
+    stop = threading.Event()
+
+    def poller(seed):
+        rng = random.Random(seed)
+        latencies = []
+        while not stop.is_set():
+            request_id = rng.choice(request_ids)
+            start = time.perf_counter()
+            queue.update_heartbeat(request_id)
+            queue.get_request_status(request_id)
+            latencies.append(time.perf_counter() - start)
+            # Lock hand-off is not fair: without a yield the pollers can keep the worker out indefinitely
+            time.sleep(0)
+        poll_latencies.extend(latencies)
+
+    processed = [0]
+
+    def worker():
+        while not stop.is_set() and queue.process_batch():
+            processed[0] += 1
+            # Refill so the queue stays at the same depth for the whole run
+            request_ids.append(queue.add_request(lambda: {"success": True}, {})[0])
+
+    threads = [threading.Thread(target=poller, args=(seed,), daemon=True) for seed in range(args.pollers)]
+    threads.append(threading.Thread(target=worker, daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    # The deadline is kept here, on the wall clock, however long a process_batch() call takes
+    threads[-1].join(args.contention_seconds)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    if any(thread.is_alive() for thread in threads):
+        print("WARNING: contention threads still running after the deadline")
+    processed = processed[0]
+    return queue, poll_latencies, processed, elapsed
+
+def measure_memory(args):
+    queue = RequestQueue(max_queue_depth=0, max_predicted_wait=0, autostart=False)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(args.requests):
+        queue.add_request(stub_request, {"clock": None, "service_time": 0})
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queued_bytes = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return queued_bytes, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress RequestQueue on a virtual clock with a stub request function")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--arrival-rate", type=float, default=20, help="Arrivals per virtual second (Poisson)")
+    parser.add_argument("--service-time", type=float, default=0.1, help="Virtual seconds per matrix")
+    parser.add_argument("--cooldown", type=float, default=0.05)
+    parser.add_argument("--poll-interval", type=float, default=2, help="Seconds between client polls, as in queue.html")
+    parser.add_argument("--patience", type=float, default=60, help="Mean seconds a client waits before abandoning")
+    parser.add_argument("--cancel-share", type=float, default=0.5, help="Share of abandoners that cancel; the rest go silent")
+    parser.add_argument("--heartbeat-timeout", type=float, default=90)
+    parser.add_argument("--cleanup-interval", type=float, default=30)
+    parser.add_argument("--pollers", type=int, default=8)
+    parser.add_argument("--contention-waiters", type=int, default=2000)
+    parser.add_argument("--contention-seconds", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    wall_start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        queue, timings, outcomes, waits, peak_depth, clock = simulate(args)
+    wall = time.perf_counter() - wall_start
+
+    stats = queue.get_queue_stats()
+    print(f"{args.requests} requests at {args.arrival_rate}/s, service {args.service_time}s + cooldown {args.cooldown}s, "
+          f"polls every {args.poll_interval}s, mean patience {args.patience}s")
+    print(f"simulated {clock.now - 1_700_000_000.0:.0f} virtual s in {wall:.2f} s wall, peak queue depth {peak_depth}")
+    print(f"outcomes: {dict(outcomes)}")
+    if waits:
+        ordered = sorted(waits)
+        print(f"wait for completed requests: p50 {percentile(ordered, 0.5):.1f}s  p99 {percentile(ordered, 0.99):.1f}s")
+    print(f"left behind after expiry: {stats['tracked_requests']} tracked, {stats['queue_size']} queued, "
+          f"{stats['pending_deadlines']} deadlines, {stats['result_store']['memory_entries']} results")
+    print_table("operation latency (virtual-time run)", sorted(timings.items()))
+    print_table("lock (virtual-time run)", [("wait", queue.lock.waits), ("hold", queue.lock.holds)])
+
+    queue, poll_latencies, processed, elapsed = contention(args)
+    print(f"\ncontention: {args.pollers} poller threads vs worker over {args.contention_waiters} waiters, "
+          f"{processed / elapsed:.0f} processed/s over {elapsed:.2f} s")
+    print_table("contended operations", [("heartbeat + status", poll_latencies),
+                                         ("lock wait", queue.lock.waits), ("lock hold", queue.lock.holds)])
+
+    queued_bytes, peak = measure_memory(args)
+    print(f"\nmemory: {queued_bytes / args.requests:.0f} bytes per queued request "
+          f"({queued_bytes / 1024 / 1024:.1f} MiB for {args.requests}), tracemalloc peak {peak / 1024 / 1024:.1f} MiB")
+
+    if stats["tracked_requests"] or stats["queue_size"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
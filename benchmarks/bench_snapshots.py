@@ -0,0 +1,123 @@
+import argparse, gzip, json, os, shutil, statistics, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import make_result, next_dates
+from matrix_codec import populated_seat_types
+from snapshot_store import SnapshotStore, HEADER, CELL, INDEX_NAME, SEGMENT_NAME
+
+def make_snapshots(args):
+    # Every train on every date, fetched a few times a day over the last N days
+    now = time.time()
+    dates = next_dates("20-Oct-2026", args.dates)
+    snapshots = []
+    for fetch in range(args.fetches):
+        fetched_at = now - args.days * 86400 * (1 - fetch / args.fetches)
+        for train in range(args.trains):
+            for day, journey_date in enumerate(dates):
+                result = make_result(args.stations, seed=fetch * 1000 + train * 100 + day, journey_date=journey_date)
+                result["train_model"] = str(701 + train)
+                snapshots.append((result, fetched_at))
+    return snapshots
+
+def full_scan(directory, train_model, from_city, to_city):
+    # What a store without an index or fixed cell positions would have to do
+    points = []
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith("segment-"):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            _, meta_length, fetched_at, cells = HEADER.unpack_from(data, offset)
+            meta = json.loads(data[offset + HEADER.size:offset + HEADER.size + meta_length])
+            start = offset + HEADER.size + meta_length
+            values = [CELL.unpack_from(data, start + k * CELL.size) for k in range(cells)]
+            if meta["train_model"] == train_model:
+                stations = meta["stations"]
+                pairs = [(a, b) for i, a in enumerate(stations) for b in stations[i + 1:]]
+                position = pairs.index((from_city, to_city))
+                for k, seat_type in enumerate(meta["seat_types"]):
+                    points.append((fetched_at, seat_type, values[k * len(pairs) + position][0]))
+            offset = start + cells * CELL.size
+    return points
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot store: enqueue latency, size on disk and segment curve queries")
+    parser.add_argument("--stations", type=int, default=40)
+    parser.add_argument("--trains", type=int, default=6)
+    parser.add_argument("--dates", type=int, default=10)
+    parser.add_argument("--fetches", type=int, default=8)
+    parser.add_argument("--days", type=float, default=10)
+    parser.add_argument("--segment-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    snapshots = make_snapshots(args)
+    directory = tempfile.mkdtemp(prefix="snapshots-")
+    failures = []
+    try:
+        store = SnapshotStore(directory, max_segment_bytes=int(args.segment_mb * 1024 * 1024), queue_size=len(snapshots))
+        enqueue = []
+        start = time.perf_counter()
+        for result, fetched_at in snapshots:
+            call_start = time.perf_counter()
+            store.record(result, fetched_at)
+            enqueue.append((time.perf_counter() - call_start) * 1e6)
+        store.flush()
+        write_seconds = time.perf_counter() - start
+        stats = store.stats()
+
+        matrices_json = json.dumps(snapshots[0][0]["fare_matrices"]).encode("utf-8")
+        print(f"{len(snapshots)} snapshots: {args.trains} trains x {args.dates} dates x {args.fetches} fetches, {args.stations} stations")
+        print(f"  record() p50 {statistics.median(enqueue):.1f} us, max {max(enqueue):.1f} us; "
+              f"written in {write_seconds:.2f}s ({len(snapshots) / write_seconds:.0f}/s)")
+        print(f"  {stats['bytes'] / stats['snapshots'] / 1024:.1f} KB per snapshot in {stats['segments']} segments "
+              f"(fare matrices as JSON: {len(matrices_json) / 1024:.1f} KB, gzipped {len(gzip.compress(matrices_json, 6)) / 1024:.1f} KB)")
+
+        result = snapshots[0][0]
+        from_city, to_city = result["stations"][0], result["stations"][-1]
+        start = time.perf_counter()
+        points = store.curve("701", from_city, to_city, since=min(fetched_at for _, fetched_at in snapshots))
+        curve_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        scanned = full_scan(directory, "701", from_city, to_city)
+        scan_ms = (time.perf_counter() - start) * 1000
+        print(f"  curve 701 {from_city} -> {to_city}, last {args.days:g} days: {len(points)} points in {curve_ms:.1f} ms "
+              f"(full scan of every segment: {scan_ms:.0f} ms)")
+
+        expected = sorted(
+            (fetched_at, seat_type, r["fare_matrices"][seat_type][from_city][to_city]["online"])
+            for r, fetched_at in snapshots if r["train_model"] == "701"
+            for seat_type in populated_seat_types(r)
+        )
+        if sorted((p["fetched_at"], p["seat_type"], p["online"]) for p in points) != sorted((round(f, 3), s, o) for f, s, o in expected):
+            failures.append("curve does not match the recorded matrices")
+        if len(scanned) != len(points):
+            failures.append("curve and full scan disagree")
+
+        # A crash between a block and its index line, with a torn block after it
+        last_segment = max(store.segment_sizes())
+        with open(os.path.join(directory, INDEX_NAME), "rb") as f:
+            lines = f.readlines()
+        with open(os.path.join(directory, INDEX_NAME), "wb") as f:
+            f.writelines(lines[:-1])
+            f.write(lines[-1][:10])
+        with open(os.path.join(directory, SEGMENT_NAME.format(last_segment)), "ab") as f:
+            f.write(HEADER.pack(b"MSNP", 100, time.time(), 1000))
+        reopened = SnapshotStore(directory)
+        if reopened.stats()["snapshots"] != stats["snapshots"]:
+            failures.append(f"reopened store has {reopened.stats()['snapshots']} of {stats['snapshots']} snapshots")
+        else:
+            print(f"  reopened after a simulated crash: all {stats['snapshots']} snapshots indexed")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
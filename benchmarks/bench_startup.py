@@ -0,0 +1,74 @@
+import argparse, json, os, statistics, subprocess, sys, time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from load_worker_modes import free_port
+
+PROBE = "import app, json; print('STARTUP ' + json.dumps(app.STARTUP_TIMINGS))"
+
+def measure_import():
+    # Fresh interpreter each run so nothing is already in sys.modules
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+
+    timings = next(json.loads(line[len("STARTUP "):]) for line in completed.stdout.splitlines() if line.startswith("STARTUP "))
+    app_cumulative = next(cumulative for _, cumulative, name in modules if name == "app")
+    return wall_ms, app_cumulative / 1000, timings["app_init_ms"], modules
+
+def measure_gunicorn_boot(preload):
+    port = free_port()
+    args = [sys.executable, "-m", "gunicorn", "harness_app:app", "-c", "gunicorn.conf.py", "--pythonpath", BENCH_DIR,
+            "-w", "2", "-b", f"127.0.0.1:{port}", "--log-level", "warning"]
+    if preload:
+        args.append("--preload")
+
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < 30:
+            try:
+                stats = requests.get(f"http://127.0.0.1:{port}/queue_stats", timeout=1).json()
+                return (time.perf_counter() - start) * 1000, stats
+            except (requests.RequestException, ValueError):
+                time.sleep(0.05)
+        raise Exception("gunicorn did not start")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app.py import cost and gunicorn worker start-up")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure_import() for _ in range(args.runs)]
+    print(f"interpreter + import app  median {statistics.median(run[0] for run in runs):7.1f} ms")
+    print(f"import app (cumulative)   median {statistics.median(run[1] for run in runs):7.1f} ms")
+    print(f"app module body           median {statistics.median(run[2] for run in runs):7.1f} ms")
+
+    print("\nslowest modules by self time (last run):")
+    for self_us, cumulative_us, name in sorted(runs[-1][3], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:7.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+
+    print()
+    for preload in (False, True):
+        boot_ms, stats = measure_gunicorn_boot(preload)
+        print(f"gunicorn 2 workers{' --preload' if preload else '          '}  first response {boot_ms:7.1f} ms  "
+              f"queue threads running: {stats['threads_started']}  worker init {stats['startup']['worker_init_ms']} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse, json, os, sys, time, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from suggest_index import SuggestIndex, normalize
+
+QUERIES = ["d", "dh", "dhaka", "sub", "suborno", "735", "bypass", "amnura_b", "rajshahi ex", "hak", "xyz"]
+
+def linear_scan(trains, stations, query, limit):
+    # What script.js used to do on every keystroke
+    query = query.lower()
+    train_matches = [
+        train for train in trains
+        if any(query in str(train.get(field, '')).lower() for field in ('train_name', 'origin_city', 'destination_city', 'zone'))
+    ]
+    station_matches = [station for station in stations if query in station.lower()]
+    return (train_matches + station_matches)[:limit]
+
+def measure(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for query in QUERIES:
+            func(query)
+        timings.append((time.perf_counter() - start) * 1e6 / len(QUERIES))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /api/suggest lookups against a linear scan")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    with open('trains_en.json') as f:
+        trains = json.load(f)['trains']
+    with open('stations_en.json') as f:
+        stations = json.load(f)['stations']
+
+    start = time.perf_counter()
+    index = SuggestIndex.from_data(trains, stations)
+    print(f"index build {(time.perf_counter() - start) * 1000:.1f} ms, {index.stats()['entries']} entries")
+
+    cases = (
+        ("linear scan", lambda query: linear_scan(trains, stations, query, args.limit)),
+        ("index (uncached)", lambda query: index._suggest(normalize(query), None, args.limit, None)),
+        ("index (memoised)", lambda query: index.suggest(query, limit=args.limit)),
+    )
+    for label, func in cases:
+        timings = measure(func, args.iterations)
+        print(f"{label:20s} median {statistics.median(timings):8.1f} us/query  "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:8.1f} us/query")
+
+if __name__ == "__main__":
+    main()
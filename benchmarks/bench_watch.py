@@ -0,0 +1,101 @@
+import argparse, os, random, sys, threading, time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_upstream import start_server, add_upstream_arguments, upstream_options
+import upstream
+from matrixCalculator import compute_matrix, search_trips, pair_lookup, station_pairs
+from watch import WatchManager
+
+def baseline_seats(result, segments, seat_types):
+    return {
+        (from_city, to_city): {
+            seat_type: result["fare_matrices"][seat_type][from_city][to_city]["online"]
+                       + result["fare_matrices"][seat_type][from_city][to_city]["offline"]
+            for seat_type in seat_types
+        }
+        for from_city, to_city in segments
+    }
+
+def run_scenario(result, watchers, segments_per_watch, args, server):
+    # Every watcher is on the same popular train, each on a random handful of its busiest segments
+    manager = WatchManager(search_trips, min_interval=args.min_interval, max_interval=args.max_interval)
+    rng = random.Random(args.seed)
+    received = []
+    lock = threading.Lock()
+
+    def listen(subscription_id):
+        last_id = 0
+        while True:
+            events, still_open = manager.wait_events(subscription_id, last_id, timeout=1)
+            with lock:
+                received.extend(event for event in events if event["event"] == "availability")
+            if events:
+                last_id = events[-1]["id"]
+            if not still_open:
+                return
+
+    server.reset_stats()
+    listeners = []
+    for watcher in range(watchers):
+        segments = rng.sample(station_pairs(result["stations"])[:args.popular_segments], segments_per_watch)
+        subscription = manager.subscribe(
+            result["train_model"], result["date"],
+            {segment: pair_lookup(result["station_dates"], *segment) for segment in segments},
+            args.seat_types, baseline_seats(result, segments, args.seat_types),
+            f"token-{watcher}", "device"
+        )
+        listener = threading.Thread(target=listen, args=(subscription.id,), daemon=True)
+        listener.start()
+        listeners.append(listener)
+
+    time.sleep(args.seconds)
+    stats = manager.stats()
+    calls = server.call_stats()["by_endpoint"].get("search-trips-v2", 0)
+    for subscription_id in manager.subscription_ids():
+        manager.unsubscribe(subscription_id)
+    for listener in listeners:
+        listener.join(timeout=5)
+    return calls, stats, len(received)
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch subscriptions: upstream calls for one watcher vs many on the same segments")
+    parser.add_argument("--watchers", type=int, default=500)
+    parser.add_argument("--segments-per-watch", type=int, default=3)
+    parser.add_argument("--popular-segments", type=int, default=8, help="Watchers pick their segments from the first N pairs")
+    parser.add_argument("--seat-types", nargs="+", default=["S_CHAIR", "SNIGDHA", "AC_S", "AC_B"])
+    parser.add_argument("--min-interval", type=float, default=1)
+    parser.add_argument("--max-interval", type=float, default=8)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    add_upstream_arguments(parser, latency_ms=20)
+    parser.set_defaults(seat_churn_seconds=5)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, **upstream_options(args))
+    upstream.API_BASE_URL = base_url.rstrip('/')
+    journey_date = (datetime.now() + timedelta(days=2)).strftime("%d-%b-%Y")
+    api_date = datetime.strptime(journey_date, "%d-%b-%Y").strftime("%Y-%m-%d")
+    result = compute_matrix(next(iter(server.trains)), journey_date, api_date, "bench", "bench")
+    print(f"{result['train_name']}, {args.stations} stations, seats reshuffle every {args.seat_churn_seconds}s, "
+          f"intervals {args.min_interval}-{args.max_interval}s, {args.seconds}s per run")
+
+    # The single watcher covers every popular segment, so both runs poll the same segments
+    single = run_scenario(result, 1, args.popular_segments, args, server)
+    many = run_scenario(result, args.watchers, args.segments_per_watch, args, server)
+
+    print(f"\n  {'':22s} {'search calls':>12s} {'pollers':>8s} {'watchers/poller':>16s} {'notifications':>14s}")
+    for label, (calls, stats, notifications) in (("1 watcher", single), (f"{args.watchers} watchers", many)):
+        print(f"  {label:22s} {calls:12d} {stats['pollers']:8d} {stats['watchers_per_poller']:16.1f} {notifications:14d}")
+
+    # Pollers are per segment, so the many-watcher run should cost about the same
+    if many[0] > single[0] * 1.25 + 5:
+        print("FAIL: upstream calls grew with the number of watchers")
+        sys.exit(1)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse, json, math, random, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from synthetic import make_station_names, make_routes
+
+ALL_DAYS = ["Sat", "Sun", "Mon", "Tue", "Wed", "Thu", "Fri"]
+FAKE_SEAT_TYPES = ("S_CHAIR", "SNIGDHA", "AC_S", "AC_B")
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+ERROR_BODIES = {
+    401: {"error": {"messages": ["Invalid User Access Token!"]}},
+    403: {"error": {"messages": ["Forbidden"]}},
+    429: {"error": {"messages": ["Too many requests. Please slow down."]}}
+}
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=500, jitter_ms=0, latency_distribution="uniform", latency_sigma=0.5,
+                 trips_per_search=3, stations=10, trains=5, first_model=701, error_rates=None, seed=0, seat_churn_seconds=0,
+                 expired_token_prefix="expired"):
+        super().__init__(address, FakeUpstreamHandler)
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise Exception(f"Unknown latency distribution: {latency_distribution}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.trips_per_search = trips_per_search
+        self.seat_churn_seconds = seat_churn_seconds
+        # Bearer tokens starting with this are answered with 401, like an expired session
+        self.expired_token_prefix = expired_token_prefix
+        self.error_rates = dict(error_rates or {})
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.calls = Counter()
+        self.calls_lock = threading.Lock()
+
+        self.stations = make_station_names(stations)
+        self.station_order = {city: order for order, city in enumerate(self.stations)}
+        self.trains = {}
+        for model in range(first_model, first_model + trains):
+            routes = make_routes(self.stations, start_minutes=(5 * 60 + model * 37) % (24 * 60), seed=model)
+            self.trains[str(model)] = {
+                "train_name": f"FAKE EXPRESS ({model})",
+                "days": ALL_DAYS,
+                "routes": routes,
+                "total_duration": routes[-1]["duration"]
+            }
+
+    def train_names(self):
+        return [train["train_name"] for train in self.trains.values()]
+
+    def sample_latency(self):
+        latency, jitter = self.latency_ms, self.jitter_ms
+        with self.rng_lock:
+            if self.latency_distribution == "fixed":
+                value = latency
+            elif self.latency_distribution == "uniform":
+                value = self.rng.uniform(latency - jitter, latency + jitter)
+            elif self.latency_distribution == "normal":
+                value = self.rng.gauss(latency, jitter)
+            elif self.latency_distribution == "lognormal":
+                # latency_ms is the median; sigma controls the length of the tail
+                value = self.rng.lognormvariate(math.log(max(latency, 0.001)), self.latency_sigma)
+            else:
+                value = self.rng.expovariate(1 / latency) if latency > 0 else 0
+        return max(0.0, value) / 1000
+
+    def pick_error(self):
+        if not self.error_rates:
+            return None
+        with self.rng_lock:
+            roll = self.rng.random()
+        for status, rate in self.error_rates.items():
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def record(self, endpoint, status):
+        with self.calls_lock:
+            self.calls[(endpoint, status)] += 1
+
+    def call_stats(self):
+        with self.calls_lock:
+            calls = dict(self.calls)
+        return {
+            "total": sum(calls.values()),
+            "by_endpoint": {
+                endpoint: sum(count for (name, _), count in calls.items() if name == endpoint)
+                for endpoint in sorted({name for name, _ in calls})
+            },
+            "by_status": {
+                str(status): sum(count for (_, code), count in calls.items() if code == status)
+                for status in sorted({code for _, code in calls})
+            }
+        }
+
+    def reset_stats(self):
+        with self.calls_lock:
+            self.calls.clear()
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith("/bookings/search-trips-v2"):
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._respond("search-trips-v2", lambda: {"data": {"trains": self._trips(params)}})
+        else:
+            self._send(404, {"error": {"messages": ["Not found"]}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path.endswith("/train-routes"):
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                payload = {}
+            self._respond("train-routes", lambda: {"data": self.server.trains.get(str(payload.get("model", "")))})
+        else:
+            self._send(404, {"error": {"messages": ["Not found"]}})
+
+    def _respond(self, endpoint, build_payload):
+        time.sleep(self.server.sample_latency())
+        prefix = self.server.expired_token_prefix
+        expired = prefix and self.headers.get("Authorization", "").startswith(f"Bearer {prefix}")
+        status = 401 if expired else self.server.pick_error()
+        self.server.record(endpoint, status or 200)
+        if status:
+            self._send(status, ERROR_BODIES.get(status, {"error": {"messages": ["Service unavailable"]}}))
+        else:
+            self._send(200, build_payload())
+
+    def _trips(self, params):
+        from_city, to_city = params.get("from_city", ""), params.get("to_city", "")
+        date = params.get("date_of_journey", "")
+        from_order = self.server.station_order.get(from_city)
+        to_order = self.server.station_order.get(to_city)
+        if from_order is None or to_order is None or from_order >= to_order:
+            return self._generic_trips(from_city, to_city, date)
+        return [
+            self._train_trip(model, train, from_order, to_order, date)
+            for model, train in self.server.trains.items()
+        ]
+
+    def _train_trip(self, model, train, from_order, to_order, date):
+        from_stop, to_stop = train["routes"][from_order], train["routes"][to_order]
+        # Seeded per pair and date so that repeated runs see the same seats; with seat churn the
+        # counts also change every seat_churn_seconds
+        seed = f"{model}|{from_stop['city']}|{to_stop['city']}|{date}"
+        if self.server.seat_churn_seconds:
+            seed += f"|{int(time.time() // self.server.seat_churn_seconds)}"
+        rng = random.Random(seed)
+        hops = to_order - from_order
+        return {
+            "train_model": model,
+            "trip_number": train["train_name"],
+            "departure_date_time": f"{date}, {from_stop['departure_time'].replace(' BST', '')}",
+            "arrival_date_time": f"{date}, {to_stop['arrival_time'].replace(' BST', '')}",
+            "travel_time": to_stop["duration"],
+            "origin_city_name": from_stop["city"],
+            "destination_city_name": to_stop["city"],
+            "seat_types": [
+                {
+                    "type": seat_type,
+                    "fare": str(40 * hops + 120 * index),
+                    "vat_amount": str(3 * hops),
+                    "seat_counts": {"online": rng.randint(0, 60), "offline": rng.randint(0, 20)}
+                }
+                for index, seat_type in enumerate(FAKE_SEAT_TYPES)
+                if rng.random() < 0.8
+            ]
+        }
+
+    def _generic_trips(self, from_city, to_city, date):
+        return [
+            {
+                "trip_number": f"FAKE EXPRESS ({700 + i})",
+                "departure_date_time": f"{date}, 0{i % 10}:00 am",
+                "arrival_date_time": f"{date}, 0{i % 10}:45 pm",
+                "travel_time": "12h 45m",
+                "origin_city_name": from_city,
+                "destination_city_name": to_city
+            }
+            for i in range(self.server.trips_per_search)
+        ]
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=0, latency_ms=500, jitter_ms=0, trips_per_search=3, **options):
+    server = FakeUpstreamServer(("127.0.0.1", port), latency_ms=latency_ms, jitter_ms=jitter_ms,
+                                trips_per_search=trips_per_search, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1.0/web"
+
+def parse_error_rates(values):
+    # "429=0.05" -> {429: 0.05}
+    rates = {}
+    for value in values or []:
+        status, _, rate = value.partition("=")
+        rates[int(status)] = float(rate)
+    if sum(rates.values()) > 1:
+        raise Exception("Injected error rates add up to more than 1")
+    return rates
+
+def add_upstream_arguments(parser, latency_ms=500):
+    parser.add_argument("--latency-ms", type=float, default=latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="uniform")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Shape of the lognormal tail")
+    parser.add_argument("--stations", type=int, default=10, help="Stations on every synthetic train")
+    parser.add_argument("--trains", type=int, default=5)
+    parser.add_argument("--error-rate", action="append", metavar="STATUS=RATE",
+                        help="Inject a status code (401, 403, 429, 5xx) into this fraction of calls; repeatable")
+    parser.add_argument("--seat-churn-seconds", type=float, default=0, help="Reshuffle seat counts this often (0 keeps them fixed)")
+
+def upstream_options(args):
+    return {
+        "latency_distribution": args.latency_distribution,
+        "latency_sigma": args.latency_sigma,
+        "stations": args.stations,
+        "trains": args.trains,
+        "error_rates": parse_error_rates(args.error_rate),
+        "seat_churn_seconds": args.seat_churn_seconds
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Shohoz railway API")
+    parser.add_argument("--port", type=int, default=8765)
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.latency_ms, args.jitter_ms, **upstream_options(args))
+    print(f"Fake upstream listening; export SHOHOZ_API_BASE_URL={base_url}")
+    print(f"Trains: {', '.join(server.train_names())} over {len(server.stations)} stations")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
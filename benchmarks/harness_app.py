@@ -0,0 +1,26 @@
+import json, os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import app as app_module
+
+# Serve the real routes: drop the sunset redirect and the per-IP limits that a
+# single load-generating client would trip immediately.
+app_module.app.before_request_funcs[None] = [
+    func for func in app_module.app.before_request_funcs[None] if func.__name__ != 'redirect_to_new_site'
+]
+app_module.CONFIG.update({
+    "is_maintenance": 0,
+    "rate_limit_enabled": False,
+    "corridor_index_enabled": False
+})
+
+# Extra settings from the load scripts, e.g. HARNESS_CONFIG='{"queue_cooldown_period": 0}'
+overrides = json.loads(os.environ.get("HARNESS_CONFIG") or "{}")
+app_module.CONFIG.update(overrides)
+if any(key.startswith("queue_") for key in overrides):
+    app_module.request_queue = app_module.configure_request_queue()
+
+app = app_module.app
@@ -0,0 +1,152 @@
+import argparse, json, math, os, random, re, statistics, sys, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_upstream import start_server, add_upstream_arguments, upstream_options
+from load_worker_modes import free_port, start_gunicorn
+
+REQUEST_ID_PATTERN = re.compile(r'const requestId = "([0-9a-f-]+)"')
+
+def percentile(ordered, fraction):
+    return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)]
+
+def run_matrix(session, base, train_name, journey_date, poll_interval, timeout):
+    # Same sequence as a browser: submit, load the queue page, poll with heartbeats, open the results
+    start = time.perf_counter()
+    response = session.post(f"{base}/matrix", data={
+        "train_model": train_name,
+        "date": journey_date,
+        "auth_token": "load-test",
+        "device_key": "load-test"
+    }, allow_redirects=False, timeout=timeout)
+    if response.status_code == 503:
+        return "rejected", time.perf_counter() - start
+    if response.status_code != 302 or not response.headers.get("Location", "").endswith("/queue_wait"):
+        return "submit_error", time.perf_counter() - start
+
+    match = REQUEST_ID_PATTERN.search(session.get(f"{base}/queue_wait", timeout=timeout).text)
+    if not match:
+        return "submit_error", time.perf_counter() - start
+    request_id = match.group(1)
+
+    deadline = start + timeout
+    while True:
+        if time.perf_counter() > deadline:
+            session.post(f"{base}/cancel_request/{request_id}", timeout=timeout)
+            return "timeout", time.perf_counter() - start
+        time.sleep(poll_interval)
+        session.post(f"{base}/queue_heartbeat/{request_id}", timeout=timeout)
+        status = session.get(f"{base}/queue_status/{request_id}", timeout=timeout)
+        if status.status_code == 429:
+            continue
+        data = status.json()
+        if data.get("error") or data.get("status") == "failed":
+            return "failed", time.perf_counter() - start
+        if data.get("status") == "completed":
+            break
+
+    response = session.get(f"{base}/show_results/{request_id}", allow_redirects=False, timeout=timeout)
+    outcome = "ok" if response.status_code == 200 and b"matrix" in response.content else "failed"
+    return outcome, time.perf_counter() - start
+
+def virtual_user(user_id, base, train_names, matrices, args, results, lock):
+    rng = random.Random(user_id)
+    session = requests.Session()
+    for _ in range(matrices):
+        journey_date = (datetime.now() + timedelta(days=rng.randint(1, args.days))).strftime("%d-%b-%Y")
+        try:
+            outcome, latency = run_matrix(session, base, rng.choice(train_names), journey_date,
+                                          args.poll_interval, args.timeout)
+        except requests.RequestException:
+            outcome, latency = "connection_error", 0
+        with lock:
+            results.append((outcome, latency))
+
+def summarize(results, elapsed, upstream_calls):
+    outcomes = Counter(outcome for outcome, _ in results)
+    latencies = sorted(latency for outcome, latency in results if outcome == "ok")
+    completed = outcomes["ok"]
+    summary = {
+        "matrices": len(results),
+        "outcomes": dict(outcomes),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_per_min": round(completed / elapsed * 60, 2) if elapsed else 0,
+        "latency_ms": None,
+        "upstream": upstream_calls,
+        "upstream_calls_per_matrix": round(upstream_calls["total"] / completed, 1) if completed else None
+    }
+    if latencies:
+        summary["latency_ms"] = {
+            "p50": round(statistics.median(latencies) * 1000),
+            "p95": round(percentile(latencies, 0.95) * 1000),
+            "p99": round(percentile(latencies, 0.99) * 1000),
+            "max": round(latencies[-1] * 1000)
+        }
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive /matrix -> queue -> /show_results end to end against the fake upstream")
+    parser.add_argument("--users", type=int, default=5, help="Concurrent virtual users")
+    parser.add_argument("--matrices-per-user", type=int, default=2)
+    parser.add_argument("--days", type=int, default=3, help="Journey dates are drawn from the next N days")
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--queue-cooldown", type=float, default=0, help="queue_cooldown_period for the run")
+    parser.add_argument("--queue-max-depth", type=int, default=0, help="queue_max_depth for the run (0 disables)")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="Also write the summary to this file")
+    parser.add_argument("--fail-above-p95-ms", type=float, help="Exit non-zero when p95 latency exceeds this")
+    add_upstream_arguments(parser, latency_ms=20)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, **upstream_options(args))
+    port = free_port()
+    process = start_gunicorn(args.worker_class, port, base_url, 1000, config={
+        "queue_enabled": True,
+        "queue_cooldown_period": args.queue_cooldown,
+        "queue_max_depth": args.queue_max_depth,
+        "queue_max_predicted_wait": 0
+    })
+    base = f"http://127.0.0.1:{port}"
+    pairs = args.stations * (args.stations - 1) // 2
+    print(f"{args.users} users x {args.matrices_per_user} matrices, {args.trains} trains of {args.stations} stations "
+          f"({pairs} pairs), upstream {args.latency_distribution} {args.latency_ms:.0f} ms, worker {args.worker_class}")
+
+    try:
+        server.reset_stats()
+        results, lock = [], threading.Lock()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as executor:
+            users = [
+                executor.submit(virtual_user, user_id, base, server.train_names(), args.matrices_per_user, args, results, lock)
+                for user_id in range(args.users)
+            ]
+            for user in users:
+                user.result()
+        summary = summarize(results, time.perf_counter() - start, server.call_stats())
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        server.shutdown()
+
+    latency = summary["latency_ms"] or {}
+    print(f"outcomes      {summary['outcomes']}")
+    print(f"throughput    {summary['throughput_per_min']} matrices/min over {summary['elapsed_seconds']} s")
+    print(f"latency ms    p50 {latency.get('p50')}  p95 {latency.get('p95')}  p99 {latency.get('p99')}  max {latency.get('max')}")
+    print(f"upstream      {summary['upstream_calls_per_matrix']} calls per matrix, by status {summary['upstream']['by_status']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.fail_above_p95_ms and (not latency or latency["p95"] > args.fail_above_p95_ms):
+        print(f"FAIL: p95 above {args.fail_above_p95_ms:.0f} ms")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse, json, math, os, socket, statistics, subprocess, sys, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_upstream import start_server
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(worker_class, port, base_url, worker_connections, config=None):
+    env = dict(os.environ, SHOHOZ_API_BASE_URL=base_url, GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKER_CONNECTIONS=str(worker_connections), HARNESS_CONFIG=json.dumps(config or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "harness_app:app", "-c", "gunicorn.conf.py",
+         "--pythonpath", BENCH_DIR, "-w", "1", "-b", f"127.0.0.1:{port}", "--timeout", "300",
+         "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/queue_stats", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise Exception(f"gunicorn ({worker_class}) did not start")
+
+def search_once(port):
+    # Unique corridors so every request misses the cache and waits on the upstream
+    payload = {"origin": f"Origin-{uuid.uuid4().hex[:8]}", "destination": "Dhaka",
+               "auth_token": "load-test", "device_key": "load-test"}
+    start = time.perf_counter()
+    try:
+        ok = requests.post(f"http://127.0.0.1:{port}/search_trains", json=payload, timeout=300).ok
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def run_level(port, concurrency, total):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: search_once(port), range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+    if not latencies:
+        return {"throughput": 0, "p50": 0, "p95": 0, "errors": errors}
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[max(0, math.ceil(len(latencies) * 0.95) - 1)] * 1000,
+        "errors": errors
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and gevent gunicorn workers on upstream-bound /search_trains")
+    parser.add_argument("--modes", default="sync,gevent")
+    parser.add_argument("--concurrency", default="1,10,50,100")
+    parser.add_argument("--requests-per-client", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--worker-connections", type=int, default=1000)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency_ms=args.latency_ms)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    print(f"1 worker, upstream latency {args.latency_ms:.0f} ms per call (2 calls per search, run concurrently)")
+    print(f"{'mode':8s} {'clients':>7s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'errors':>7s}")
+
+    try:
+        for mode in args.modes.split(","):
+            port = free_port()
+            process = start_gunicorn(mode, port, base_url, args.worker_connections)
+            try:
+                for concurrency in levels:
+                    stats = run_level(port, concurrency, concurrency * args.requests_per_client)
+                    print(f"{mode:8s} {concurrency:7d} {stats['throughput']:8.1f} {stats['p50']:9.0f} "
+                          f"{stats['p95']:9.0f} {stats['errors']:7d}")
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
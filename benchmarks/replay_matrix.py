@@ -0,0 +1,87 @@
+import argparse, cProfile, io, json, os, pstats, statistics, sys, time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import upstream
+from matrixCalculator import compute_matrix, result_version
+
+def recorded_matrices(replayer):
+    # Every successful train-routes recording is one matrix that can be recomputed, in recorded order
+    seen = []
+    for entry in replayer.entries("train-routes"):
+        key = (str(entry["params"].get("model")), entry["params"].get("departure_date_time"))
+        if entry["status"] == 200 and key not in seen:
+            seen.append(key)
+    return seen
+
+def replay_once(model, api_date):
+    journey_date_str = datetime.strptime(api_date, "%Y-%m-%d").strftime("%d-%b-%Y")
+    started = time.perf_counter()
+    try:
+        outcome = result_version(compute_matrix(model, journey_date_str, api_date, "replay", "replay"))
+    except Exception as e:
+        outcome = f"error: {e}"
+    return outcome, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute matrices offline from a recorded upstream archive")
+    parser.add_argument("archive", help="Archive written with SHOHOZ_UPSTREAM_RECORD (gzip NDJSON)")
+    parser.add_argument("--latency-scale", type=float, default=0, help="1 replays recorded latencies, 0 skips them")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--baseline", help="JSON file of expected result versions; exit non-zero on any difference")
+    parser.add_argument("--write-baseline", help="Write this run's result versions to a JSON file")
+    parser.add_argument("--profile", action="store_true", help="Print the top functions by cumulative time")
+    args = parser.parse_args()
+
+    upstream.configure(replay_path=args.archive, latency_scale=args.latency_scale)
+    replayer = upstream.REPLAYER
+    matrices = recorded_matrices(replayer)
+    print(f"{len(matrices)} matrices, {replayer.stats()['recordings']} recorded responses, latency scale {args.latency_scale}")
+
+    profiler = cProfile.Profile() if args.profile else None
+    versions = {}
+    timings = {f"{model}|{api_date}": [] for model, api_date in matrices}
+    for _ in range(args.runs):
+        # Rewind once per pass: trains on the same corridor share search-trips recordings,
+        # and a pass consumes them in the order they were recorded
+        replayer.rewind()
+        for model, api_date in matrices:
+            key = f"{model}|{api_date}"
+            if profiler:
+                profiler.enable()
+            outcome, elapsed = replay_once(model, api_date)
+            if profiler:
+                profiler.disable()
+            timings[key].append(elapsed)
+            if versions.setdefault(key, outcome) != outcome:
+                print(f"  {key}: result changed between runs")
+
+    for key, samples in timings.items():
+        model, api_date = key.split("|")
+        print(f"  {model:>6s} {api_date}  median {statistics.median(samples) * 1000:8.1f} ms  {versions[key][:60]}")
+
+    stats = replayer.stats()
+    print(f"replayed {stats['hits']} responses, {stats['misses']} requests had no recording")
+
+    if profiler:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(20)
+        print(output.getvalue())
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump(versions, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            expected = json.load(f)
+        changed = sorted(key for key in expected if versions.get(key) != expected[key])
+        for key in changed:
+            print(f"CHANGED {key}: {expected[key][:60]} -> {versions.get(key, 'not replayed')[:60]}")
+        if changed:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
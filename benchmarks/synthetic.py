@@ -0,0 +1,89 @@
+import random, sys, os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matrixCalculator import SEAT_TYPES, result_version
+
+def make_station_names(n_stations):
+    return [f"Station_{i:02d}" for i in range(n_stations)]
+
+def make_routes(stations, start_minutes=6 * 60, seed=0):
+    rng = random.Random(seed)
+    routes = []
+    minutes = start_minutes
+
+    for i, city in enumerate(stations):
+        halt = 0 if i in (0, len(stations) - 1) else rng.randint(2, 10)
+        arrival = None if i == 0 else format_bst(minutes)
+        minutes += halt
+        departure = None if i == len(stations) - 1 else format_bst(minutes)
+        routes.append({
+            "city": city,
+            "arrival_time": arrival,
+            "departure_time": departure,
+            "halt": str(halt) if i not in (0, len(stations) - 1) else "---",
+            "duration": "---" if i == 0 else f"{(minutes - start_minutes) // 60:02d}:{(minutes - start_minutes) % 60:02d}"
+        })
+        minutes += rng.randint(10, 40)
+    return routes
+
+def format_bst(total_minutes):
+    hour = (total_minutes // 60) % 24
+    minute = total_minutes % 60
+    am_pm = "am" if hour < 12 else "pm"
+    display_hour = hour % 12 or 12
+    return f"{display_hour:02d}:{minute:02d} {am_pm} BST"
+
+def make_seat_info(rng, seat_types_with_data):
+    seat_info = {stype: {"online": 0, "offline": 0, "fare": 0, "vat_amount": 0} for stype in SEAT_TYPES}
+    for stype in seat_types_with_data:
+        if rng.random() < 0.7:
+            seat_info[stype] = {
+                "online": rng.randint(0, 60),
+                "offline": rng.randint(0, 20),
+                "fare": float(rng.randint(50, 1500)),
+                "vat_amount": float(rng.randint(0, 80))
+            }
+    return seat_info
+
+def make_result(n_stations=40, seat_types_with_data=("S_CHAIR", "SNIGDHA", "AC_S", "AC_B"), seed=0, journey_date="20-Oct-2026"):
+    rng = random.Random(seed)
+    stations = make_station_names(n_stations)
+    routes = make_routes(stations, seed=seed)
+    api_date = datetime.strptime(journey_date, "%d-%b-%Y").strftime("%Y-%m-%d")
+
+    fare_matrices = {seat_type: {from_city: {} for from_city in stations} for seat_type in SEAT_TYPES}
+    has_data_map = {seat_type: False for seat_type in SEAT_TYPES}
+
+    for i, from_city in enumerate(stations):
+        for to_city in stations[i + 1:]:
+            seat_info = make_seat_info(rng, seat_types_with_data)
+            for seat_type in SEAT_TYPES:
+                fare_matrices[seat_type][from_city][to_city] = seat_info[seat_type]
+                if seat_info[seat_type]["online"] + seat_info[seat_type]["offline"] > 0:
+                    has_data_map[seat_type] = True
+
+    result = {
+        "train_model": "701",
+        "train_name": "SYNTHETIC EXPRESS (701)",
+        "date": journey_date,
+        "stations": stations,
+        "seat_types": SEAT_TYPES,
+        "fare_matrices": fare_matrices,
+        "has_data_map": has_data_map,
+        "routes": routes,
+        "days": ["Sat", "Sun", "Mon", "Tue", "Wed", "Thu", "Fri"],
+        "total_duration": routes[-1]["duration"],
+        "station_dates": {station: api_date for station in stations},
+        "station_dates_formatted": {station: journey_date for station in stations},
+        "has_segmented_dates": False,
+        "next_day_str": "",
+        "prev_day_str": "",
+    }
+    result["version"] = result_version(result)
+    return result
+
+def next_dates(start, count):
+    base = datetime.strptime(start, "%d-%b-%Y")
+    return [(base + timedelta(days=i)).strftime("%d-%b-%Y") for i in range(count)]
@@ -0,0 +1,143 @@
+import gzip, time, zlib, logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml'
+}
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+def negotiate_encoding(accept_encoding):
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        pieces = part.strip().split(';')
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+
+    for coding in available_encodings():
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > 0:
+            return coding
+    return None
+
+def compress_bytes(data, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+class _StreamEncoder:
+    # compress() returns everything given so far, so each streamed chunk reaches the client at once
+    def __init__(self, encoding, gzip_level=6, brotli_quality=5):
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+            self.compress = lambda chunk: self.compressor.process(chunk) + self.compressor.flush()
+            self.finish = self.compressor.finish
+        else:
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self.compress = lambda chunk: self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.compressor.flush
+
+class ResponseCompressor:
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def should_compress(self, response):
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return False
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return False
+        return response.mimetype in COMPRESSIBLE_MIMETYPES
+
+    def compress_response(self, response, accept_encoding, label=''):
+        if not self.should_compress(response):
+            return response
+
+        encoding = negotiate_encoding(accept_encoding)
+        response.vary.add('Accept-Encoding')
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            self._weaken_etag(response)
+            response.response = self._compress_stream(response.response, encoding, label)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        cpu_start = time.thread_time()
+        compressed = compress_bytes(data, encoding, self.gzip_level, self.brotli_quality)
+        cpu_ms = (time.thread_time() - cpu_start) * 1000
+
+        self._weaken_etag(response)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        self._log(label, encoding, len(data), len(compressed), cpu_ms)
+        return response
+
+    def _compress_stream(self, iterable, encoding, label):
+        encoder = _StreamEncoder(encoding, self.gzip_level, self.brotli_quality)
+        raw_size = 0
+        compressed_size = 0
+        cpu_seconds = 0.0
+
+        try:
+            for chunk in iterable:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                raw_size += len(chunk)
+
+                cpu_start = time.thread_time()
+                output = encoder.compress(chunk)
+                cpu_seconds += time.thread_time() - cpu_start
+
+                if output:
+                    compressed_size += len(output)
+                    yield output
+
+            cpu_start = time.thread_time()
+            output = encoder.finish()
+            cpu_seconds += time.thread_time() - cpu_start
+            compressed_size += len(output)
+            yield output
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+        self._log(label, encoding, raw_size, compressed_size, cpu_seconds * 1000, streamed=True)
+
+    def _weaken_etag(self, response):
+        # A strong ETag names one exact byte sequence, which the compressed body no longer is
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+    def _log(self, label, encoding, raw_size, compressed_size, cpu_ms, streamed=False):
+        ratio = raw_size / compressed_size if compressed_size else 0
+        logger.info(
+            f"Compressed {label or 'response'} ({encoding}{', streamed' if streamed else ''}): "
+            f"{raw_size} -> {compressed_size} bytes, ratio {ratio:.1f}x, CPU {cpu_ms:.1f} ms"
+        )
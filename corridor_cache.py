@@ -0,0 +1,62 @@
+import threading, time
+from collections import deque
+from result_store import ResultStore
+
+class CorridorCache:
+    def __init__(self, ttl=21600, max_bytes=4 * 1024 * 1024, latency_samples=200):
+        self.ttl = ttl
+        self.store = ResultStore(max_bytes=max_bytes)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fetch_latencies = deque(maxlen=latency_samples)
+        self.hit_latencies = deque(maxlen=latency_samples)
+
+    def key(self, origin, destination, dates):
+        # The trains listed depend on the lookup dates through their running days, so an entry
+        # stored before midnight is never served for the next day's dates
+        return f"{origin.lower()}|{destination.lower()}|{'|'.join(dates)}"
+
+    def get(self, origin, destination, dates):
+        entry = self.store.get(self.key(origin, destination, dates))
+        if entry and time.time() - entry["cached_at"] <= self.ttl:
+            return entry
+        return None
+
+    def put(self, origin, destination, trains, dates):
+        entry = {"trains": trains, "dates": dates, "cached_at": time.time()}
+        self.store.put(self.key(origin, destination, dates), entry)
+        return entry
+
+    def record(self, hit, latency):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_latencies.append(latency)
+            else:
+                self.misses += 1
+                self.fetch_latencies.append(latency)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+                "ttl_seconds": self.ttl,
+                "hit_latency_ms": self._summarize(self.hit_latencies),
+                "fetch_latency_ms": self._summarize(self.fetch_latencies),
+                "store": self.store.stats()
+            }
+
+    def _summarize(self, samples):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return {
+            "avg": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p95": round(ordered[max(0, int(len(ordered) * 0.95) - 1)] * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2)
+        }
@@ -0,0 +1,290 @@
+import json, logging, os, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class CorridorIndex:
+    def __init__(self, trains, fetch_route, snapshot_path=None, refresh_interval=86400, workers=4):
+        self.trains = trains
+        self.fetch_route = fetch_route
+        self.snapshot_path = snapshot_path or None
+        self.refresh_interval = refresh_interval
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.refresher = None
+
+        # train name -> {"days": [...], "stops": [(city, arrival, departure, arrival offset, departure offset), ...]}
+        self.routes = {}
+        # station key -> {train name: stop order}
+        self.stations = {}
+        self.built_at = None
+        self.snapshot_mtime = None
+        self.last_build_seconds = None
+        self.failed_trains = []
+        self.queries = 0
+        self.answered = 0
+
+        if self.snapshot_path:
+            self.load_snapshot()
+
+    def ready(self):
+        return bool(self.stations)
+
+    def query(self, origin, destination, journey_dates=None):
+        with self.lock:
+            origin_trains = self.stations.get(station_key(origin), {})
+            destination_trains = self.stations.get(station_key(destination), {})
+            if len(destination_trains) < len(origin_trains):
+                candidates = [name for name in destination_trains if name in origin_trains]
+            else:
+                candidates = [name for name in origin_trains if name in destination_trains]
+
+            weekdays = {date.strftime("%a") for date in journey_dates} if journey_dates else None
+            matches = []
+            for name in candidates:
+                from_order, to_order = origin_trains[name], destination_trains[name]
+                if from_order >= to_order:
+                    continue
+                route = self.routes[name]
+                if weekdays and route["days"] and not weekdays.intersection(route["days"]):
+                    continue
+                matches.append(self._describe(name, route, from_order, to_order))
+
+            self.queries += 1
+            if matches:
+                self.answered += 1
+
+        matches.sort(key=lambda train: train.pop("sort_minutes"))
+        return matches
+
+    def stats(self):
+        with self.lock:
+            return {
+                "ready": self.ready(),
+                "trains": len(self.routes),
+                "stations": len(self.stations),
+                "failed_trains": len(self.failed_trains),
+                "built_at": self.built_at,
+                "last_build_seconds": self.last_build_seconds,
+                "queries": self.queries,
+                "answered": self.answered,
+                "refresher_running": bool(self.refresher and self.refresher.is_alive())
+            }
+
+    def ensure_refresher(self):
+        # Also called from the train search, so a worker whose refresher died gets it back on the next
+        # search; with a snapshot path _refresh lets one worker rebuild and the rest load its snapshot
+        with self.lock:
+            if self.refresher and self.refresher.is_alive():
+                return
+            self.refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+            self.refresher.start()
+
+    def build(self, api_date=None):
+        api_date = api_date or (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+        started = time.perf_counter()
+        routes = {}
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.fetch_route, train["train_number"], api_date): train["train_name"]
+                for train in self.trains
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    train_data = future.result()
+                except Exception as e:
+                    logger.warning(f"Corridor index: failed to fetch route for {name}: {e}")
+                    failed.append(name)
+                    continue
+                if train_data and train_data.get("routes"):
+                    routes[name] = {
+                        "days": train_data.get("days") or [],
+                        "stops": build_stops(train_data["routes"])
+                    }
+                else:
+                    failed.append(name)
+
+        with self.lock:
+            # Keep the previous route of trains that failed this round
+            for name in failed:
+                if name in self.routes:
+                    routes[name] = self.routes[name]
+            self._install_locked(routes)
+            self.built_at = datetime.now().isoformat(timespec="seconds")
+            self.last_build_seconds = round(time.perf_counter() - started, 2)
+            self.failed_trains = failed
+
+        logger.info(f"Corridor index: indexed {len(routes)} trains, {len(failed)} failed, in {self.last_build_seconds}s")
+        if self.snapshot_path:
+            self.save_snapshot()
+
+    def load_snapshot(self):
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        routes = {
+            name: {"days": route["days"], "stops": [tuple(stop) for stop in route["stops"]]}
+            for name, route in snapshot.get("routes", {}).items()
+        }
+        with self.lock:
+            self._install_locked(routes)
+            self.built_at = snapshot.get("built_at")
+            self.snapshot_mtime = mtime
+        return True
+
+    def save_snapshot(self):
+        with self.lock:
+            snapshot = {"built_at": self.built_at, "routes": self.routes}
+        # A temp file of its own, so that a concurrent save never publishes a half-written one
+        directory, name = os.path.split(os.path.abspath(self.snapshot_path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False) as f:
+            json.dump(snapshot, f)
+        try:
+            os.replace(f.name, self.snapshot_path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+        with self.lock:
+            self.snapshot_mtime = os.path.getmtime(self.snapshot_path)
+
+    def _install_locked(self, routes):
+        stations = {}
+        for name, route in routes.items():
+            for order, stop in enumerate(route["stops"]):
+                # A train listed twice at a station keeps its first stop
+                stations.setdefault(station_key(stop[0]), {}).setdefault(name, order)
+        self.routes = routes
+        self.stations = stations
+
+    def _describe(self, name, route, from_order, to_order):
+        from_city, _, departure, _, from_offset = route["stops"][from_order]
+        to_city, arrival, _, to_offset, _ = route["stops"][to_order]
+        if from_offset is None or to_offset is None:
+            travel_time, sort_minutes = "", 24 * 60
+        else:
+            travel_minutes = to_offset - from_offset
+            travel_time, sort_minutes = f"{travel_minutes // 60}h {travel_minutes % 60}m", from_offset % 1440
+        return {
+            "trip_number": name,
+            "departure_time": departure or "",
+            "arrival_time": arrival or "",
+            "travel_time": travel_time,
+            "origin_city": from_city,
+            "destination_city": to_city,
+            "days": route["days"],
+            "sort_minutes": sort_minutes
+        }
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.warning(f"Corridor index: refresh failed: {e}")
+            time.sleep(min(self.refresh_interval, 600))
+
+    def _refresh(self):
+        if not self.snapshot_path:
+            if self._age_seconds() >= self.refresh_interval:
+                self.build()
+            return
+
+        self._reload_if_newer()
+        if self._age_seconds() < self.refresh_interval:
+            return
+        with open(f"{self.snapshot_path}.lock", 'a') as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Another worker is rebuilding; its snapshot is loaded on a later pass
+                    return
+            try:
+                # It may have finished just before the lock was ours
+                self._reload_if_newer()
+                if self._age_seconds() >= self.refresh_interval:
+                    self.build()
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload_if_newer(self):
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+        except OSError:
+            return
+        if mtime != self.snapshot_mtime:
+            self.load_snapshot()
+
+    def _age_seconds(self):
+        try:
+            return (datetime.now() - datetime.fromisoformat(self.built_at)).total_seconds()
+        except (TypeError, ValueError):
+            return float("inf")
+
+def station_key(name):
+    return name.strip().lower().replace('_', ' ')
+
+def parse_bst_minutes(time_str):
+    if not time_str or "BST" not in time_str:
+        return None
+    try:
+        hour_min, am_pm = time_str.replace(" BST", "").strip().split(' ')
+        hour, minute = map(int, hour_min.split(':'))
+    except ValueError:
+        return None
+    if am_pm.lower() == "pm" and hour != 12:
+        hour += 12
+    elif am_pm.lower() == "am" and hour == 12:
+        hour = 0
+    return hour * 60 + minute
+
+def build_stops(routes):
+    # Minute offsets are cumulative from the first departure so that overnight
+    # trains keep increasing past midnight.
+    stops = []
+    offset = None
+    previous = None
+    for stop in routes:
+        offsets = []
+        for time_str in (stop.get("arrival_time"), stop.get("departure_time")):
+            minutes = parse_bst_minutes(time_str)
+            if minutes is None:
+                offsets.append(None)
+                continue
+            offset = minutes if previous is None else offset + (minutes - previous) % 1440
+            previous = minutes
+            offsets.append(offset)
+        arrival = (stop.get("arrival_time") or "").replace(" BST", "").strip() or None
+        departure = (stop.get("departure_time") or "").replace(" BST", "").strip() or None
+        stops.append((stop["city"], arrival, departure, offsets[0], offsets[1]))
+    return stops
+
+if __name__ == "__main__":
+    import argparse
+    from matrixCalculator import fetch_train_data
+
+    parser = argparse.ArgumentParser(description="Build the offline corridor index snapshot from train routes")
+    parser.add_argument("--output", default="corridor_index.json")
+    parser.add_argument("--date", help="Route date as YYYY-MM-DD (default: tomorrow)")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with open('trains_en.json', 'r') as f:
+        trains = json.load(f)['trains']
+
+    CorridorIndex(trains, fetch_train_data, snapshot_path=args.output, workers=args.workers).build(args.date)
@@ -0,0 +1,111 @@
+import threading, time
+from collections import OrderedDict
+from rate_limiter import hash_credential
+
+AUTH_ERRORS = ("AUTH_TOKEN_EXPIRED", "AUTH_DEVICE_KEY_EXPIRED")
+
+class CredentialCache:
+    # Remembers, by a hash of the token and device key, whether upstream last accepted them,
+    # so that expired credentials are turned away before they take a queue slot
+    def __init__(self, probe, ttl=300, invalid_ttl=3600, max_entries=10000, clock=time.time):
+        self.probe = probe
+        self.ttl = ttl
+        self.invalid_ttl = invalid_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.lock = threading.Lock()
+        # credential hash -> (auth error or None, expires at), least recently used first
+        self.entries = OrderedDict()
+        self.checks = 0
+        self.valid_hits = 0
+        self.invalid_hits = 0
+        self.probes = 0
+        self.inconclusive = 0
+        # Matrix requests turned away before queueing, and ones that failed on credentials once queued
+        self.rejected = 0
+        self.late_auth_failures = 0
+        self.rejected_searches = 0
+
+    def check(self, auth_token, device_key, probe=True, queued=True):
+        # -> the auth error to reject with, or None to go ahead. Without probe, only what is
+        # already known is used, for callers whose own upstream call is as cheap as a probe.
+        if not auth_token or not device_key:
+            with self.lock:
+                self.checks += 1
+                self._count_rejection(queued)
+            return "AUTH_CREDENTIALS_REQUIRED"
+
+        key = hash_credential(f"{auth_token}\n{device_key}")
+        with self.lock:
+            self.checks += 1
+            entry = self.entries.get(key)
+            if entry and entry[1] > self.clock():
+                self.entries.move_to_end(key)
+                if entry[0]:
+                    self.invalid_hits += 1
+                    self._count_rejection(queued)
+                else:
+                    self.valid_hits += 1
+                return entry[0]
+            if not probe:
+                return None
+            self.probes += 1
+
+        try:
+            self.probe(auth_token, device_key)
+            error = None
+        except Exception as e:
+            if str(e) not in AUTH_ERRORS:
+                # Rate limits, outages and timeouts say nothing about the credentials; let the request decide
+                with self.lock:
+                    self.inconclusive += 1
+                return None
+            error = str(e)
+
+        self._store(key, error)
+        if error:
+            with self.lock:
+                self._count_rejection(queued)
+        return error
+
+    def mark_valid(self, auth_token, device_key):
+        if auth_token and device_key:
+            self._store(hash_credential(f"{auth_token}\n{device_key}"), None)
+
+    def mark_invalid(self, auth_token, device_key, error, queued=True):
+        # A request that got past the check and still failed on its credentials
+        if auth_token and device_key:
+            self._store(hash_credential(f"{auth_token}\n{device_key}"), error)
+            if queued:
+                with self.lock:
+                    self.late_auth_failures += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "checks": self.checks,
+                "valid_hits": self.valid_hits,
+                "invalid_hits": self.invalid_hits,
+                "probes": self.probes,
+                "inconclusive": self.inconclusive,
+                "rejected_before_queue": self.rejected,
+                "rejected_searches": self.rejected_searches,
+                "late_auth_failures": self.late_auth_failures,
+                # Of all requests that would have failed on their credentials, the share turned away up front
+                "avoided_queue_slot_rate": round(self.rejected / (self.rejected + self.late_auth_failures), 3)
+                                           if self.rejected + self.late_auth_failures else 0
+            }
+
+    def _count_rejection(self, queued):
+        if queued:
+            self.rejected += 1
+        else:
+            self.rejected_searches += 1
+
+    def _store(self, key, error):
+        with self.lock:
+            self.entries[key] = (error, self.clock() + (self.invalid_ttl if error else self.ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
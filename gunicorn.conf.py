@@ -0,0 +1,16 @@
+import os
+
+# Picked up automatically by `gunicorn app:app` from the project root.
+# GUNICORN_WORKER_CLASS=gevent serves many slow upstream-bound requests per worker.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+if worker_class == "gevent":
+    # Patch before the app (and with --preload, the master) creates any thread, lock or socket
+    from gevent import monkey
+    monkey.patch_all()
+
+def post_worker_init(worker):
+    # Queue, cleanup and refresher threads start here, in each worker, after the fork
+    from app import init_worker
+    init_worker()
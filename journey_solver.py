@@ -0,0 +1,216 @@
+import threading
+from collections import OrderedDict
+from matrixCalculator import result_version
+from matrix_codec import populated_seat_types
+
+# Added by the booking site to every ticket, as in the availability checker on matrix.html
+BOOKING_CHARGE = 20
+
+# Key in the leg tables for the cheapest leg of any seat type
+ANY_SEAT_TYPE = None
+
+def leg_tables(result, seat_types):
+    # seat type -> rows[i][j] = (ticket total, online seats, seat type) for a bookable leg i -> j,
+    # else None. ANY_SEAT_TYPE holds the cheapest of them, so mixed searches skip the k factor.
+    stations = result["stations"]
+    tables = {}
+    for seat_type in seat_types:
+        matrix = result["fare_matrices"][seat_type]
+        rows = []
+        for i, from_city in enumerate(stations):
+            row = [None] * len(stations)
+            cells = matrix.get(from_city, {})
+            for j in range(i + 1, len(stations)):
+                cell = cells.get(stations[j])
+                if cell and cell.get("online", 0) > 0:
+                    row[j] = (float(cell["fare"]) + float(cell.get("vat_amount", 0)) + BOOKING_CHARGE, cell["online"], seat_type)
+            rows.append(row)
+        tables[seat_type] = rows
+
+    tables[ANY_SEAT_TYPE] = [
+        [min((tables[seat_type][i][j] for seat_type in seat_types if tables[seat_type][i][j]),
+             key=lambda leg: (leg[0], -leg[1]), default=None) for j in range(len(stations))]
+        for i in range(len(stations))
+    ]
+    return tables
+
+def best_path(tables, seat_types, origin, destination, legs_first=False, min_seats=0):
+    # DP over the station order. labels[j] is the best (cost, legs) to reach j, or (legs, cost)
+    # with legs_first; both parts are sums, so it extends the best label at some i < j.
+    columns = [tables[seat_type] for seat_type in seat_types]
+    labels = [None] * (destination + 1)
+    labels[origin] = (0, 0.0) if legs_first else (0.0, 0)
+    back = {}
+    for j in range(origin + 1, destination + 1):
+        best = None
+        for i in range(origin, j):
+            label = labels[i]
+            if label is None:
+                continue
+            for rows in columns:
+                leg = rows[i][j]
+                if leg is None or leg[1] < min_seats:
+                    continue
+                candidate = (label[0] + 1, label[1] + leg[0]) if legs_first else (label[0] + leg[0], label[1] + 1)
+                if best is None or candidate < best:
+                    best = candidate
+                    back[j] = (i, leg[2])
+        labels[j] = best
+    if labels[destination] is None:
+        return None
+    path = []
+    j = destination
+    while j != origin:
+        i, seat_type = back[j]
+        path.append((i, j, seat_type))
+        j = i
+    return path[::-1]
+
+def widest_seats(tables, seat_types, origin, destination):
+    # Largest number of online seats that some itinerary keeps on every one of its legs
+    columns = [tables[seat_type] for seat_type in seat_types]
+    width = [0] * (destination + 1)
+    width[origin] = float("inf")
+    for j in range(origin + 1, destination + 1):
+        best = 0
+        for i in range(origin, j):
+            if width[i] <= best:
+                continue
+            for rows in columns:
+                leg = rows[i][j]
+                if leg is not None and leg[1] > best:
+                    best = min(width[i], leg[1])
+        width[j] = best
+    return width[destination]
+
+def direct_path(tables, seat_type, origin, destination):
+    # The through ticket on its own, so that a page can show it without loading the seat type's matrix
+    return [(origin, destination, seat_type)] if tables[seat_type][origin][destination] else None
+
+def solve(tables, seat_types, origin, destination):
+    # ANY_SEAT_TYPE only stands in for the full set of seat types the tables were built from
+    cheapest_legs = [ANY_SEAT_TYPE] if 1 < len(seat_types) == len(tables) - 1 else seat_types
+    cheapest = best_path(tables, cheapest_legs, origin, destination)
+    if cheapest is None:
+        return {"cheapest": None, "fewest_changes": None, "most_seats": None}
+    # Among itineraries that keep the most seats, the fewest changes and then the lowest fare
+    seats = widest_seats(tables, seat_types, origin, destination)
+    return {
+        "cheapest": cheapest,
+        "fewest_changes": best_path(tables, cheapest_legs, origin, destination, legs_first=True),
+        "most_seats": best_path(tables, seat_types, origin, destination, legs_first=True, min_seats=seats)
+    }
+
+def describe_itinerary(result, path):
+    if path is None:
+        return None
+    stations = result["stations"]
+    legs = []
+    for i, j, seat_type in path:
+        cell = result["fare_matrices"][seat_type][stations[i]][stations[j]]
+        base, vat = float(cell["fare"]), float(cell.get("vat_amount", 0))
+        legs.append({
+            "from": stations[i],
+            "to": stations[j],
+            "seat_type": seat_type,
+            "base": number(base),
+            "vat": number(vat),
+            "charge": BOOKING_CHARGE,
+            "total": number(base + vat + BOOKING_CHARGE),
+            "online": cell["online"],
+            "seats": cell["online"] + cell["offline"],
+            "date": result.get("station_dates", {}).get(stations[i])
+        })
+    return {
+        "legs": legs,
+        "total": number(sum(leg["total"] for leg in legs)),
+        "changes": len(legs) - 1,
+        "min_online_seats": min(leg["online"] for leg in legs),
+        "seat_types": list(dict.fromkeys(leg["seat_type"] for leg in legs))
+    }
+
+def number(value):
+    return int(value) if float(value).is_integer() else round(value, 2)
+
+class JourneySolver:
+    def __init__(self, max_entries=256, max_tables=32):
+        self.max_entries = max_entries
+        self.max_tables = max_tables
+        self.lock = threading.Lock()
+        # (result version, origin, destination, seat types) -> answer, least recently used first
+        self.entries = OrderedDict()
+        # result version -> (seat types, leg tables)
+        self.tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def solve(self, result, origin, destination, seat_types=None):
+        stations = result["stations"]
+        if origin not in stations or destination not in stations:
+            raise Exception("Both stations must be on this train's route.")
+        origin_index, destination_index = stations.index(origin), stations.index(destination)
+        if origin_index >= destination_index:
+            raise Exception("The destination must come after the origin on this train's route.")
+
+        populated = populated_seat_types(result)
+        seat_types = [seat_type for seat_type in (seat_types or populated) if seat_type in populated]
+        version = result.get("version") or result_version(result)
+        key = (version, origin, destination, tuple(seat_types))
+
+        with self.lock:
+            answer = self.entries.get(key)
+            if answer is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return answer
+            self.misses += 1
+
+        tables = self._tables(version, result, populated)
+        answer = {
+            "version": version,
+            "origin": origin,
+            "destination": destination,
+            "seat_types": seat_types,
+            "mixed": self._describe(result, solve(tables, seat_types, origin_index, destination_index)),
+            "by_seat_type": {
+                seat_type: {
+                    **self._describe(result, solve(tables, [seat_type], origin_index, destination_index)),
+                    "direct": describe_itinerary(result, direct_path(tables, seat_type, origin_index, destination_index))
+                }
+                for seat_type in seat_types
+            }
+        }
+
+        with self.lock:
+            self.entries[key] = answer
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return answer
+
+    def _tables(self, version, result, seat_types):
+        with self.lock:
+            cached = self.tables.get(version)
+            if cached is not None:
+                self.tables.move_to_end(version)
+                return cached
+        tables = leg_tables(result, seat_types)
+        with self.lock:
+            self.tables[version] = tables
+            while len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+        return tables
+
+    def _describe(self, result, paths):
+        return {objective: describe_itinerary(result, path) for objective, path in paths.items()}
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "tables": len(self.tables),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0
+            }
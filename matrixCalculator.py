@@ -1,14 +1,17 @@
-import requests
+import requests, json, hashlib, threading, time
 from datetime import datetime, timedelta
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from upstream import api_url, upstream_get, upstream_post
+from tracing import span, traced, propagate
 
 SEAT_TYPES = [
     "S_CHAIR", "SHOVAN", "SNIGDHA", "F_SEAT", "F_CHAIR", "AC_S", "F_BERTH", "AC_B", "SHULOV", "AC_CHAIR"
 ]
 
+@traced("upstream.train_routes", "model", "api_date")
 def fetch_train_data(model: str, api_date: str) -> dict:
-    url = "https://railspaapi.shohoz.com/v1.0/web/train-routes"
+    url = api_url("train-routes")
     payload = {
         "model": model,
         "departure_date_time": api_date
@@ -20,7 +23,7 @@ def fetch_train_data(model: str, api_date: str) -> dict:
 
     while retry_count < max_retries:
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = upstream_post(url, json=payload, headers=headers)
             
             if response.status_code == 429:
                 try:
@@ -58,8 +61,9 @@ def fetch_train_data(model: str, api_date: str) -> dict:
                     raise Exception("Currently we are experiencing high traffic. Please try again after some time.")
             raise
 
-def get_seat_availability(train_model: str, journey_date: str, from_city: str, to_city: str, auth_token: str, device_key: str) -> tuple:
-    url = "https://railspaapi.shohoz.com/v1.0/web/bookings/search-trips-v2"
+@traced("upstream.search_trips", "journey_date", "from_city", "to_city")
+def search_trips(journey_date: str, from_city: str, to_city: str, auth_token: str, device_key: str, timeout=None) -> dict:
+    url = api_url("bookings/search-trips-v2")
     params = {
         "from_city": from_city,
         "to_city": to_city,
@@ -76,7 +80,7 @@ def get_seat_availability(train_model: str, journey_date: str, from_city: str, t
 
     while retry_count < max_retries:
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = upstream_get(url, headers=headers, params=params, timeout=timeout)
             
             if response.status_code == 429:
                 try:
@@ -114,27 +118,17 @@ def get_seat_availability(train_model: str, journey_date: str, from_city: str, t
             response.raise_for_status()
             trains = response.json().get("data", {}).get("trains", [])
 
+            # Every train on the segment is in the response: {train model: seat info}
+            seat_infos = {}
             for train in trains:
-                if train.get("train_model") == train_model:
-                    seat_info = {stype: {"online": 0, "offline": 0, "fare": 0, "vat_amount": 0} for stype in SEAT_TYPES}
-                    for seat in train.get("seat_types", []):
-                        stype = seat["type"]
-                        if stype in seat_info:
-                            fare = float(seat["fare"])
-                            vat_amount = float(seat["vat_amount"])
-                            if stype in ["AC_B", "F_BERTH"]:
-                                fare += 50
-                            seat_info[stype] = {
-                                "online": seat["seat_counts"]["online"],
-                                "offline": seat["seat_counts"]["offline"],
-                                "fare": fare,
-                                "vat_amount": vat_amount
-                            }
-                    return (from_city, to_city, seat_info)
-
-            return (from_city, to_city, None)
+                if train.get("train_model") and train["train_model"] not in seat_infos:
+                    seat_infos[train["train_model"]] = parse_seat_info(train)
+            return seat_infos
 
         except requests.RequestException as e:
+            if isinstance(e, requests.Timeout):
+                # Not the same as a segment with no trains
+                raise Exception("Upstream search timed out")
             status_code = e.response.status_code if e.response is not None else None
             
             if status_code == 429:
@@ -163,7 +157,31 @@ def get_seat_availability(train_model: str, journey_date: str, from_city: str, t
                     
             if hasattr(e, 'response') and e.response and e.response.status_code == 403:
                 raise Exception("Currently we are experiencing high traffic. Please try again after some time.")
-            return (from_city, to_city, None)
+            return {}
+
+def parse_seat_info(train):
+    seat_info = {stype: {"online": 0, "offline": 0, "fare": 0, "vat_amount": 0} for stype in SEAT_TYPES}
+    for seat in train.get("seat_types", []):
+        stype = seat["type"]
+        if stype in seat_info:
+            fare = float(seat["fare"])
+            vat_amount = float(seat["vat_amount"])
+            if stype in ["AC_B", "F_BERTH"]:
+                fare += 50
+            seat_info[stype] = {
+                "online": seat["seat_counts"]["online"],
+                "offline": seat["seat_counts"]["offline"],
+                "fare": fare,
+                "vat_amount": vat_amount
+            }
+    return seat_info
+
+def result_version(result: dict) -> str:
+    payload = json.dumps(
+        {key: result.get(key) for key in ("train_model", "date", "stations", "fare_matrices", "routes", "station_dates")},
+        sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:20]
 
 def clean_halt_times(routes):
     for stop in routes:
@@ -211,26 +229,17 @@ def clean_halt_times(routes):
             except Exception:
                 continue
 
-def compute_matrix(train_model: str, journey_date_str: str, api_date_format: str, auth_token: str, device_key: str) -> dict:
-    train_data = fetch_train_data(train_model, api_date_format)
-    if not train_data or not train_data.get("train_name") or not train_data.get("routes"):
-        raise Exception("No information found for this train. Please try another train or date.")
-
-    clean_halt_times(train_data['routes'])
+MAX_REASONABLE_GAP_HOURS = 12
 
-    stations = [r['city'] for r in train_data['routes']]
-    days = train_data['days']
-    train_name = train_data['train_name']
-    routes = train_data['routes']
-    base_date = datetime.strptime(journey_date_str, "%d-%b-%Y")
-    current_date = base_date
+def schedule_offsets(routes):
+    # Day offset of each station from the journey date, and of the stops either side of a
+    # midnight crossing whose date is shown. Depends only on the timetable, not on the date.
+    offsets = {}
+    display_offsets = {}
+    offset = 0
     previous_time = None
 
-    MAX_REASONABLE_GAP_HOURS = 12
-
-    station_dates = {}
     for i, stop in enumerate(routes):
-        stop["display_date"] = None
         time_str = stop.get("departure_time") or stop.get("arrival_time")
 
         if time_str and "BST" in time_str:
@@ -247,69 +256,110 @@ def compute_matrix(train_model: str, journey_date_str: str, api_date_format: str
 
                 current_time = timedelta(hours=hour, minutes=minute)
 
-                if previous_time is not None:
-                    time_diff = (current_time - previous_time).total_seconds() / 3600
-                    if current_time < previous_time:
-                        time_diff = ((current_time + timedelta(days=1)) - previous_time).total_seconds() / 3600
-                        if time_diff < MAX_REASONABLE_GAP_HOURS:
-                            routes[i - 1]["display_date"] = current_date.strftime("%d %b")
-                            current_date += timedelta(days=1)
-                            stop["display_date"] = current_date.strftime("%d %b")
-                        else:
-                            hours = int(time_diff)
-                            minutes = int((time_diff - hours) * 60)
+                if previous_time is not None and current_time < previous_time:
+                    time_diff = ((current_time + timedelta(days=1)) - previous_time).total_seconds() / 3600
+                    if time_diff < MAX_REASONABLE_GAP_HOURS:
+                        display_offsets[i - 1] = offset
+                        offset += 1
+                        display_offsets[i] = offset
 
                 previous_time = current_time
             except Exception:
                 continue
 
-        station_dates[stop['city']] = current_date.strftime("%Y-%m-%d")
+        offsets[stop['city']] = offset
 
-    total_duration = train_data.get('total_duration', 'N/A')
+    return offsets, display_offsets
 
-    weekday_short = datetime.strptime(journey_date_str, "%d-%b-%Y").strftime("%a")
-    weekday_full = datetime.strptime(journey_date_str, "%d-%b-%Y").strftime("%A")
-    
-    # Comment out these two lines below as trains run every day temporarily on EID journey
-    if weekday_short not in days:
-        raise Exception(f"{train_name} does not run on {weekday_full}.")
+def dated_schedule(routes, offsets, display_offsets, journey_date_str):
+    base_date = datetime.strptime(journey_date_str, "%d-%b-%Y")
+    dated_routes = [
+        dict(stop, display_date=(base_date + timedelta(days=display_offsets[i])).strftime("%d %b") if i in display_offsets else None)
+        for i, stop in enumerate(routes)
+    ]
+    station_dates = {
+        station: (base_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+        for station, offset in offsets.items()
+    }
+    return dated_routes, station_dates
+
+def runs_on(days, journey_date_str):
+    return datetime.strptime(journey_date_str, "%d-%b-%Y").strftime("%a") in days
+
+class CallPacer:
+    # Spaces calls at most calls_per_second apart across all fan-out threads. None leaves a single
+    # date's fan-out unpaced; 0 falls back to the default, so range and batch jobs are always paced
+    DEFAULT_CALLS_PER_SECOND = 10
+
+    def __init__(self, calls_per_second=None):
+        if calls_per_second is None:
+            self.interval = 0
+        else:
+            self.interval = 1 / (calls_per_second if calls_per_second > 0 else self.DEFAULT_CALLS_PER_SECOND)
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
+def station_pairs(stations):
+    return [(from_city, to_city) for i, from_city in enumerate(stations) for to_city in stations[i + 1:]]
+
+def fetch_trips(lookups, auth_token, device_key, max_calls_per_second=None):
+    # lookups: unique (journey date, from city, to city) tuples -> {lookup: {train model: seat_info}}
+    pacer = CallPacer(max_calls_per_second)
+
+    def lookup_trips(journey_date, from_city, to_city):
+        pacer.wait()
+        return search_trips(journey_date, from_city, to_city, auth_token, device_key)
+
+    trips = {}
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = {executor.submit(propagate(lookup_trips), *lookup): lookup for lookup in lookups}
+        try:
+            for future in as_completed(futures):
+                trips[futures[future]] = future.result()
+        except Exception:
+            # One failure fails the whole matrix, so stop spending upstream calls on it
+            for future in futures:
+                future.cancel()
+            raise
+    return trips
+
+def fetch_seat_availability(lookups, train_model, auth_token, device_key, max_calls_per_second=None):
+    # lookups -> {lookup: seat_info or None} for one train
+    trips = fetch_trips(lookups, auth_token, device_key, max_calls_per_second)
+    return {lookup: seat_infos.get(train_model) for lookup, seat_infos in trips.items()}
+
+def pair_lookup(station_dates, from_city, to_city):
+    journey_date = datetime.strptime(station_dates[from_city], "%Y-%m-%d").strftime("%d-%b-%Y")
+    return (journey_date, from_city, to_city)
+
+def build_fare_matrices(stations, station_dates, seat_infos):
     fare_matrices = {
         seat_type: {from_city: {} for from_city in stations} for seat_type in SEAT_TYPES
     }
-
     seat_type_has_data = {seat_type: False for seat_type in SEAT_TYPES}
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [
-            executor.submit(
-                get_seat_availability,
-                train_model,
-                datetime.strptime(station_dates[from_city], "%Y-%m-%d").strftime("%d-%b-%Y"),
-                from_city,
-                to_city,
-                auth_token,
-                device_key
+    for from_city, to_city in station_pairs(stations):
+        seat_info = seat_infos[pair_lookup(station_dates, from_city, to_city)]
+        for seat_type in SEAT_TYPES:
+            fare_matrices[seat_type][from_city][to_city] = (
+                seat_info.get(seat_type, {"online": 0, "offline": 0, "fare": 0})
+                if seat_info else {"online": 0, "offline": 0, "fare": 0}
             )
-            for i, from_city in enumerate(stations)
-            for j, to_city in enumerate(stations)
-            if i < j
-        ]
-        for future in as_completed(futures):
-            from_city, to_city, seat_info = future.result()
-            for seat_type in SEAT_TYPES:
-                fare_matrices[seat_type][from_city][to_city] = (
-                    seat_info.get(seat_type, {"online": 0, "offline": 0, "fare": 0})
-                    if seat_info else {"online": 0, "offline": 0, "fare": 0}
-                )
-                if seat_info:
-                    for seat_type in SEAT_TYPES:
-                        if seat_info[seat_type]["online"] + seat_info[seat_type]["offline"] > 0:
-                            seat_type_has_data[seat_type] = True
-
-    if not any(seat_type_has_data.values()):
-        raise Exception("No seats available for the selected train and date. Please try a different date or train.")
-    
+            if seat_info and seat_info[seat_type]["online"] + seat_info[seat_type]["offline"] > 0:
+                seat_type_has_data[seat_type] = True
+    return fare_matrices, seat_type_has_data
+
+def assemble_result(train_model, train_data, journey_date_str, stations, routes, station_dates, fare_matrices, seat_type_has_data):
     station_dates_formatted = {
         station: datetime.strptime(date_str, "%Y-%m-%d").strftime("%d-%b-%Y")
         for station, date_str in station_dates.items()
@@ -326,20 +376,214 @@ def compute_matrix(train_model: str, journey_date_str: str, api_date_format: str
         next_day_str = next_day_obj.strftime("%d-%b-%Y")
         prev_day_str = prev_day_obj.strftime("%d-%b-%Y")
 
-    return {
+    result = {
         "train_model": train_model,
-        "train_name": train_name,
+        "train_name": train_data['train_name'],
         "date": journey_date_str,
         "stations": stations,
         "seat_types": SEAT_TYPES,
         "fare_matrices": fare_matrices,
         "has_data_map": seat_type_has_data,
         "routes": routes,
-        "days": days,
-        "total_duration": total_duration,
+        "days": train_data['days'],
+        "total_duration": train_data.get('total_duration', 'N/A'),
         "station_dates": station_dates,
         "station_dates_formatted": station_dates_formatted,
         "has_segmented_dates": has_segmented_dates,
         "next_day_str": next_day_str,
         "prev_day_str": prev_day_str,
-    }
\ No newline at end of file
+    }
+    result["version"] = result_version(result)
+    return result
+
+def fetch_route(train_model, api_date_format):
+    train_data = fetch_train_data(train_model, api_date_format)
+    if not train_data or not train_data.get("train_name") or not train_data.get("routes"):
+        raise Exception("No information found for this train. Please try another train or date.")
+    return train_data
+
+@traced("compute_matrix", "train_model", "journey_date_str")
+def compute_matrix(train_model: str, journey_date_str: str, api_date_format: str, auth_token: str, device_key: str) -> dict:
+    train_data = fetch_route(train_model, api_date_format)
+
+    with span("normalise_schedule"):
+        clean_halt_times(train_data['routes'])
+        stations = [r['city'] for r in train_data['routes']]
+        offsets, display_offsets = schedule_offsets(train_data['routes'])
+        routes, station_dates = dated_schedule(train_data['routes'], offsets, display_offsets, journey_date_str)
+
+    # Comment out these two lines below as trains run every day temporarily on EID journey
+    if not runs_on(train_data['days'], journey_date_str):
+        weekday_full = datetime.strptime(journey_date_str, "%d-%b-%Y").strftime("%A")
+        raise Exception(f"{train_data['train_name']} does not run on {weekday_full}.")
+
+    with span("pair_fanout", pairs=len(stations) * (len(stations) - 1) // 2):
+        lookups = {pair_lookup(station_dates, from_city, to_city) for from_city, to_city in station_pairs(stations)}
+        seat_infos = fetch_seat_availability(lookups, train_model, auth_token, device_key)
+
+    with span("aggregate"):
+        fare_matrices, seat_type_has_data = build_fare_matrices(stations, station_dates, seat_infos)
+        if not any(seat_type_has_data.values()):
+            raise Exception("No seats available for the selected train and date. Please try a different date or train.")
+        return assemble_result(train_model, train_data, journey_date_str, stations, routes, station_dates, fare_matrices, seat_type_has_data)
+
+@traced("compute_matrix_range", "train_model")
+def compute_matrix_range(train_model: str, journey_dates: list, auth_token: str, device_key: str, max_calls_per_second: float = 0) -> dict:
+    # One route fetch and one shared fan-out for several journey dates of the same train
+    api_date_format = datetime.strptime(journey_dates[0], "%d-%b-%Y").strftime("%Y-%m-%d")
+    train_data = fetch_route(train_model, api_date_format)
+    train_name = train_data['train_name']
+
+    with span("normalise_schedule", dates=len(journey_dates)):
+        clean_halt_times(train_data['routes'])
+        stations = [r['city'] for r in train_data['routes']]
+        offsets, display_offsets = schedule_offsets(train_data['routes'])
+
+        skipped = {}
+        schedules = {}
+        for journey_date_str in journey_dates:
+            if not runs_on(train_data['days'], journey_date_str):
+                weekday_full = datetime.strptime(journey_date_str, "%d-%b-%Y").strftime("%A")
+                skipped[journey_date_str] = f"{train_name} does not run on {weekday_full}."
+                continue
+            schedules[journey_date_str] = dated_schedule(train_data['routes'], offsets, display_offsets, journey_date_str)
+
+    lookups = {
+        pair_lookup(station_dates, from_city, to_city)
+        for _, station_dates in schedules.values()
+        for from_city, to_city in station_pairs(stations)
+    }
+    with span("pair_fanout", pairs=len(lookups), dates=len(schedules)):
+        seat_infos = fetch_seat_availability(lookups, train_model, auth_token, device_key, max_calls_per_second)
+
+    with span("aggregate"):
+        results = {}
+        for journey_date_str, (routes, station_dates) in schedules.items():
+            fare_matrices, seat_type_has_data = build_fare_matrices(stations, station_dates, seat_infos)
+            if not any(seat_type_has_data.values()):
+                skipped[journey_date_str] = "No seats available."
+                continue
+            results[journey_date_str] = assemble_result(
+                train_model, train_data, journey_date_str, stations, routes, station_dates, fare_matrices, seat_type_has_data
+            )
+
+        if not results:
+            raise Exception("No seats available for the selected train on any of these dates. Please try different dates or another train.")
+
+        cube = availability_cube(results)
+        return {
+            "range": True,
+            "train_model": train_model,
+            "train_name": train_name,
+            "stations": stations,
+            "dates": journey_dates,
+            "skipped": skipped,
+            "results": results,
+            "versions": {journey_date_str: result["version"] for journey_date_str, result in results.items()},
+            "cube": cube,
+            "best_dates": best_dates(cube, journey_dates, stations)
+        }
+
+def availability_cube(results):
+    # date -> from -> to -> {seat type: seats}, keeping only segments and seat types with seats
+    cube = {}
+    for journey_date_str, result in results.items():
+        segments = {}
+        for seat_type in SEAT_TYPES:
+            if not result["has_data_map"][seat_type]:
+                continue
+            for from_city, row in result["fare_matrices"][seat_type].items():
+                for to_city, cell in row.items():
+                    seats = cell["online"] + cell["offline"]
+                    if seats > 0:
+                        segments.setdefault(from_city, {}).setdefault(to_city, {})[seat_type] = seats
+        cube[journey_date_str] = segments
+    return cube
+
+def best_dates(cube, journey_dates, stations):
+    # from -> to -> the date with the most seats on that segment (earliest on a tie)
+    summary = {}
+    for from_city, to_city in station_pairs(stations):
+        best = None
+        available_dates = 0
+        for journey_date_str in journey_dates:
+            seats_by_type = cube.get(journey_date_str, {}).get(from_city, {}).get(to_city)
+            if not seats_by_type:
+                continue
+            available_dates += 1
+            seats = sum(seats_by_type.values())
+            if best is None or seats > best["seats"]:
+                best = {
+                    "date": journey_date_str,
+                    "seats": seats,
+                    "seat_type": max(seats_by_type, key=seats_by_type.get)
+                }
+        if best:
+            best["available_dates"] = available_dates
+            summary.setdefault(from_city, {})[to_city] = best
+    return summary
+
+@traced("compute_corridor_matrices", "journey_date_str")
+def compute_corridor_matrices(train_models: list, journey_date_str: str, api_date_format: str, auth_token: str, device_key: str, max_calls_per_second: float = 0) -> dict:
+    # Matrices for several trains on one date from a single fan-out: every search-trips
+    # response lists all trains on its segment, so each (date, from, to) is queried once
+    skipped = {}
+    with span("fetch_routes", trains=len(train_models)):
+        with ThreadPoolExecutor(max_workers=min(len(train_models), 5)) as executor:
+            futures = {model: executor.submit(propagate(fetch_route), model, api_date_format) for model in train_models}
+        train_datas = {}
+        for model, future in futures.items():
+            try:
+                train_datas[model] = future.result()
+            except Exception as e:
+                skipped[model] = str(e)
+
+    with span("normalise_schedule", trains=len(train_datas)):
+        schedules = {}
+        for model, train_data in train_datas.items():
+            if not runs_on(train_data['days'], journey_date_str):
+                weekday_full = datetime.strptime(journey_date_str, "%d-%b-%Y").strftime("%A")
+                skipped[model] = f"{train_data['train_name']} does not run on {weekday_full}."
+                continue
+            clean_halt_times(train_data['routes'])
+            stations = [r['city'] for r in train_data['routes']]
+            offsets, display_offsets = schedule_offsets(train_data['routes'])
+            routes, station_dates = dated_schedule(train_data['routes'], offsets, display_offsets, journey_date_str)
+            lookups = {pair_lookup(station_dates, from_city, to_city) for from_city, to_city in station_pairs(stations)}
+            schedules[model] = (stations, routes, station_dates, lookups)
+
+    all_lookups = set().union(*(lookups for _, _, _, lookups in schedules.values()))
+    separate_calls = sum(len(lookups) for _, _, _, lookups in schedules.values())
+    with span("pair_fanout", pairs=len(all_lookups), trains=len(schedules), separate_pairs=separate_calls):
+        trips = fetch_trips(all_lookups, auth_token, device_key, max_calls_per_second)
+
+    with span("aggregate"):
+        results = {}
+        for model, (stations, routes, station_dates, lookups) in schedules.items():
+            seat_infos = {lookup: trips[lookup].get(model) for lookup in lookups}
+            fare_matrices, seat_type_has_data = build_fare_matrices(stations, station_dates, seat_infos)
+            if not any(seat_type_has_data.values()):
+                skipped[model] = "No seats available."
+                continue
+            results[model] = assemble_result(
+                model, train_datas[model], journey_date_str, stations, routes, station_dates, fare_matrices, seat_type_has_data
+            )
+
+        if not results:
+            raise Exception("No seats available on any of the selected trains for this date. Please try a different date.")
+
+        return {
+            "corridor": True,
+            "date": journey_date_str,
+            "train_models": train_models,
+            "train_names": {model: train_data['train_name'] for model, train_data in train_datas.items()},
+            "skipped": skipped,
+            "results": results,
+            "versions": {model: result["version"] for model, result in results.items()},
+            "savings": {
+                "separate_calls": separate_calls,
+                "batched_calls": len(all_lookups),
+                "saved_calls": separate_calls - len(all_lookups),
+                "saved_percent": round((separate_calls - len(all_lookups)) * 100 / separate_calls, 1) if separate_calls else 0
+            }
+        }
@@ -0,0 +1,51 @@
+FIELDS = (("online", "online"), ("offline", "offline"), ("fare", "fare"), ("vat", "vat_amount"))
+
+def populated_seat_types(result):
+    has_data_map = result.get("has_data_map", {})
+    return [seat_type for seat_type in result["seat_types"] if has_data_map.get(seat_type)]
+
+def encode_columnar(result, seat_types=None):
+    # Cells are laid out once per seat type as flat arrays over the upper triangle
+    # of the station matrix in row-major order: (0,1), (0,2) ... (0,n-1), (1,2) ...
+    stations = result["stations"]
+    fare_matrices = result["fare_matrices"]
+    seat_types = populated_seat_types(result) if seat_types is None else seat_types
+
+    matrices = {}
+    for seat_type in seat_types:
+        matrix = fare_matrices[seat_type]
+        columns = {name: [] for name, _ in FIELDS}
+        for i, from_city in enumerate(stations):
+            row = matrix.get(from_city, {})
+            for to_city in stations[i + 1:]:
+                cell = row.get(to_city) or {}
+                for name, key in FIELDS:
+                    value = cell.get(key, 0)
+                    columns[name].append(int(value) if float(value).is_integer() else value)
+        matrices[seat_type] = columns
+
+    return {
+        "version": result.get("version"),
+        "train_model": result.get("train_model"),
+        "train_name": result.get("train_name"),
+        "date": result.get("date"),
+        "layout": "upper_triangle_row_major",
+        "stations": stations,
+        "station_dates": [result.get("station_dates_formatted", {}).get(station, result.get("date")) for station in stations],
+        "seat_types": seat_types,
+        "matrices": matrices
+    }
+
+def decode_columnar(payload):
+    stations = payload["stations"]
+    fare_matrices = {}
+
+    for seat_type, columns in payload["matrices"].items():
+        matrix = {from_city: {} for from_city in stations}
+        index = 0
+        for i, from_city in enumerate(stations):
+            for to_city in stations[i + 1:]:
+                matrix[from_city][to_city] = {key: columns[name][index] for name, key in FIELDS}
+                index += 1
+        fare_matrices[seat_type] = matrix
+    return fare_matrices
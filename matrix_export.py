@@ -0,0 +1,61 @@
+import csv, json
+from matrix_codec import FIELDS, populated_seat_types
+
+EXPORT_COLUMNS = ["train", "date", "from", "to", "seat_type", "online", "offline", "fare", "vat"]
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+def export_rows(result):
+    # One row per seat type and station pair, walked straight off the result as it is read
+    stations = result["stations"]
+    train, journey_date = result.get("train_name") or result.get("train_model"), result.get("date")
+    for seat_type in populated_seat_types(result):
+        matrix = result["fare_matrices"][seat_type]
+        for i, from_city in enumerate(stations):
+            row = matrix.get(from_city, {})
+            for to_city in stations[i + 1:]:
+                cell = row.get(to_city) or {}
+                values = [cell.get(key, 0) for _, key in FIELDS]
+                yield [train, journey_date, from_city, to_city, seat_type] + [
+                    int(value) if float(value).is_integer() else value for value in values
+                ]
+
+def batch_rows(results):
+    for result in results:
+        yield from export_rows(result)
+
+class _Lines:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+def csv_chunks(rows, rows_per_chunk=500):
+    buffer = _Lines()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield "".join(buffer.lines)
+            buffer.lines.clear()
+    yield "".join(buffer.lines)
+
+def ndjson_chunks(rows, rows_per_chunk=500):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+        if len(lines) == rows_per_chunk:
+            yield "".join(lines)
+            lines.clear()
+    if lines:
+        yield "".join(lines)
+
+def export_chunks(results, export_format="csv", rows_per_chunk=500):
+    # results may be a single matrix result or any iterable of them; consumed lazily
+    if export_format not in EXPORT_FORMATS:
+        raise Exception(f"Unsupported export format: {export_format}")
+    if isinstance(results, dict):
+        results = [results]
+    chunks = csv_chunks if export_format == "csv" else ndjson_chunks
+    return chunks(batch_rows(results), rows_per_chunk)
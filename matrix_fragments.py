@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from jinja2.utils import htmlsafe_json_dumps
+from matrixCalculator import result_version
+from matrix_codec import populated_seat_types
+
+class MatrixFragmentCache:
+    def __init__(self, jinja_env, max_entries=64, eager_seat_types=1):
+        self.jinja_env = jinja_env
+        self.max_entries = max_entries
+        self.eager_seat_types = eager_seat_types
+        self.lock = threading.Lock()
+        # (result version, fragment name) -> rendered fragment, least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, result):
+        return self._cached(result, "page", self.render)
+
+    def get_table(self, result, seat_type):
+        return self._cached(result, f"table:{seat_type}", lambda r: self.render_table(r, seat_type))
+
+    def _cached(self, result, name, builder):
+        key = (result.get("version") or result_version(result), name)
+
+        with self.lock:
+            fragment = self.entries.get(key)
+            if fragment is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        fragment = builder(result)
+
+        with self.lock:
+            self.entries[key] = fragment
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return fragment
+
+    def render(self, result):
+        populated = populated_seat_types(result)
+        eager = populated[:self.eager_seat_types]
+        return {
+            "route": Markup(self.jinja_env.get_template('matrix_route.html').render(**result)),
+            "tables": Markup(self.jinja_env.get_template('matrix_tables.html').render(**result, eager_seat_types=eager)),
+            "populated_seat_types": populated,
+            "fare_matrices_json": self._json({seat_type: result["fare_matrices"][seat_type] for seat_type in eager})
+        }
+
+    def render_table(self, result, seat_type):
+        return Markup(self.jinja_env.get_template('matrix_table.html').render(**result, seat_type=seat_type))
+
+    def _json(self, value):
+        policies = self.jinja_env.policies
+        return htmlsafe_json_dumps(value, dumps=policies["json.dumps_function"], **policies["json.dumps_kwargs"])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0
+            }
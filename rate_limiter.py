@@ -0,0 +1,133 @@
+import threading, time, sqlite3, hashlib, math
+from collections import defaultdict
+
+class MemoryBucketStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.rejections = defaultdict(int)
+        self.calls = 0
+
+    def take(self, keys, capacity, refill_rate, now):
+        # One token from every bucket, or none from any: a request turned away by one bucket
+        # does not spend from the others
+        with self.lock:
+            levels = {}
+            for key in keys:
+                tokens, updated = self.buckets.get(key, (capacity, now))
+                levels[key] = min(capacity, tokens + (now - updated) * refill_rate)
+
+            allowed = all(tokens >= 1 for tokens in levels.values())
+            for key, tokens in levels.items():
+                self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+
+            self.calls += 1
+            if self.calls % 1000 == 0:
+                self._prune_locked(now)
+            return allowed, min(levels.values())
+
+    def record_rejection(self, bucket):
+        with self.lock:
+            self.rejections[bucket] += 1
+
+    def get_rejections(self):
+        with self.lock:
+            return dict(self.rejections)
+
+    def _prune_locked(self, now, idle_seconds=3600):
+        stale = [key for key, (_, updated) in self.buckets.items() if now - updated > idle_seconds]
+        for key in stale:
+            del self.buckets[key]
+
+class SqliteBucketStore:
+    def __init__(self, path):
+        self.path = path
+        # One connection per process behind a lock rather than per thread: under gevent
+        # every request is its own greenlet, and thread-locals would open a connection each.
+        self.lock = threading.Lock()
+        self.conn = None
+        self.calls = 0
+        with self.lock:
+            conn = self._connection()
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS rejections (bucket TEXT PRIMARY KEY, count INTEGER)")
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        return self.conn
+
+    def take(self, keys, capacity, refill_rate, now):
+        with self.lock:
+            return self._take_locked(keys, capacity, refill_rate, now)
+
+    def _take_locked(self, keys, capacity, refill_rate, now):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = {}
+            for key in keys:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                levels[key] = min(capacity, tokens + (now - updated) * refill_rate)
+
+            allowed = all(tokens >= 1 for tokens in levels.values())
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, tokens - 1 if allowed else tokens, now) for key, tokens in levels.items()]
+            )
+
+            self.calls += 1
+            if self.calls % 1000 == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, min(levels.values())
+
+    def record_rejection(self, bucket):
+        with self.lock:
+            self._connection().execute(
+                "INSERT INTO rejections (bucket, count) VALUES (?, 1) "
+                "ON CONFLICT(bucket) DO UPDATE SET count = count + 1",
+                (bucket,)
+            )
+
+    def get_rejections(self):
+        with self.lock:
+            rows = self._connection().execute("SELECT bucket, count FROM rejections").fetchall()
+        return dict(rows)
+
+class RateLimiter:
+    def __init__(self, limits, store=None):
+        # limits: bucket name -> (burst capacity, tokens refilled per minute)
+        self.limits = limits
+        self.store = store or MemoryBucketStore()
+
+    def check(self, bucket, client_ip, auth_token=None):
+        capacity, per_minute = self.limits[bucket]
+        refill_rate = per_minute / 60.0
+        now = time.time()
+
+        keys = [f"{bucket}:ip:{client_ip}"]
+        if auth_token:
+            keys.append(f"{bucket}:token:{hash_credential(auth_token)}")
+
+        allowed, tokens = self.store.take(keys, capacity, refill_rate, now)
+        if not allowed:
+            self.store.record_rejection(bucket)
+            retry_after = max(1, math.ceil((1 - tokens) / refill_rate))
+            return retry_after
+        return None
+
+    def get_stats(self):
+        rejections = self.store.get_rejections()
+        return {
+            "rejected": {bucket: rejections.get(bucket, 0) for bucket in self.limits},
+            "store": type(self.store).__name__
+        }
+
+def hash_credential(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
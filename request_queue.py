@@ -1,64 +1,152 @@
-import threading, time, uuid, queue, random
+import threading, time, uuid, random, heapq, math, os, weakref
 from typing import Dict, Any, Optional, Callable
-from datetime import datetime, timedelta
-from collections import deque, OrderedDict
+from datetime import datetime
+from collections import deque
+from result_store import ResultStore
+from tracing import TRACER, span
+
+class QueuedRequest:
+    __slots__ = ('request_id', 'request_func', 'params', 'status', 'created_at',
+                 'timestamp', 'last_heartbeat', 'position', 'estimated_time')
+
+    def __init__(self, request_id, request_func, params, created_at, timestamp):
+        self.request_id = request_id
+        self.request_func = request_func
+        self.params = params
+        self.status = "queued"
+        self.created_at = created_at
+        self.timestamp = timestamp
+        self.last_heartbeat = timestamp
+        self.position = 0
+        self.estimated_time = 0
+
+    def to_status(self):
+        return {
+            "status": self.status,
+            "position": self.position,
+            "created_at": self.created_at,
+            "estimated_time": self.estimated_time,
+            "last_heartbeat": self.last_heartbeat
+        }
 
 class RequestQueue:
-    def __init__(self, max_concurrent=1, cooldown_period=3, batch_cleanup_threshold=10, cleanup_interval=30, heartbeat_timeout=60):
-        self.queue = queue.Queue()
-        self.results = {}
-        self.statuses = {}
+    def __init__(self, max_concurrent=1, cooldown_period=3, batch_cleanup_threshold=10, cleanup_interval=30, heartbeat_timeout=60,
+                 result_memory_limit=64 * 1024 * 1024, result_spill_dir=None, max_queue_depth=0, max_predicted_wait=0,
+                 clock=time.time, sleep=time.sleep, autostart=True):
+        # clock, sleep and autostart let benchmarks drive the queue on virtual time via process_batch()
+        self.clock = clock
+        self.sleep = sleep
+        self.autostart = autostart
+        self.queue = deque()
+        self.requests: Dict[str, QueuedRequest] = {}
+        self.results = ResultStore(max_bytes=result_memory_limit, spill_dir=result_spill_dir)
         self.max_concurrent = max_concurrent
         self.cooldown_period = cooldown_period
         self.active_requests = 0
         self.lock = threading.Lock()
         self.last_request_time = None
         
-        self.queue_order = OrderedDict()
         self.cancelled_requests = set()
         
-        self.requests = {}
         self.processing_history = deque(maxlen=50)
         self.abandonment_history = deque(maxlen=100)
         self.avg_processing_time = 8.0
         self.cleanup_interval = cleanup_interval
-        self.last_cleanup = time.time()
+        self.last_cleanup = self.clock()
         self.batch_cleanup_threshold = batch_cleanup_threshold
         self.heartbeat_timeout = heartbeat_timeout
+        self.result_ttl = 1800
+        self.max_queue_depth = max_queue_depth
+        self.max_predicted_wait = max_predicted_wait
+        self.rejected_requests = 0
         
-        self.worker_thread = threading.Thread(target=self._process_queue)
-        self.worker_thread.daemon = True
-        self.worker_thread.start()
+        # Min-heaps of (deadline, request_id). Heartbeat entries are refreshed lazily:
+        # a popped deadline is re-pushed if the record has been heard from since.
+        self.heartbeat_deadlines = []
+        self.result_expiries = []
         
-        self.enhanced_cleanup_thread = threading.Thread(target=self._enhanced_cleanup_loop)
-        self.enhanced_cleanup_thread.daemon = True
-        self.enhanced_cleanup_thread.start()
+        # Threads are started by start(), not here, so that importing the app (including in a
+        # gunicorn --preload master) leaves no threads behind to die silently at fork.
+        self.worker_thread = None
+        self.enhanced_cleanup_thread = None
+        self.started_pid = None
+        
+        # A fork can copy the lock while another thread holds it; the child gets a fresh one
+        # before any of its own threads can touch the queue
+        if hasattr(os, "register_at_fork"):
+            queue_ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: queue_ref() and queue_ref()._after_fork())
+    
+    def _after_fork(self):
+        self.lock = threading.Lock()
+    
+    def start(self):
+        # Forked after starting: the threads did not survive, so the child starts its own
+        with self.lock:
+            if self.started_pid == os.getpid():
+                return
+            self.started_pid = os.getpid()
+            
+            self.worker_thread = threading.Thread(target=self._process_queue)
+            self.worker_thread.daemon = True
+            self.worker_thread.start()
+            
+            self.enhanced_cleanup_thread = threading.Thread(target=self._enhanced_cleanup_loop)
+            self.enhanced_cleanup_thread.daemon = True
+            self.enhanced_cleanup_thread.start()
     
     def add_request(self, request_func, params):
+        # -> (request id, None) once queued, or (None, retry after seconds) when the queue is full.
+        # The limit is checked under the same lock as the append, so concurrent submissions
+        # cannot all pass it and overshoot together.
+        if self.autostart:
+            self.start()
         request_id = str(uuid.uuid4())
-        current_time = datetime.now()
+        now = self.clock()
         
         with self.lock:
-            self.queue.put((request_id, request_func, params))
-            queue_size = self.queue.qsize()
+            retry_after = self._admission_retry_after()
+            if retry_after:
+                return None, retry_after
             
-            self.queue_order[request_id] = current_time
+            TRACER.start(request_func.__name__, trace_id=request_id)
+            record = QueuedRequest(request_id, request_func, params, datetime.fromtimestamp(now), now)
+            self.queue.append(record)
+            self.requests[request_id] = record
             
-            self.requests[request_id] = {
-                'request_func': request_func,
-                'params': params,
-                'timestamp': time.time(),
-                'last_heartbeat': time.time()
-            }
+            heapq.heappush(self.heartbeat_deadlines, (record.last_heartbeat + self.heartbeat_timeout, request_id))
             
-            self.statuses[request_id] = {
-                "status": "queued",
-                "position": queue_size,
-                "created_at": current_time,
-                "estimated_time": self._enhanced_estimate_wait_time(queue_size),
-                "last_heartbeat": time.time()
-            }
-        return request_id
+            queue_size = len(self.queue)
+            record.position = queue_size
+            record.estimated_time = self._enhanced_estimate_wait_time(queue_size)
+        return request_id, None
+    
+    def check_admission(self):
+        # A cheap pre-filter for callers with work to do before add_request; add_request re-checks
+        with self.lock:
+            return self._admission_retry_after()
+    
+    def _admission_retry_after(self):
+        # Cancelled ids also include requests that were already processing or done, so only
+        # the cancelled records still sitting in the queue are left out
+        depth = sum(1 for record in self.queue if record.status != "cancelled")
+        predicted_wait = self._enhanced_estimate_wait_time(depth + 1)
+        drain_rate = self._drain_rate()
+        
+        retry_after = 0
+        if self.max_queue_depth and depth >= self.max_queue_depth:
+            retry_after = (depth + 1 - self.max_queue_depth) / drain_rate
+        if self.max_predicted_wait and predicted_wait > self.max_predicted_wait:
+            retry_after = max(retry_after, predicted_wait - self.max_predicted_wait)
+        
+        if retry_after <= 0:
+            return None
+        
+        self.rejected_requests += 1
+        return max(1, int(math.ceil(retry_after)))
+    
+    def _drain_rate(self):
+        return self.max_concurrent / max(1.0, self.avg_processing_time + self.cooldown_period)
     
     def _enhanced_estimate_wait_time(self, position):
         base_time = self.avg_processing_time + (self.cooldown_period / self.max_concurrent)
@@ -80,7 +168,7 @@ class RequestQueue:
         if not self.abandonment_history or current_position <= 1:
             return 0
         
-        recent_time = time.time() - 1800
+        recent_time = self.clock() - 1800
         recent_abandonments = [a for a in self.abandonment_history if a['timestamp'] > recent_time]
         
         if len(recent_abandonments) < 5:
@@ -91,50 +179,44 @@ class RequestQueue:
     
     def update_heartbeat(self, request_id):
         with self.lock:
-            current_time = time.time()
-            if request_id in self.statuses:
-                self.statuses[request_id]["last_heartbeat"] = current_time
-            if request_id in self.requests:
-                self.requests[request_id]["last_heartbeat"] = current_time
+            record = self.requests.get(request_id)
+            if record:
+                record.last_heartbeat = self.clock()
                 return True
         return False
     
     def get_request_status(self, request_id):
         with self.lock:
-            if request_id in self.statuses:
-                status_data = self.statuses[request_id].copy()
+            record = self.requests.get(request_id)
+            if record:
+                status_data = record.to_status()
                 
-                if status_data["status"] == "queued":
-                    position = self._get_fast_position(request_id)
+                if record.status == "queued":
+                    position = self._get_fast_position(record)
                     status_data["position"] = position
                     status_data["estimated_time"] = self._enhanced_estimate_wait_time(position)
-                elif status_data["status"] == "processing":
+                elif record.status == "processing":
                     status_data["position"] = 0
                     status_data["estimated_time"] = 0
                 return status_data
             return None
     
-    def _get_fast_position(self, request_id):
-        if request_id not in self.queue_order:
-            return 0
-        
+    def _get_fast_position(self, record):
         position = 1
-        target_time = self.queue_order[request_id]
         
-        for rid, timestamp in self.queue_order.items():
-            if timestamp < target_time and rid not in self.cancelled_requests:
-                position += 1
-            elif rid == request_id:
+        for queued in self.queue:
+            if queued is record:
                 break
+            if queued.request_id not in self.cancelled_requests:
+                position += 1
         
         return position
     
     def get_request_result(self, request_id):
         with self.lock:
             if request_id in self.results:
-                result = self.results[request_id]
-                del self.results[request_id]
-                del self.statuses[request_id]
+                result = self.results.pop(request_id)
+                self.requests.pop(request_id, None)
                 return result
             return None
     
@@ -142,29 +224,24 @@ class RequestQueue:
         with self.lock:
             removed = False
             
-            if request_id in self.statuses:
+            record = self.requests.pop(request_id, None)
+            if record:
                 self.cancelled_requests.add(request_id)
-                status = self.statuses[request_id]
                 
-                if status["status"] == "queued":
+                if record.status == "queued":
                     abandonment_data = {
-                        'position': status.get("position", 0),
-                        'wait_time': time.time() - status["created_at"].timestamp(),
-                        'timestamp': time.time()
+                        'position': record.position,
+                        'wait_time': self.clock() - record.timestamp,
+                        'timestamp': self.clock()
                     }
                     self.abandonment_history.append(abandonment_data)
                 
-                del self.statuses[request_id]
+                record.status = "cancelled"
+                record.request_func = None
+                record.params = None
                 removed = True
             
-            if request_id in self.results:
-                del self.results[request_id]
-            
-            if request_id in self.requests:
-                del self.requests[request_id]
-            
-            if request_id in self.queue_order:
-                del self.queue_order[request_id]
+            self.results.discard(request_id)
             
             if len(self.cancelled_requests) >= self.batch_cleanup_threshold:
                 self._batch_remove_cancelled()
@@ -175,20 +252,10 @@ class RequestQueue:
         if not self.cancelled_requests:
             return
         
-        temp_queue = queue.Queue()
-        removed_count = 0
+        remaining = deque(record for record in self.queue if record.status != "cancelled")
+        removed_count = len(self.queue) - len(remaining)
         
-        while not self.queue.empty():
-            try:
-                item = self.queue.get_nowait()
-                if item[0] not in self.cancelled_requests:
-                    temp_queue.put(item)
-                else:
-                    removed_count += 1
-            except queue.Empty:
-                break
-        
-        self.queue = temp_queue
+        self.queue = remaining
         self.cancelled_requests.clear()
         
         if removed_count > 0:
@@ -196,121 +263,131 @@ class RequestQueue:
     
     def _process_queue(self):
         while True:
-            batch = []
-            with self.lock:
-                if self.cancelled_requests:
-                    self._batch_remove_cancelled()
-                
-                if self.last_request_time and (datetime.now() - self.last_request_time) < timedelta(seconds=self.cooldown_period):
-                    time_to_wait = (self.last_request_time + timedelta(seconds=self.cooldown_period) - datetime.now()).total_seconds()
-                    if time_to_wait > 0:
-                        self.lock.release()
-                        time.sleep(time_to_wait)
-                        self.lock.acquire()
+            if not self.process_batch():
+                self.sleep(1)
+                self._cleanup_old_entries()
+    
+    def process_batch(self):
+        batch = []
+        with self.lock:
+            if self.cancelled_requests:
+                self._batch_remove_cancelled()
+            
+            if self.last_request_time is not None:
+                time_to_wait = self.last_request_time + self.cooldown_period - self.clock()
+                if time_to_wait > 0:
+                    self.lock.release()
+                    self.sleep(time_to_wait)
+                    self.lock.acquire()
+            
+            while len(batch) < self.max_concurrent and self.queue:
+                record = self.queue.popleft()
                 
-                while len(batch) < self.max_concurrent and not self.queue.empty():
-                    item = self.queue.get()
-                    request_id = item[0]
-                    
-                    if request_id in self.cancelled_requests:
-                        self.cancelled_requests.discard(request_id)
-                        continue
-                    
-                    if request_id in self.statuses:
-                        batch.append(item)
-                        self.statuses[request_id]["status"] = "processing"
-                        self.queue_order.pop(request_id, None)
+                if record.status == "cancelled":
+                    self.cancelled_requests.discard(record.request_id)
+                    continue
                 
-                if batch:
-                    self.last_request_time = datetime.now()
+                batch.append(record)
+                record.status = "processing"
             
-            for request_id, request_func, params in batch:
-                start_time = time.time()
-                
-                with self.lock:
-                    if request_id not in self.statuses or request_id in self.cancelled_requests:
-                        continue
+            if batch:
+                self.last_request_time = self.clock()
+        
+        for record in batch:
+            start_time = self.clock()
+            
+            with self.lock:
+                if record.status == "cancelled":
+                    continue
+                request_func, params = record.request_func, record.params
+            
+            TRACER.record(record.request_id, "queue.wait", record.timestamp, start_time)
+            trace = TRACER.get(record.request_id)
+            try:
+                max_retries = 3
+                retry_count = 0
+                retry_delay = 5
                 
-                try:
-                    max_retries = 3
-                    retry_count = 0
-                    retry_delay = 5
-                    
-                    while retry_count < max_retries:
-                        with self.lock:
-                            if request_id not in self.statuses or request_id in self.cancelled_requests:
-                                break
-                        
-                        try:
-                            result = request_func(**params)
+                while retry_count < max_retries:
+                    with self.lock:
+                        if record.status == "cancelled":
                             break
-                        except Exception as e:
-                            if "experiencing high traffic" in str(e) or "403" in str(e):
-                                retry_count += 1
-                                if retry_count < max_retries:
-                                    retry_delay_with_jitter = retry_delay + (retry_count * 2) + (random.random() * 2)
-                                    time.sleep(retry_delay_with_jitter)
-                                    continue
-                            raise
                     
-                    end_time = time.time()
-                    processing_time = end_time - start_time
-                    self.processing_history.append(processing_time)
-                    
-                    if self.processing_history:
-                        self.avg_processing_time = sum(self.processing_history) / len(self.processing_history)
-                    
-                    with self.lock:
-                        if request_id in self.statuses:
-                            self.results[request_id] = result
-                            self.statuses[request_id]["status"] = "completed"
-                except Exception as e:
-                    with self.lock:
-                        if request_id in self.statuses:
-                            self.results[request_id] = {"error": str(e)}
-                            self.statuses[request_id]["status"] = "failed"
-            
-            if not batch:
-                time.sleep(1)
-                self._cleanup_old_entries()
+                    try:
+                        with TRACER.activate(trace), span("queue.process", attempt=retry_count + 1):
+                            result = request_func(**params)
+                        break
+                    except Exception as e:
+                        if "experiencing high traffic" in str(e) or "403" in str(e):
+                            retry_count += 1
+                            if retry_count < max_retries:
+                                retry_delay_with_jitter = retry_delay + (retry_count * 2) + (random.random() * 2)
+                                self.sleep(retry_delay_with_jitter)
+                                continue
+                        raise
+                
+                end_time = self.clock()
+                processing_time = end_time - start_time
+                self.processing_history.append(processing_time)
+                
+                if self.processing_history:
+                    self.avg_processing_time = sum(self.processing_history) / len(self.processing_history)
+                
+                with self.lock:
+                    if record.status != "cancelled":
+                        self.results.put(record.request_id, result)
+                        self._finish_locked(record, "completed")
+                TRACER.finish(trace, "completed")
+            except Exception as e:
+                with self.lock:
+                    if record.status != "cancelled":
+                        self.results.put(record.request_id, {"error": str(e)})
+                        self._finish_locked(record, "failed")
+                TRACER.finish(trace, "failed")
+        
+        return bool(batch)
+    
+    def _finish_locked(self, record, status):
+        record.status = status
+        record.request_func = None
+        record.params = None
+        heapq.heappush(self.result_expiries, (record.timestamp + self.result_ttl, record.request_id))
     
     def _cleanup_old_entries(self):
         with self.lock:
-            current_time = datetime.now()
-            expired_ids = []
+            current_time = self.clock()
             
-            for request_id, status in self.statuses.items():
-                if status["status"] in ["completed", "failed"] and "created_at" in status:
-                    time_diff = current_time - status["created_at"]
-                    if time_diff.total_seconds() > 1800:
-                        expired_ids.append(request_id)
-            
-            for request_id in expired_ids:
-                if request_id in self.results:
-                    del self.results[request_id]
-                if request_id in self.statuses:
-                    del self.statuses[request_id]
-                if request_id in self.queue_order:
-                    del self.queue_order[request_id]
+            while self.result_expiries and self.result_expiries[0][0] <= current_time:
+                _, request_id = heapq.heappop(self.result_expiries)
+                record = self.requests.get(request_id)
+                if record and record.status in ["completed", "failed"]:
+                    self.results.discard(request_id)
+                    del self.requests[request_id]
     
     def _enhanced_cleanup_loop(self):
         while True:
-            time.sleep(self.cleanup_interval)
+            self.sleep(self.cleanup_interval)
             self._enhanced_cleanup()
             with self.lock:
                 if self.cancelled_requests:
                     self._batch_remove_cancelled()
     
     def _enhanced_cleanup(self):
-        current_time = time.time()
+        current_time = self.clock()
         stale_requests = []
         
         with self.lock:
-            for request_id, status in self.statuses.items():
-                if status["status"] == "queued":
-                    last_heartbeat = status.get("last_heartbeat", 0)
-                    if current_time - last_heartbeat > self.heartbeat_timeout:
-                        stale_requests.append(request_id)
+            while self.heartbeat_deadlines and self.heartbeat_deadlines[0][0] < current_time:
+                _, request_id = heapq.heappop(self.heartbeat_deadlines)
+                record = self.requests.get(request_id)
+                if not record or record.status != "queued":
+                    continue
+                
+                deadline = record.last_heartbeat + self.heartbeat_timeout
+                if deadline >= current_time:
+                    heapq.heappush(self.heartbeat_deadlines, (deadline, request_id))
+                else:
+                    stale_requests.append(request_id)
         
         for request_id in stale_requests:
             self.cancel_request(request_id)
@@ -327,18 +404,22 @@ class RequestQueue:
     
     def get_queue_stats(self):
         with self.lock:
-            total_queued = sum(1 for s in self.statuses.values() if s["status"] == "queued")
-            total_processing = sum(1 for s in self.statuses.values() if s["status"] == "processing")
+            total_queued = sum(1 for r in self.requests.values() if r.status == "queued")
+            total_processing = sum(1 for r in self.requests.values() if r.status == "processing")
             recent_abandonments = len([a for a in self.abandonment_history 
-                                      if time.time() - a['timestamp'] < 3600])
+                                      if self.clock() - a['timestamp'] < 3600])
             
             return {
                 "queued": total_queued,
                 "processing": total_processing,
                 "avg_processing_time": round(self.avg_processing_time, 2),
                 "recent_abandonments": recent_abandonments,
-                "queue_size": self.queue.qsize(),
-                "cancelled_pending": len(self.cancelled_requests)
+                "queue_size": len(self.queue),
+                "cancelled_pending": len(self.cancelled_requests),
+                "tracked_requests": len(self.requests),
+                "drain_rate_per_min": round(self._drain_rate() * 60, 2),
+                "rejected": self.rejected_requests,
+                "pending_deadlines": len(self.heartbeat_deadlines) + len(self.result_expiries),
+                "result_store": self.results.stats(),
+                "threads_started": self.started_pid == os.getpid()
             }
-
-request_queue = RequestQueue()
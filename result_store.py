@@ -0,0 +1,138 @@
+import os, pickle, sys, threading, zlib
+from collections import OrderedDict
+
+class ResultStore:
+    def __init__(self, max_bytes=64 * 1024 * 1024, spill_dir=None, compress_level=6):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or None
+        self.compress_level = compress_level
+        self.lock = threading.Lock()
+
+        # key -> (value, size); ordered from least to most recently used
+        self.entries = OrderedDict()
+        # key -> (path, size) for results written out to disk
+        self.spilled = {}
+
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self.evictions = 0
+        self.spills = 0
+
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, key, value):
+        size = self._measure(value)
+        with self.lock:
+            self._discard_locked(key)
+            self.entries[key] = (value, size)
+            self.memory_bytes += size
+            self._enforce_limit_locked()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            if key in self.spilled:
+                value = self._load_spilled_locked(key)
+                if value is not None:
+                    size = self._measure(value)
+                    self.entries[key] = (value, size)
+                    self.memory_bytes += size
+                    self._enforce_limit_locked()
+                    return value
+            return default
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                value, size = self.entries.pop(key)
+                self.memory_bytes -= size
+                return value
+            if key in self.spilled:
+                value = self._load_spilled_locked(key)
+                return default if value is None else value
+            return default
+
+    def discard(self, key):
+        with self.lock:
+            self._discard_locked(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries or key in self.spilled
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries) + len(self.spilled)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_bytes": self.memory_bytes,
+                "memory_limit_bytes": self.max_bytes,
+                "memory_entries": len(self.entries),
+                "spilled_bytes": self.spilled_bytes,
+                "spilled_entries": len(self.spilled),
+                "evictions": self.evictions,
+                "spills": self.spills
+            }
+
+    def _measure(self, value):
+        try:
+            return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return sys.getsizeof(value)
+
+    def _discard_locked(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= entry[1]
+        spilled = self.spilled.pop(key, None)
+        if spilled is not None:
+            self.spilled_bytes -= spilled[1]
+            self._remove_file(spilled[0])
+
+    def _enforce_limit_locked(self):
+        while self.memory_bytes > self.max_bytes and self.entries:
+            key, (value, size) = self.entries.popitem(last=False)
+            self.memory_bytes -= size
+
+            if self.spill_dir and self._spill_locked(key, value):
+                continue
+            self.evictions += 1
+
+    def _spill_locked(self, key, value):
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            compressed = zlib.compress(payload, self.compress_level)
+            path = os.path.join(self.spill_dir, f"{key}.pkl.z")
+            with open(path, 'wb') as spill_file:
+                spill_file.write(compressed)
+        except Exception as e:
+            print(f"Result store: failed to spill {key}: {e}")
+            return False
+
+        self.spilled[key] = (path, len(compressed))
+        self.spilled_bytes += len(compressed)
+        self.spills += 1
+        return True
+
+    def _load_spilled_locked(self, key):
+        path, size = self.spilled.pop(key)
+        self.spilled_bytes -= size
+        try:
+            with open(path, 'rb') as spill_file:
+                return pickle.loads(zlib.decompress(spill_file.read()))
+        except Exception as e:
+            print(f"Result store: failed to load spilled {key}: {e}")
+            return None
+        finally:
+            self._remove_file(path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,378 @@
+import json, logging, mmap, os, queue, struct, threading, time
+from contextlib import contextmanager
+from matrix_codec import populated_seat_types
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MSNP"
+# magic, metadata length, fetched at (unix seconds), cell count
+HEADER = struct.Struct("<4sIdI")
+# online, offline, fare, vat of one seat type and station pair
+CELL = struct.Struct("<HHff")
+SEGMENT_NAME = "segment-{:06d}.bin"
+INDEX_NAME = "index.ndjson"
+LOCK_NAME = "append.lock"
+
+def encode_snapshot(result, fetched_at):
+    # Cells follow matrix_codec's layout: seat type by seat type, each over the upper triangle
+    # of the station matrix in row-major order, so one cell can be read without the rest
+    stations = result["stations"]
+    seat_types = populated_seat_types(result)
+    meta = json.dumps({
+        "train_model": result["train_model"],
+        "train_name": result.get("train_name"),
+        "date": result["date"],
+        "stations": stations,
+        "seat_types": seat_types
+    }, separators=(",", ":")).encode("utf-8")
+
+    cells = bytearray()
+    for seat_type in seat_types:
+        matrix = result["fare_matrices"][seat_type]
+        for i, from_city in enumerate(stations):
+            row = matrix.get(from_city, {})
+            for to_city in stations[i + 1:]:
+                cell = row.get(to_city) or {}
+                cells += CELL.pack(
+                    min(int(cell.get("online", 0)), 65535), min(int(cell.get("offline", 0)), 65535),
+                    float(cell.get("fare", 0)), float(cell.get("vat_amount", 0))
+                )
+    return HEADER.pack(MAGIC, len(meta), fetched_at, len(cells) // CELL.size) + meta + bytes(cells)
+
+def pair_index(i, j, n_stations):
+    return i * n_stations - i * (i + 1) // 2 + (j - i - 1)
+
+class SnapshotStore:
+    def __init__(self, directory, max_segment_bytes=64 * 1024 * 1024, queue_size=256, batch_size=32, clock=time.time):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.batch_size = batch_size
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (train model, journey date) -> [(fetched at, segment, offset)] in write order, followed from
+        # index.ndjson so that blocks written by other processes sharing the directory show up too
+        self.index = {}
+        self.index_bytes = 0
+        # segment -> read-only mmap; replaced by a larger one once the segment grows past it
+        self.maps = {}
+        # metadata bytes -> (station positions, seat type positions, station count, journey date)
+        self.layouts = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = None
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def record(self, result, fetched_at=None):
+        # Never blocks the caller: when the writer falls behind, the snapshot is dropped
+        self.ensure_writer()
+        try:
+            self.queue.put_nowait((result, fetched_at or self.clock()))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def flush(self):
+        self.ensure_writer()
+        self.queue.join()
+
+    def ensure_writer(self):
+        # Started by the first record() in a process, so a store that is only read (the CLI, /api/history)
+        # never starts a writer
+        with self.lock:
+            if self.writer and self.writer.is_alive():
+                return
+            self.writer = threading.Thread(target=self._write_loop, daemon=True)
+            self.writer.start()
+
+    def curve(self, train_model, from_city, to_city, seat_type=None, journey_date=None, since=None, until=None):
+        # Seat counts of one segment across snapshots; only the matching blocks are touched,
+        # and of each block only its header, metadata and the requested cells
+        self._refresh_index()
+        with self.lock:
+            blocks = [
+                (fetched_at, segment, offset)
+                for (model, date), entries in self.index.items()
+                if model == str(train_model) and (journey_date is None or date == journey_date)
+                for fetched_at, segment, offset in entries
+                if (since is None or fetched_at >= since) and (until is None or fetched_at <= until)
+            ]
+
+        points = []
+        for fetched_at, segment, offset in sorted(blocks):
+            view = self._view(segment, offset + HEADER.size)
+            _, meta_length, _, _ = HEADER.unpack_from(view, offset)
+            meta_start = offset + HEADER.size
+            view = self._view(segment, meta_start + meta_length)
+            meta = bytes(view[meta_start:meta_start + meta_length])
+            stations, seat_types, n_stations, journey = self._layout(meta)
+            i, j = stations.get(from_city), stations.get(to_city)
+            if i is None or j is None or i >= j:
+                continue
+
+            pairs = n_stations * (n_stations - 1) // 2
+            cells_start = meta_start + meta_length
+            for name, position in seat_types.items():
+                if seat_type and name != seat_type:
+                    continue
+                cell_offset = cells_start + (position * pairs + pair_index(i, j, n_stations)) * CELL.size
+                online, offline, fare, vat = CELL.unpack_from(self._view(segment, cell_offset + CELL.size), cell_offset)
+                points.append({
+                    "fetched_at": round(fetched_at, 3),
+                    "date": journey,
+                    "seat_type": name,
+                    "online": online,
+                    "offline": offline,
+                    "fare": round(fare, 2),
+                    "vat": round(vat, 2)
+                })
+        return points
+
+    def keys(self, train_model=None):
+        self._refresh_index()
+        with self.lock:
+            return sorted(key for key in self.index if train_model is None or key[0] == str(train_model))
+
+    def stats(self):
+        self._refresh_index()
+        segment_sizes = self.segment_sizes()
+        with self.lock:
+            return {
+                "segments": len(segment_sizes),
+                "bytes": sum(segment_sizes.values()),
+                "snapshots": sum(len(entries) for entries in self.index.values()),
+                "keys": len(self.index),
+                "queued": self.queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "write_errors": self.write_errors,
+                "writer_running": bool(self.writer and self.writer.is_alive())
+            }
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._append(batch)
+            except Exception as e:
+                with self.lock:
+                    self.write_errors += len(batch)
+                logger.warning(f"Snapshot store: failed to write {len(batch)} snapshots: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def segment_sizes(self):
+        sizes = {}
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name.endswith(".bin"):
+                sizes[int(name[8:-4])] = os.path.getsize(os.path.join(self.directory, name))
+        return sizes
+
+    @contextmanager
+    def _file_lock(self):
+        # Every gunicorn worker appends to the same files: offsets are only valid when taken
+        # from the files themselves while no other process is writing
+        with open(os.path.join(self.directory, LOCK_NAME), "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _append(self, batch):
+        # One write per segment for the whole batch, then one index append
+        blocks = []
+        for result, fetched_at in batch:
+            try:
+                blocks.append((result["train_model"], result["date"], fetched_at, encode_snapshot(result, fetched_at)))
+            except Exception as e:
+                with self.lock:
+                    self.write_errors += 1
+                logger.warning(f"Snapshot store: could not encode a snapshot: {e}")
+
+        with self._file_lock():
+            segment_sizes = self.segment_sizes()
+            segment = max(segment_sizes, default=1)
+            size = segment_sizes.get(segment, 0)
+
+            entries = []
+            pending = bytearray()
+            for train_model, journey_date, fetched_at, block in blocks:
+                if size + len(pending) + len(block) > self.max_segment_bytes and size + len(pending) > 0:
+                    self._write_segment(segment, size, pending)
+                    segment, size, pending = segment + 1, 0, bytearray()
+                entries.append((segment, size + len(pending), fetched_at, str(train_model), journey_date))
+                pending += block
+            if pending:
+                self._write_segment(segment, size, pending)
+            self._append_index(entries)
+
+        with self.lock:
+            self.written += len(entries)
+        self._refresh_index()
+
+    def _write_segment(self, segment, expected_size, data):
+        with open(os.path.join(self.directory, SEGMENT_NAME.format(segment)), "ab") as f:
+            if f.tell() != expected_size:
+                raise Exception(f"Snapshot segment {segment} changed size while locked")
+            f.write(data)
+            f.flush()
+
+    def _append_index(self, entries):
+        if entries:
+            with open(os.path.join(self.directory, INDEX_NAME), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(list(entry)) + "\n" for entry in entries))
+
+    def _refresh_index(self):
+        # Picks up the index lines appended since the last read, by this process or any other
+        path = os.path.join(self.directory, INDEX_NAME)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self.lock:
+            if size < self.index_bytes:
+                # Cut back by another process's recovery: read it again from the start
+                self.index, self.index_bytes = {}, 0
+            if size == self.index_bytes:
+                return
+            with open(path, "rb") as f:
+                f.seek(self.index_bytes)
+                data = f.read(size - self.index_bytes)
+            # A line still being written is picked up next time
+            data = data[:data.rfind(b"\n") + 1]
+            for line in data.splitlines():
+                segment, offset, fetched_at, train_model, journey_date = json.loads(line)
+                self.index.setdefault((train_model, journey_date), []).append((fetched_at, segment, offset))
+            self.index_bytes += len(data)
+
+    def _view(self, segment, end):
+        with self.lock:
+            view = self.maps.get(segment)
+            if view is not None and len(view) >= end:
+                return view
+        with open(os.path.join(self.directory, SEGMENT_NAME.format(segment)), "rb") as f:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(view) < end:
+            raise Exception(f"Snapshot segment {segment} is shorter than its index")
+        with self.lock:
+            # Readers still holding the previous map keep it alive until they are done
+            self.maps[segment] = view
+        return view
+
+    def _layout(self, meta):
+        layout = self.layouts.get(meta)
+        if layout is None:
+            info = json.loads(meta)
+            layout = (
+                {station: i for i, station in enumerate(info["stations"])},
+                {seat_type: i for i, seat_type in enumerate(info["seat_types"])},
+                len(info["stations"]),
+                info["date"]
+            )
+            if len(self.layouts) >= 256:
+                self.layouts.clear()
+            self.layouts[meta] = layout
+        return layout
+
+    def _load(self):
+        # Index lines are appended after their blocks, so a crash leaves at most a torn last line
+        # and blocks past the last indexed one, which are recovered from the segments below.
+        # Under the append lock, so that another worker's write in progress is never mistaken for one.
+        with self._file_lock():
+            segment_sizes = self.segment_sizes()
+            index_path = os.path.join(self.directory, INDEX_NAME)
+            last = None
+            good_bytes = 0
+            if os.path.exists(index_path):
+                with open(index_path, "rb") as f:
+                    for line in f:
+                        try:
+                            segment, offset, fetched_at, train_model, journey_date = json.loads(line)
+                        except ValueError:
+                            break
+                        if not line.endswith(b"\n") or segment not in segment_sizes:
+                            break
+                        good_bytes += len(line)
+                        last = max(last or (segment, offset), (segment, offset))
+                if good_bytes < os.path.getsize(index_path):
+                    with open(index_path, "r+b") as f:
+                        f.truncate(good_bytes)
+
+            if last:
+                segment, offset = last
+                start = offset + self._block_length(segment, offset)
+            else:
+                segment, start = min(segment_sizes, default=1), 0
+            self._recover(segment_sizes, segment, start)
+        self._refresh_index()
+
+    def _block_length(self, segment, offset):
+        with open(os.path.join(self.directory, SEGMENT_NAME.format(segment)), "rb") as f:
+            f.seek(offset)
+            magic, meta_length, _, cells = HEADER.unpack(f.read(HEADER.size))
+        return HEADER.size + meta_length + cells * CELL.size
+
+    def _recover(self, segment_sizes, first_segment, start):
+        recovered = []
+        for segment in sorted(s for s in segment_sizes if s >= first_segment):
+            path = os.path.join(self.directory, SEGMENT_NAME.format(segment))
+            offset = start if segment == first_segment else 0
+            with open(path, "rb") as f:
+                data = f.read()
+            while offset + HEADER.size <= len(data):
+                magic, meta_length, fetched_at, cells = HEADER.unpack_from(data, offset)
+                end = offset + HEADER.size + meta_length + cells * CELL.size
+                if magic != MAGIC or end > len(data):
+                    break
+                meta = json.loads(data[offset + HEADER.size:offset + HEADER.size + meta_length])
+                recovered.append((segment, offset, fetched_at, str(meta["train_model"]), meta["date"]))
+                offset = end
+            if offset < len(data):
+                # A block torn by a crash; later writes go after the last whole one
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+                logger.warning(f"Snapshot store: truncated a partial block at the end of {path}")
+
+        if recovered:
+            self._append_index(recovered)
+            logger.warning(f"Snapshot store: recovered {len(recovered)} snapshots missing from the index")
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Seat availability of one segment across stored snapshots")
+    parser.add_argument("directory")
+    parser.add_argument("--train", required=True, help="Train model, e.g. 701")
+    parser.add_argument("--from", dest="from_city", required=True)
+    parser.add_argument("--to", dest="to_city", required=True)
+    parser.add_argument("--seat-type")
+    parser.add_argument("--date", help="Journey date as DD-Mon-YYYY (default: every stored date)")
+    parser.add_argument("--days", type=float, default=10, help="Only snapshots fetched in the last N days")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.directory)
+    points = store.curve(args.train, args.from_city, args.to_city, args.seat_type, args.date, since=time.time() - args.days * 86400)
+    for point in points:
+        fetched = datetime.fromtimestamp(point["fetched_at"]).strftime("%Y-%m-%d %H:%M")
+        print(f"{fetched}  {point['date']}  {point['seat_type']:10s} online {point['online']:4d}  offline {point['offline']:4d}  fare {point['fare']:g}")
+    print(f"{len(points)} points from {store.stats()['snapshots']} stored snapshots")
@@ -2,8 +2,13 @@ document.documentElement.classList.add('js-enabled');
 
 let focusDueToValidation = false;
 let suppressEvents = false;
-let trainData = [];
-let trainDataFull = [];
+const TRAIN_SUGGEST_LIMIT = 20;
+// An empty train field lists every train, as the dropdown did before it was served by /api/suggest
+const TRAIN_BROWSE_LIMIT = 500;
+const STATION_SUGGEST_LIMIT = 5;
+const SUGGEST_DEBOUNCE_MS = 150;
+// Per input element, so that typing in one field never cancels another field's suggestions
+const suggestRequests = new Map();
 
 function initAuthCredentials() {
     const authToken = localStorage.getItem('railway_auth_token');
@@ -239,44 +244,14 @@ function setupInstructionImageLink() {
     const instructionLink = document.getElementById('instructionImageLink');
     if (!instructionLink) return;
     
-    const configData = JSON.parse(document.getElementById('app-config').textContent);
-    const appVersion = configData.version || "1.0.0";
-    const currentImageUrl = window.instructionImageUrl;
+    const imageUrl = window.instructionImageUrl;
+    localStorage.removeItem('instructionImageData');
     
-    if (!currentImageUrl) return;
-    
-    const cachedImageData = localStorage.getItem('instructionImageData');
-    let imageUrl = currentImageUrl;
-    
-    if (cachedImageData) {
-        const parsedCache = JSON.parse(cachedImageData);
-        if (parsedCache.version === appVersion) {
-            imageUrl = parsedCache.base64;
-        }
-    } else {
-        localStorage.setItem('instructionImageData', JSON.stringify({
-            base64: currentImageUrl,
-            version: appVersion
-        }));
-    }
+    if (!imageUrl) return;
     
     instructionLink.addEventListener('click', function(e) {
         e.preventDefault();
-        
-        const base64Data = imageUrl.split(',')[1];
-        const mimeType = imageUrl.split(',')[0].split(':')[1].split(';')[0];
-        const byteCharacters = atob(base64Data);
-        const byteNumbers = new Array(byteCharacters.length);
-        
-        for (let i = 0; i < byteCharacters.length; i++) {
-            byteNumbers[i] = byteCharacters.charCodeAt(i);
-        }
-        
-        const byteArray = new Uint8Array(byteNumbers);
-        const blob = new Blob([byteArray], { type: mimeType });
-        const blobUrl = URL.createObjectURL(blob);
-        
-        window.open(blobUrl, '_blank');
+        window.open(imageUrl, '_blank');
     });
 }
 
@@ -284,44 +259,14 @@ function setupMobileInstructionImageLink() {
     const mobileInstructionLink = document.getElementById('mobileInstructionImageLink');
     if (!mobileInstructionLink) return;
     
-    const configData = JSON.parse(document.getElementById('app-config').textContent);
-    const appVersion = configData.version || "1.0.0";
-    const currentImageUrl = window.mobileInstructionImageUrl;
+    const imageUrl = window.mobileInstructionImageUrl;
+    localStorage.removeItem('mobileInstructionImageData');
     
-    if (!currentImageUrl) return;
-    
-    const cachedImageData = localStorage.getItem('mobileInstructionImageData');
-    let imageUrl = currentImageUrl;
-    
-    if (cachedImageData) {
-        const parsedCache = JSON.parse(cachedImageData);
-        if (parsedCache.version === appVersion) {
-            imageUrl = parsedCache.base64;
-        }
-    } else {
-        localStorage.setItem('mobileInstructionImageData', JSON.stringify({
-            base64: currentImageUrl,
-            version: appVersion
-        }));
-    }
+    if (!imageUrl) return;
     
     mobileInstructionLink.addEventListener('click', function(e) {
         e.preventDefault();
-        
-        const base64Data = imageUrl.split(',')[1];
-        const mimeType = imageUrl.split(',')[0].split(':')[1].split(';')[0];
-        const byteCharacters = atob(base64Data);
-        const byteNumbers = new Array(byteCharacters.length);
-        
-        for (let i = 0; i < byteCharacters.length; i++) {
-            byteNumbers[i] = byteCharacters.charCodeAt(i);
-        }
-        
-        const byteArray = new Uint8Array(byteNumbers);
-        const blob = new Blob([byteArray], { type: mimeType });
-        const blobUrl = URL.createObjectURL(blob);
-        
-        window.open(blobUrl, '_blank');
+        window.open(imageUrl, '_blank');
     });
 }
 
@@ -668,45 +613,36 @@ function clearAdminError(fieldId) {
     }
 }
 
-function loadTrains() {
-    return new Promise((resolve) => {
-        const cachedTrains = localStorage.getItem('railwayTrains');
-        const trainsElement = document.getElementById('trains-data');
-        let serverTrains, serverVersion;
-
-        if (trainsElement) {
-            const data = JSON.parse(trainsElement.textContent);
-            serverTrains = data.trains;
-            trainDataFull = data.trains_full || [];
-            serverVersion = data.version || "1.0.0";
-        } else {
-            serverTrains = [];
-            trainDataFull = [];
-            serverVersion = "1.0.0";
-        }
+function fetchSuggestions(input, kind, query, limit, exclude = '') {
+    // Resolves to null when a later keystroke in the same input superseded this one
+    const previous = suggestRequests.get(input);
+    if (previous) {
+        clearTimeout(previous.timer);
+        previous.controller.abort();
+        previous.resolve(null);
+    }
 
-        if (cachedTrains) {
-            const cachedData = JSON.parse(cachedTrains);
-            const cachedVersion = cachedData.version || "0.0.0";
-            if (cachedVersion === serverVersion) {
-                trainData = cachedData.trains;
-                resolve();
-            } else {
-                trainData = serverTrains;
-                localStorage.setItem('railwayTrains', JSON.stringify({
-                    trains: serverTrains,
-                    version: serverVersion
-                }));
-                resolve();
+    return new Promise(resolve => {
+        const pending = { controller: new AbortController(), resolve: resolve, timer: null };
+        suggestRequests.set(input, pending);
+
+        pending.timer = setTimeout(() => {
+            const params = new URLSearchParams({ kind: kind, q: query, limit: limit });
+            if (exclude) {
+                params.set('exclude', exclude);
             }
-        } else {
-            trainData = serverTrains;
-            localStorage.setItem('railwayTrains', JSON.stringify({
-                trains: serverTrains,
-                version: serverVersion
-            }));
-            resolve();
-        }
+
+            fetch(`/api/suggest?${params.toString()}`, { signal: pending.controller.signal })
+                .then(response => response.ok ? response.json() : { results: [] })
+                .then(data => data.results || [])
+                .catch(error => error.name === 'AbortError' ? null : [])
+                .then(results => {
+                    if (suggestRequests.get(input) === pending) {
+                        suggestRequests.delete(input);
+                    }
+                    resolve(results);
+                });
+        }, SUGGEST_DEBOUNCE_MS);
     });
 }
 
@@ -810,9 +746,9 @@ function setupTrainDropdown() {
     let allOptions = [];
     let focusedOptionIndex = -1;
 
-    function populateTrainOptions() {
+    function populateTrainOptions(trains) {
         optionsContainer.innerHTML = '';
-        trainDataFull.forEach(train => {
+        trains.forEach(train => {
             const option = document.createElement('div');
             option.className = 'dropdown-option';
             option.setAttribute('data-value', train.train_name);
@@ -832,7 +768,9 @@ function setupTrainDropdown() {
         });
         allOptions = Array.from(optionsContainer.querySelectorAll('.dropdown-option'));
         setupOptionEventListeners();
-    } function openDropdown() {
+    }
+
+    async function openDropdown() {
         const isInCollapsible = dropdown.closest('.collapsible-content') !== null;
 
         if (isInCollapsible) {
@@ -848,7 +786,8 @@ function setupTrainDropdown() {
             dropdownMenu.style.width = '';
         }
 
-        const visibleOptions = filterOptions(textInput.value);
+        const visibleOptions = await filterOptions(textInput.value);
+        if (visibleOptions === null) return;
         focusedOptionIndex = -1;
         
         if (visibleOptions.length > 0) {
@@ -868,26 +807,15 @@ function setupTrainDropdown() {
         }, 200);
     }
 
-    function filterOptions(query) {
-        const lowerQuery = query.toLowerCase();
-        let visibleOptions = [];
-        allOptions.forEach(option => {
-            const trainName = option.dataset.value.toLowerCase();
-            const origin = option.dataset.origin.toLowerCase();
-            const destination = option.dataset.destination.toLowerCase();
-            const zone = option.dataset.zone.toLowerCase();
-
-            const isVisible = trainName.includes(lowerQuery) ||
-                origin.includes(lowerQuery) ||
-                destination.includes(lowerQuery) ||
-                zone.includes(lowerQuery);
-
-            option.style.display = isVisible ? 'block' : 'none';
-            if (isVisible) visibleOptions.push(option);
-        });
+    async function filterOptions(query) {
+        const filter = query.trim();
+        const trains = await fetchSuggestions(textInput, 'train', filter, filter ? TRAIN_SUGGEST_LIMIT : TRAIN_BROWSE_LIMIT);
+        if (trains === null) return null;
+
+        populateTrainOptions(trains);
         focusedOptionIndex = -1;
         updateFocusedOption();
-        return visibleOptions;
+        return allOptions;
     }
 
     function selectOption(option) {
@@ -981,10 +909,6 @@ function setupTrainDropdown() {
 
     if (hiddenInput.value) {
         textInput.value = hiddenInput.value;
-        const selectedOption = allOptions.find(opt => opt.dataset.value === hiddenInput.value);
-        if (selectedOption) selectedOption.classList.add('selected');
-    } if (trainDataFull.length > 0) {
-        populateTrainOptions();
     }
 }
 
@@ -1326,8 +1250,8 @@ document.addEventListener('DOMContentLoaded', async () => {
     setupInstructionImageLink();
     setupMobileInstructionImageLink();
     
-    await loadTrains();
-    await loadStations();
+    localStorage.removeItem('railwayTrains');
+    localStorage.removeItem('railwayStations');
     initMaterialCalendar();
     setupCalendarBlurClose();
     setupCalendarClickOutside();
@@ -1618,55 +1542,10 @@ document.addEventListener('keydown', function (event) {
     }
 });
 
-let stationData = [];
 let trainSearchSuppressDropdown = false;
 let trainHighlightTimeout = null;
 let originalTrainInputBg = null;
-
-function loadStations() {
-    return new Promise((resolve) => {
-        const cachedStations = localStorage.getItem('railwayStations');
-        const stationsElement = document.getElementById('stations-data');
-        let serverStations, serverVersion;
-
-        if (stationsElement) {
-            try {
-                const data = JSON.parse(stationsElement.textContent);
-                serverStations = data.stations;
-                serverVersion = data.version || "1.0.0";
-            } catch (e) {
-                serverStations = [];
-                serverVersion = "1.0.0";
-            }
-        } else {
-            serverStations = [];
-            serverVersion = "1.0.0";
-        }
-
-        if (cachedStations) {
-            const cachedData = JSON.parse(cachedStations);
-            const cachedVersion = cachedData.version || "0.0.0";
-            if (cachedVersion === serverVersion) {
-                stationData = cachedData.stations;
-                resolve();
-            } else {
-                stationData = serverStations;
-                localStorage.setItem('railwayStations', JSON.stringify({
-                    stations: serverStations,
-                    version: serverVersion
-                }));
-                resolve();
-            }
-        } else {
-            stationData = serverStations;
-            localStorage.setItem('railwayStations', JSON.stringify({
-                stations: serverStations,
-                version: serverVersion
-            }));
-            resolve();
-        }
-    });
-}
+let lastSearchedTrains = [];
 
 function initializeTrainSearch() {
     const collapsibleToggle = document.querySelector('.collapsible-toggle');
@@ -1782,8 +1661,8 @@ function initializeTrainSearch() {
     setupClearButton('searchDestination', 'searchDestinationClear');
 }
 
-function filterTrainSearchDropdown(inputId, dropdownId) {
-    if (trainSearchSuppressDropdown || !stationData) return;
+async function filterTrainSearchDropdown(inputId, dropdownId) {
+    if (trainSearchSuppressDropdown) return;
     const input = document.getElementById(inputId);
     const dropdown = document.getElementById(dropdownId);
     if (!input || !dropdown) return;
@@ -1793,18 +1672,17 @@ function filterTrainSearchDropdown(inputId, dropdownId) {
     const otherInput = document.getElementById(otherInputId);
     const excludeStation = otherInput ? otherInput.value.trim() : '';
 
-    dropdown.innerHTML = '';
-
     if (filter.length < 2 || input !== document.activeElement) {
+        dropdown.innerHTML = '';
         dropdown.style.display = "none";
         return;
-    } else {
-        dropdown.style.display = "block";
     }
 
-    const filteredStations = stationData
-        .filter(station => station.toLowerCase().includes(filter) && station !== excludeStation)
-        .slice(0, 5);
+    const filteredStations = await fetchSuggestions(input, 'station', filter, STATION_SUGGEST_LIMIT, excludeStation);
+    if (filteredStations === null || input !== document.activeElement) return;
+
+    dropdown.innerHTML = '';
+    dropdown.style.display = "block";
 
     filteredStations.forEach(station => {
         const option = document.createElement('div');
@@ -2046,7 +1924,15 @@ function displayTrainResults(trains, origin, destination) {
                 </div>
             </div>
         `;
-    }).join(''); trainListDiv.innerHTML = trainElements;
+    }).join('');
+
+    lastSearchedTrains = trains.map(train => train.trip_number);
+    const compareButton = trains.length > 1 ? `
+        <button type="button" class="btn-primary compare-trains-btn" onclick="compareAllTrains()">
+            <i class="fas fa-layer-group"></i> Compare All Trains
+        </button>
+    ` : '';
+    trainListDiv.innerHTML = trainElements + compareButton;
 
     updateCollapsibleHeight();
     setTimeout(() => {
@@ -2075,6 +1961,31 @@ window.addEventListener('resize', () => {
     }
 });
 
+function compareAllTrains() {
+    const dateInput = document.getElementById('date');
+    if (!dateInput || !dateInput.value) {
+        showTrainSearchNetworkError('Select a Date of Journey above to compare all trains on that date.');
+        return;
+    }
+
+    const credentials = getAuthCredentials();
+    const fields = [['date', dateInput.value], ['auth_token', credentials.authToken], ['device_key', credentials.deviceKey]];
+    lastSearchedTrains.forEach(trainName => fields.push(['train_models', trainName]));
+
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/matrix';
+    fields.forEach(([name, value]) => {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = name;
+        input.value = value;
+        form.appendChild(input);
+    });
+    document.body.appendChild(form);
+    form.submit();
+}
+
 function selectTrainFromList(trainName) {
     const trainModelInput = document.getElementById('train-model-input');
     const trainModelHidden = document.getElementById('train_model');
@@ -0,0 +1,69 @@
+import os, hashlib, mimetypes, threading
+from compression import COMPRESSIBLE_MIMETYPES, available_encodings, compress_bytes
+
+class AssetManifest:
+    def __init__(self, static_folder, url_prefix='/assets', precompress=True):
+        self.static_folder = static_folder
+        self.url_prefix = url_prefix
+        self.precompress = precompress
+        # logical path (e.g. "css/styles.css") -> fingerprinted path
+        self.fingerprints = {}
+        # fingerprinted path -> logical path
+        self.logical_paths = {}
+        # (logical path, encoding) -> compressed bytes, filled on first use or by warm()
+        self.variants = {}
+        self.lock = threading.Lock()
+        self.build()
+
+    def build(self):
+        self.fingerprints.clear()
+        self.logical_paths.clear()
+        self.variants.clear()
+
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                full_path = os.path.join(root, name)
+                logical_path = os.path.relpath(full_path, self.static_folder).replace(os.sep, '/')
+
+                with open(full_path, 'rb') as asset_file:
+                    content = asset_file.read()
+                digest = hashlib.sha256(content).hexdigest()[:12]
+
+                base, ext = os.path.splitext(logical_path)
+                fingerprinted = f"{base}.{digest}{ext}"
+                self.fingerprints[logical_path] = fingerprinted
+                self.logical_paths[fingerprinted] = logical_path
+
+    def url_for(self, logical_path):
+        fingerprinted = self.fingerprints.get(logical_path)
+        if not fingerprinted:
+            return f"/static/{logical_path}"
+        return f"{self.url_prefix}/{fingerprinted}"
+
+    def variant(self, logical_path, encoding):
+        if not encoding or not self.compressible(logical_path):
+            return None
+
+        key = (logical_path, encoding)
+        data = self.variants.get(key)
+        if data is None:
+            # Max-effort compression is too slow for import time; it runs once per worker instead
+            with open(os.path.join(self.static_folder, logical_path), 'rb') as asset_file:
+                data = compress_bytes(asset_file.read(), encoding, gzip_level=9, brotli_quality=11)
+            with self.lock:
+                self.variants[key] = data
+        return data
+
+    def warm(self):
+        for logical_path in list(self.fingerprints):
+            for encoding in available_encodings():
+                self.variant(logical_path, encoding)
+
+    def compressible(self, logical_path):
+        return self.precompress and self.mimetype(logical_path) in COMPRESSIBLE_MIMETYPES
+
+    def resolve(self, fingerprinted):
+        return self.logical_paths.get(fingerprinted)
+
+    def mimetype(self, logical_path):
+        return mimetypes.guess_type(logical_path)[0] or 'application/octet-stream'
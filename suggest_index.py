@@ -0,0 +1,145 @@
+import hashlib, json, re
+from collections import defaultdict
+from functools import lru_cache
+
+NGRAM_SIZE = 3
+
+# Lower ranks sort first: whole-name matches, then name prefixes, then word prefixes, then substrings
+RANK_EXACT, RANK_NAME_PREFIX, RANK_WORD_PREFIX, RANK_SUBSTRING = range(4)
+
+def normalize(text):
+    return re.sub(r'[^a-z0-9]+', ' ', str(text).lower()).strip()
+
+class SuggestEntry:
+    __slots__ = ('kind', 'name', 'payload', 'key', 'words', 'haystack')
+
+    def __init__(self, kind, name, payload, fields):
+        self.kind = kind
+        self.name = name
+        self.payload = payload
+        self.key = normalize(name)
+
+        # Aliases such as "Amnura_Bypass" are searchable as "amnura bypass" and "amnurabypass"
+        words = []
+        for field in fields:
+            normalized = normalize(field)
+            words.extend(normalized.split())
+            if ' ' in normalized:
+                words.append(normalized.replace(' ', ''))
+        self.words = tuple(dict.fromkeys(words))
+        self.haystack = ' '.join([normalize(field) for field in fields] + list(self.words))
+
+class SuggestIndex:
+    def __init__(self, entries, cache_size=4096):
+        self.entries = sorted(entries, key=lambda entry: (entry.kind, entry.key))
+        # (kind, word prefix) -> entry ids
+        self.prefixes = defaultdict(set)
+        # (kind, character trigram) -> entry ids, for matches inside words
+        self.ngrams = defaultdict(set)
+
+        for entry_id, entry in enumerate(self.entries):
+            for word in entry.words:
+                for end in range(1, len(word) + 1):
+                    self.prefixes[(entry.kind, word[:end])].add(entry_id)
+            for ngram in self._ngrams(entry.haystack):
+                self.ngrams[(entry.kind, ngram)].add(entry_id)
+
+        self.kinds = tuple(dict.fromkeys(entry.kind for entry in self.entries))
+        # Keystroke prefixes repeat across users, so ranked answers are memoised
+        self._cached_suggest = lru_cache(maxsize=cache_size)(self._suggest)
+
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(json.dumps([entry.kind, entry.payload], sort_keys=True).encode('utf-8'))
+        self.version = digest.hexdigest()[:16]
+
+    @classmethod
+    def from_data(cls, trains, stations):
+        entries = [
+            SuggestEntry('train', train['train_name'], train, [
+                train['train_name'], train.get('train_number', ''), train.get('origin_city', ''),
+                train.get('destination_city', ''), train.get('zone', '')
+            ])
+            for train in trains
+        ]
+        entries.extend(SuggestEntry('station', station, station, [station]) for station in stations)
+        return cls(entries)
+
+    def suggest(self, query, kind=None, limit=10, exclude=None):
+        return [self.entries[entry_id].payload for entry_id in self._cached_suggest(normalize(query), kind, limit, exclude)]
+
+    def stats(self):
+        cache = self._cached_suggest.cache_info()
+        return {
+            "entries": len(self.entries),
+            "prefix_keys": len(self.prefixes),
+            "ngram_keys": len(self.ngrams),
+            "version": self.version,
+            "cache_hits": cache.hits,
+            "cache_misses": cache.misses
+        }
+
+    def _suggest(self, query, kind, limit, exclude):
+        if not query:
+            return tuple(entry_id for entry_id, entry in enumerate(self.entries) if self._accepts(entry, kind, exclude))[:limit]
+
+        terms = query.split()
+        matches = []
+        for search_kind in (self.kinds if kind is None else (kind,)):
+            for entry_id in self._candidates(search_kind, terms):
+                entry = self.entries[entry_id]
+                if entry.name == exclude:
+                    continue
+                rank = self._rank(entry, query, terms)
+                if rank is not None:
+                    matches.append((rank, entry.key, entry_id))
+
+        matches.sort()
+        return tuple(entry_id for _, _, entry_id in matches[:limit])
+
+    def _candidates(self, kind, terms):
+        # Each term must be a word prefix or a substring of the entry. Start from the
+        # smallest candidate set and verify the remaining terms while ranking.
+        best = None
+        for term in terms:
+            candidates = self.prefixes.get((kind, term), set())
+            if len(term) >= NGRAM_SIZE:
+                candidates = candidates | self._substring_candidates(kind, term)
+            if best is None or len(candidates) < len(best):
+                best = candidates
+            if not best:
+                break
+        return best or ()
+
+    def _substring_candidates(self, kind, term):
+        candidates = None
+        for ngram in self._ngrams(term):
+            ids = self.ngrams.get((kind, ngram))
+            if not ids:
+                return set()
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                break
+        return candidates or set()
+
+    def _rank(self, entry, query, terms):
+        if entry.key == query:
+            rank = RANK_EXACT
+        elif entry.key.startswith(query):
+            rank = RANK_NAME_PREFIX
+        else:
+            rank = RANK_WORD_PREFIX
+        for term in terms:
+            if any(word.startswith(term) for word in entry.words):
+                continue
+            if len(term) >= NGRAM_SIZE and term in entry.haystack:
+                rank = RANK_SUBSTRING
+                continue
+            return None
+        return rank
+
+    def _accepts(self, entry, kind, exclude):
+        return (kind is None or entry.kind == kind) and entry.name != exclude
+
+    def _ngrams(self, text):
+        return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
@@ -0,0 +1,304 @@
+import contextvars, functools, heapq, inspect, sys, threading, time, uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    __slots__ = ('span_id', 'parent_id', 'name', 'start', 'end', 'thread', 'attrs')
+
+    def __init__(self, span_id, parent_id, name, start, attrs):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end = None
+        self.thread = threading.current_thread().name
+        self.attrs = attrs
+
+    def to_dict(self, origin):
+        return {
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(((self.end or time.time()) - self.start) * 1000, 2),
+            "thread": self.thread,
+            "attrs": self.attrs
+        }
+
+class Trace:
+    def __init__(self, trace_id, name, attrs):
+        self.trace_id = trace_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+        self.status = "running"
+        self.spans = []
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self.next_span_id = 0
+
+    def add_span(self, name, start, attrs, parent_id=None):
+        with self.lock:
+            self.next_span_id += 1
+            span = Span(self.next_span_id, parent_id, name, start, attrs)
+            self.spans.append(span)
+        return span
+
+    def end_span(self, span):
+        span.end = time.time()
+        # Rendering happens in a later request, after the job itself has finished
+        if self.end is not None and span.end > self.end:
+            self.end = span.end
+
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def summary(self):
+        return {
+            "id": self.trace_id,
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.start,
+            "duration_ms": round(self.duration() * 1000, 2),
+            "spans": len(self.spans),
+            "attrs": self.attrs
+        }
+
+    def to_dict(self, top_stacks=20):
+        with self.lock:
+            spans = [span.to_dict(self.start) for span in self.spans]
+            samples = self.samples.most_common(top_stacks)
+        details = self.summary()
+        details["spans"] = spans
+        if samples:
+            details["profile"] = {
+                "samples": sum(self.samples.values()),
+                "top_stacks": [{"count": count, "stack": stack.split(";")} for stack, count in samples]
+            }
+        return details
+
+class Tracer:
+    def __init__(self, max_traces=200, enabled=True):
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self.lock = threading.Lock()
+        # trace id -> Trace, oldest first; running and finished traces share the ring
+        self.traces = OrderedDict()
+        self.profiler = None
+
+    def start(self, name, trace_id=None, **attrs):
+        if not self.enabled:
+            return None
+        trace = Trace(trace_id or str(uuid.uuid4()), name, attrs)
+        with self.lock:
+            self.traces[trace.trace_id] = trace
+            while len(self.traces) > self.max_traces:
+                _, evicted = self.traces.popitem(last=False)
+                if self.profiler:
+                    self.profiler.forget(evicted)
+        return trace
+
+    def get(self, trace_id):
+        with self.lock:
+            return self.traces.get(trace_id)
+
+    def finish(self, trace, status="ok"):
+        if trace is None:
+            return
+        trace.end = time.time()
+        trace.status = status
+        if self.profiler:
+            self.profiler.finished(trace)
+
+    def record(self, trace_id, name, start, end, **attrs):
+        # For intervals measured elsewhere, such as time spent waiting in the queue
+        trace = self.get(trace_id)
+        if trace:
+            trace.add_span(name, start, attrs).end = end
+
+    @contextmanager
+    def activate(self, trace):
+        if trace is None:
+            yield None
+            return
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        if self.profiler:
+            self.profiler.attach(trace)
+        try:
+            yield trace
+        finally:
+            if self.profiler:
+                self.profiler.detach()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+
+    def recent(self, limit=50):
+        with self.lock:
+            traces = list(self.traces.values())
+        return [trace.summary() for trace in reversed(traces[-limit:])]
+
+    def slowest(self, limit=10):
+        with self.lock:
+            traces = [trace for trace in self.traces.values() if trace.end]
+        return [trace.summary() for trace in heapq.nlargest(limit, traces, key=Trace.duration)]
+
+    def enable_profiler(self, interval=0.01, keep_slowest=5, max_depth=40):
+        self.profiler = SamplingProfiler(interval, keep_slowest, max_depth)
+        self.profiler.start()
+
+    def stats(self):
+        with self.lock:
+            running = sum(1 for trace in self.traces.values() if not trace.end)
+            stored = len(self.traces)
+        return {
+            "enabled": self.enabled,
+            "stored": stored,
+            "running": running,
+            "max_traces": self.max_traces,
+            "profiler": self.profiler.stats() if self.profiler else None
+        }
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01, keep_slowest=5, max_depth=40):
+        self.interval = interval
+        self.keep_slowest = keep_slowest
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        # thread ident -> trace currently running on it
+        self.threads = {}
+        # min-heap of (duration, trace id) for traces whose samples are kept
+        self.kept = []
+        self.sample_count = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def attach(self, trace):
+        with self.lock:
+            self.threads[threading.get_ident()] = trace
+
+    def detach(self):
+        with self.lock:
+            self.threads.pop(threading.get_ident(), None)
+
+    def finished(self, trace):
+        # Keep samples only for the slowest N finished traces
+        with self.lock:
+            entry = (trace.duration(), trace.trace_id, trace)
+            if len(self.kept) < self.keep_slowest:
+                heapq.heappush(self.kept, entry)
+                return
+            if entry[0] > self.kept[0][0]:
+                _, _, dropped = heapq.heapreplace(self.kept, entry)
+            else:
+                dropped = trace
+        with dropped.lock:
+            dropped.samples.clear()
+
+    def forget(self, trace):
+        with self.lock:
+            self.kept = [entry for entry in self.kept if entry[2] is not trace]
+            heapq.heapify(self.kept)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "interval_ms": self.interval * 1000,
+                "samples": self.sample_count,
+                "keep_slowest": self.keep_slowest,
+                "kept_traces": [trace_id for _, trace_id, _ in sorted(self.kept, reverse=True)]
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                threads = dict(self.threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, trace in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                with trace.lock:
+                    trace.samples[";".join(reversed(stack))] += 1
+                self.sample_count += 1
+
+TRACER = Tracer()
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def span(name, **attrs):
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.add_span(name, time.time(), attrs, _current_span.get())
+    token = _current_span.set(current.span_id)
+    try:
+        yield current
+    except Exception as e:
+        current.attrs["error"] = str(e)
+        raise
+    finally:
+        trace.end_span(current)
+        _current_span.reset(token)
+
+def traced(name, *arg_names):
+    # Decorator form of span(); the named arguments are recorded as span attributes
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with span(name, **{arg: arguments.get(arg) for arg in arg_names}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def propagate(func):
+    # Carry the active trace and span into executor threads
+    trace = _current_trace.get()
+    if trace is None:
+        return func
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        profiler = TRACER.profiler
+        if profiler:
+            profiler.attach(trace)
+        try:
+            return context.copy().run(func, *args, **kwargs)
+        finally:
+            if profiler:
+                profiler.detach()
+    return run
+
+def traced_iter(trace, name, iterable, **attrs):
+    # Spans a streamed response body, which is produced after the view has returned
+    if trace is None:
+        yield from iterable
+        return
+    current = trace.add_span(name, time.time(), attrs)
+    try:
+        yield from iterable
+    finally:
+        trace.end_span(current)
@@ -0,0 +1,172 @@
+import gzip, json, logging, os, threading, time
+from collections import defaultdict
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Overridable so load tests and local stand-ins can replace railspaapi.shohoz.com
+API_BASE_URL = os.environ.get("SHOHOZ_API_BASE_URL", "https://railspaapi.shohoz.com/v1.0/web").rstrip('/')
+
+def api_url(path):
+    return f"{API_BASE_URL}/{path}"
+
+def endpoint_name(url):
+    prefix = f"{API_BASE_URL}/"
+    return url[len(prefix):] if url.startswith(prefix) else url
+
+def request_key(method, endpoint, params):
+    params = {key: str(value) for key, value in (params or {}).items()}
+    return json.dumps([method, endpoint, params], sort_keys=True)
+
+class UpstreamRecorder:
+    # Appends one JSON line per upstream response, each as a complete gzip member, so the file
+    # stays readable however the process exits. Request headers (auth token, device key) are
+    # never written.
+    def __init__(self, path):
+        self.path_template = path
+        self.path = None
+        self.lock = threading.Lock()
+        self.file = None
+        self.records = 0
+
+    def write(self, method, url, params, response, elapsed):
+        entry = {
+            "method": method,
+            "endpoint": endpoint_name(url),
+            "params": params or {},
+            "status": response.status_code,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "recorded_at": round(time.time(), 3)
+        }
+        try:
+            entry["json"] = response.json()
+        except ValueError:
+            entry["text"] = response.text
+        member = gzip.compress((json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8"))
+
+        with self.lock:
+            # Opened on first use so that each forked worker (also with --preload) gets its own file
+            if self.file is None:
+                self.path = self.path_template.replace("{pid}", str(os.getpid()))
+                self.file = open(self.path, "ab")
+            self.file.write(member)
+            self.file.flush()
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def stats(self):
+        return {"mode": "record", "path": self.path or self.path_template, "records": self.records}
+
+class UpstreamReplayer:
+    # Serves recorded responses by method, endpoint and parameters. Repeated requests for the
+    # same key walk through its recordings in order and then wrap around.
+    def __init__(self, path, latency_scale=1.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.responses = defaultdict(list)
+        self.cursors = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[request_key(entry["method"], entry["endpoint"], entry["params"])].append(entry)
+            except (EOFError, ValueError):
+                # A recording cut off mid-write (a killed worker, an older single-stream file
+                # never closed): keep what was read
+                logger.warning(f"Upstream replay: {path} ends in a partial record; using the {sum(len(r) for r in self.responses.values())} before it")
+
+    def entries(self, endpoint=None):
+        return [
+            entry for recorded in self.responses.values() for entry in recorded
+            if endpoint is None or entry["endpoint"] == endpoint
+        ]
+
+    def rewind(self):
+        with self.lock:
+            self.cursors.clear()
+
+    def respond(self, method, url, params):
+        key = request_key(method, endpoint_name(url), params)
+        with self.lock:
+            recorded = self.responses.get(key)
+            if not recorded:
+                self.misses += 1
+                raise requests.ConnectionError(f"No recorded response for {method} {endpoint_name(url)} {params}")
+            entry = recorded[self.cursors[key] % len(recorded)]
+            self.cursors[key] += 1
+            self.hits += 1
+
+        if self.latency_scale:
+            time.sleep(entry["elapsed_ms"] / 1000 * self.latency_scale)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.url = url
+        response.reason = "Replayed"
+        response.encoding = "utf-8"
+        if "json" in entry:
+            response._content = json.dumps(entry["json"]).encode("utf-8")
+            response.headers["Content-Type"] = "application/json"
+        else:
+            response._content = entry.get("text", "").encode("utf-8")
+        return response
+
+    def stats(self):
+        with self.lock:
+            return {
+                "mode": "replay",
+                "path": self.path,
+                "recordings": sum(len(recorded) for recorded in self.responses.values()),
+                "latency_scale": self.latency_scale,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+RECORDER = None
+REPLAYER = None
+
+def configure(record_path=None, replay_path=None, latency_scale=1.0):
+    global RECORDER, REPLAYER
+    if RECORDER:
+        RECORDER.close()
+    RECORDER = UpstreamRecorder(record_path) if record_path else None
+    REPLAYER = UpstreamReplayer(replay_path, latency_scale) if replay_path else None
+
+def upstream_stats():
+    if REPLAYER:
+        return REPLAYER.stats()
+    if RECORDER:
+        return RECORDER.stats()
+    return {"mode": "live"}
+
+def upstream_get(url, **kwargs):
+    return _send("GET", url, kwargs.get("params"), lambda: requests.get(url, **kwargs))
+
+def upstream_post(url, **kwargs):
+    return _send("POST", url, kwargs.get("json"), lambda: requests.post(url, **kwargs))
+
+def _send(method, url, params, send):
+    if REPLAYER:
+        return REPLAYER.respond(method, url, params)
+    if not RECORDER:
+        return send()
+    started = time.perf_counter()
+    response = send()
+    RECORDER.write(method, url, params, response, time.perf_counter() - started)
+    return response
+
+configure(
+    record_path=os.environ.get("SHOHOZ_UPSTREAM_RECORD"),
+    replay_path=os.environ.get("SHOHOZ_UPSTREAM_REPLAY"),
+    latency_scale=float(os.environ.get("SHOHOZ_REPLAY_LATENCY_SCALE", "1"))
+)
@@ -0,0 +1,467 @@
+import json, logging, os, sqlite3, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+AUTH_ERRORS = ("AUTH_TOKEN_EXPIRED", "AUTH_DEVICE_KEY_EXPIRED")
+EVENTS_KEPT = 50
+# Closed watches are kept a while so that open streams still receive their "closed" event
+CLOSED_RETENTION_SECONDS = 300
+
+class Subscription:
+    def __init__(self, subscription_id, train_model, journey_date, lookups, seat_types, seats, credentials, webhook_url, expires_at,
+                 created_at=None, closed=False):
+        self.id = subscription_id
+        self.train_model = train_model
+        self.journey_date = journey_date
+        # (from city, to city) -> (query date, from city, to city) shared with every other watcher
+        self.lookups = lookups
+        self.seat_types = seat_types
+        # (from city, to city) -> {seat type: seats} as last notified
+        self.seats = seats
+        self.credentials = credentials
+        self.webhook_url = webhook_url
+        self.expires_at = expires_at
+        self.created_at = created_at or time.time()
+        self.closed = closed
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "train_model": self.train_model,
+            "date": self.journey_date,
+            "segments": [list(segment) for segment in self.lookups],
+            "seat_types": self.seat_types,
+            "seats": [
+                {"from": from_city, "to": to_city, "seats": seats}
+                for (from_city, to_city), seats in self.seats.items()
+            ],
+            "delivery": "webhook" if self.webhook_url else "sse",
+            "expires_at": int(self.expires_at),
+            "closed": self.closed
+        }
+
+    def to_record(self):
+        return json.dumps({
+            "train_model": self.train_model,
+            "date": self.journey_date,
+            "lookups": [[list(segment), list(lookup)] for segment, lookup in self.lookups.items()],
+            "seat_types": self.seat_types,
+            "seats": [[list(segment), seats] for segment, seats in self.seats.items()],
+            "credentials": list(self.credentials),
+            "webhook_url": self.webhook_url,
+            "expires_at": self.expires_at,
+            "created_at": self.created_at
+        })
+
+    @classmethod
+    def from_record(cls, subscription_id, record, closed=False):
+        data = json.loads(record)
+        return cls(
+            subscription_id, data["train_model"], data["date"],
+            {tuple(segment): tuple(lookup) for segment, lookup in data["lookups"]},
+            data["seat_types"],
+            {tuple(segment): seats for segment, seats in data["seats"]},
+            tuple(data["credentials"]), data["webhook_url"], data["expires_at"], data["created_at"], closed
+        )
+
+class Poller:
+    # One per distinct (query date, from, to): a search-trips response covers every train on the
+    # segment, so all watchers of it share these polls whatever train they watch
+    def __init__(self, lookup, interval, next_poll):
+        self.lookup = lookup
+        self.subscribers = set()
+        self.interval = interval
+        self.next_poll = next_poll
+        self.last_seats = None
+        self.polls = 0
+        self.changes = 0
+        self.errors = 0
+
+class WatchManager:
+    # Watches and their events live in SQLite: in memory for a single process, or in the file at
+    # store_path, shared by every gunicorn worker on the host. Any worker answers status, delete and
+    # event requests; only the one holding <store_path>.lock polls upstream, so each segment is polled
+    # once however many workers there are.
+    def __init__(self, search, min_interval=60, max_interval=600, backoff=1.5, ttl=86400, max_subscriptions=1000,
+                 max_segments=20, webhook_hosts=("127.0.0.1", "localhost", "::1"), workers=4, store_path=None, clock=time.time):
+        self.search = search
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.ttl = ttl
+        self.max_subscriptions = max_subscriptions
+        self.max_segments = max_segments
+        self.webhook_hosts = set(webhook_hosts)
+        self.workers = workers
+        self.store_path = store_path or None
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.conn = None
+        self.conn_pid = None
+        self.poller_lock_file = None
+        self.poller_lock_pid = None
+        # Bumped on every change this process makes, to wake its waiting streams at once
+        self.changed = threading.Condition()
+        self.generation = 0
+        self.wakeup = threading.Event()
+        # Polling state, only in the process that polls: lookup -> Poller, and the watches they serve
+        self.pollers = {}
+        self.watched = {}
+        self.scheduler = None
+        self.executor = None
+        self.upstream_calls = 0
+        self.notifications = 0
+        self.webhook_failures = 0
+
+        with self.lock:
+            conn = self._connection()
+            conn.execute("CREATE TABLE IF NOT EXISTS watches (id TEXT PRIMARY KEY, record TEXT, expires_at REAL, "
+                         "closed_at REAL, next_event_id INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS watch_events (watch TEXT, id INTEGER, event TEXT, PRIMARY KEY (watch, id))")
+        if self.store_path:
+            # The file holds the watchers' credentials
+            os.chmod(self.store_path, 0o600)
+
+    def subscribe(self, train_model, journey_date, lookups, seat_types, seats, auth_token, device_key, webhook_url=None, expires_at=None):
+        if not lookups:
+            raise Exception("Choose at least one segment to watch.")
+        if len(lookups) > self.max_segments:
+            raise Exception(f"A watch can cover at most {self.max_segments} segments.")
+        if not auth_token or not device_key:
+            raise Exception("AUTH_CREDENTIALS_REQUIRED")
+        if webhook_url and urlparse(webhook_url).hostname not in self.webhook_hosts:
+            raise Exception("Webhooks can only be delivered to a local endpoint.")
+
+        now = self.clock()
+        subscription = Subscription(
+            str(uuid.uuid4()), train_model, journey_date, dict(lookups), list(seat_types),
+            {segment: {seat_type: seats.get(segment, {}).get(seat_type, 0) for seat_type in seat_types} for segment in lookups},
+            (auth_token, device_key), webhook_url, min(expires_at or now + self.ttl, now + self.ttl), created_at=now
+        )
+
+        def insert(conn):
+            active = conn.execute("SELECT COUNT(*) FROM watches WHERE closed_at IS NULL").fetchone()[0]
+            if active >= self.max_subscriptions:
+                raise Exception("Too many active watches right now. Please try again later.")
+            conn.execute("INSERT INTO watches (id, record, expires_at, closed_at, next_event_id) VALUES (?, ?, ?, NULL, 1)",
+                         (subscription.id, subscription.to_record(), subscription.expires_at))
+        self._transaction(insert)
+
+        self.ensure_scheduler()
+        # Picked up on the polling process's next pass; here that pass starts now
+        self.wakeup.set()
+        return subscription
+
+    def get(self, subscription_id):
+        with self.lock:
+            row = self._connection().execute(
+                "SELECT record FROM watches WHERE id = ? AND closed_at IS NULL", (subscription_id,)
+            ).fetchone()
+        return Subscription.from_record(subscription_id, row[0]) if row else None
+
+    def subscription_ids(self):
+        with self.lock:
+            return [row[0] for row in self._connection().execute("SELECT id FROM watches WHERE closed_at IS NULL")]
+
+    def unsubscribe(self, subscription_id, reason="unsubscribed"):
+        if self._notify(subscription_id, "closed", {"reason": reason}, close=True) is None:
+            return False
+        with self.lock:
+            # Stop polling for it here at once; other processes' pollers catch up on their next pass
+            self.watched.pop(subscription_id, None)
+            for lookup, poller in list(self.pollers.items()):
+                poller.subscribers.discard(subscription_id)
+                if not poller.subscribers:
+                    del self.pollers[lookup]
+        return True
+
+    def wait_events(self, subscription_id, after_id=0, timeout=15):
+        # -> (events newer than after_id, whether more can follow); blocks until one arrives
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.changed:
+                generation = self.generation
+            found = self._events(subscription_id, after_id)
+            if found is None:
+                return [], False
+            events, still_open = found
+            remaining = deadline - time.monotonic()
+            if events or not still_open or remaining <= 0:
+                return events, still_open
+            # Woken at once by this process's changes; those of other workers show up within a second
+            with self.changed:
+                self.changed.wait_for(lambda: self.generation != generation, min(remaining, 1))
+
+    def ensure_scheduler(self):
+        # Started on the first subscribe, or by init_worker for a shared store. Every worker that has one
+        # competes for the poller lock, so polling survives the exit of the worker that holds it
+        with self.lock:
+            if self.scheduler and self.scheduler.is_alive():
+                return
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.scheduler = threading.Thread(target=self._schedule_loop, daemon=True)
+            self.scheduler.start()
+
+    def stats(self):
+        with self.lock:
+            subscriptions = self._connection().execute("SELECT COUNT(*) FROM watches WHERE closed_at IS NULL").fetchone()[0]
+            pollers = list(self.pollers.values())
+            return {
+                "subscriptions": subscriptions,
+                "pollers": len(pollers),
+                "watchers_per_poller": round(sum(len(poller.subscribers) for poller in pollers) / len(pollers), 2) if pollers else 0,
+                "mean_interval_seconds": round(sum(poller.interval for poller in pollers) / len(pollers), 1) if pollers else 0,
+                "polling_process": self.poller_lock_pid == os.getpid() or not self.store_path,
+                "upstream_calls": self.upstream_calls,
+                "notifications": self.notifications,
+                "webhook_failures": self.webhook_failures,
+                "scheduler_running": bool(self.scheduler and self.scheduler.is_alive())
+            }
+
+    def run_due(self):
+        # Polls every poller whose time has come; returns seconds until the next one is due
+        now = self.clock()
+        for subscription_id in self._expired(now):
+            self.unsubscribe(subscription_id, reason="expired")
+        self._sync_pollers(now)
+
+        with self.lock:
+            due = [poller for poller in self.pollers.values() if poller.next_poll <= now]
+            for poller in due:
+                # Pushed out while in flight so that the next pass does not poll it twice
+                poller.next_poll = now + self.max_interval
+        if self.executor:
+            list(self.executor.map(self.poll, due))
+        else:
+            for poller in due:
+                self.poll(poller)
+
+        with self.lock:
+            upcoming = [poller.next_poll for poller in self.pollers.values()]
+        return max(0.0, min(upcoming) - self.clock()) if upcoming else self.max_interval
+
+    def poll(self, poller):
+        journey_date, from_city, to_city = poller.lookup
+        seat_infos = None
+        for subscription_ids, (auth_token, device_key) in self._credentials(poller):
+            with self.lock:
+                self.upstream_calls += 1
+            try:
+                seat_infos = self.search(journey_date, from_city, to_city, auth_token, device_key)
+                break
+            except Exception as e:
+                if str(e) not in AUTH_ERRORS:
+                    logger.warning(f"Watch: poll of {from_city} -> {to_city} on {journey_date} failed: {e}")
+                    break
+                # These credentials are no longer valid; their watches cannot continue
+                for subscription_id in subscription_ids:
+                    self.unsubscribe(subscription_id, reason=str(e))
+
+        with self.lock:
+            if self.pollers.get(poller.lookup) is not poller:
+                return
+            poller.polls += 1
+            now = self.clock()
+            if not seat_infos:
+                # Failed, or the segment came back empty: back off without touching anyone's state
+                poller.errors += 1
+                poller.interval = min(poller.interval * 2, self.max_interval)
+                poller.next_poll = now + poller.interval
+                return
+            changed = poller.last_seats is not None and poller.last_seats != seat_infos
+            poller.last_seats = seat_infos
+            if changed:
+                poller.changes += 1
+                poller.interval = self.min_interval
+            else:
+                poller.interval = min(poller.interval * self.backoff, self.max_interval)
+            poller.next_poll = now + poller.interval
+            subscribers = [(subscription_id, self.watched[subscription_id].train_model) for subscription_id in poller.subscribers]
+
+        for subscription_id, train_model in subscribers:
+            self._diff(subscription_id, (from_city, to_city), seat_infos.get(train_model))
+
+    def _diff(self, subscription_id, segment, seat_info):
+        # Read, compare and write back in one transaction, so that a concurrent unsubscribe or
+        # another segment's update is never lost
+        def apply(conn):
+            row = conn.execute("SELECT record FROM watches WHERE id = ? AND closed_at IS NULL", (subscription_id,)).fetchone()
+            if not row:
+                return None
+            subscription = Subscription.from_record(subscription_id, row[0])
+            previous = subscription.seats[segment]
+            changes = []
+            for seat_type in subscription.seat_types:
+                cell = (seat_info or {}).get(seat_type) or {}
+                seats = cell.get("online", 0) + cell.get("offline", 0)
+                if seats != previous.get(seat_type, 0):
+                    changes.append({
+                        "from": segment[0],
+                        "to": segment[1],
+                        "seat_type": seat_type,
+                        "before": previous.get(seat_type, 0),
+                        "after": seats,
+                        "fare": cell.get("fare", 0) + cell.get("vat_amount", 0)
+                    })
+                    previous[seat_type] = seats
+            if not changes:
+                return None
+            conn.execute("UPDATE watches SET record = ? WHERE id = ?", (subscription.to_record(), subscription_id))
+            return self._append_event(conn, subscription, "availability", {"changes": changes}, close=False)
+        self._delivered(self._transaction(apply))
+
+    def _notify(self, subscription_id, event_type, data, close=False):
+        def append(conn):
+            row = conn.execute("SELECT record FROM watches WHERE id = ? AND closed_at IS NULL", (subscription_id,)).fetchone()
+            if not row:
+                return None
+            return self._append_event(conn, Subscription.from_record(subscription_id, row[0]), event_type, data, close)
+        return self._delivered(self._transaction(append))
+
+    def _append_event(self, conn, subscription, event_type, data, close):
+        event_id = conn.execute("SELECT next_event_id FROM watches WHERE id = ?", (subscription.id,)).fetchone()[0]
+        event = {
+            "id": event_id,
+            "event": event_type,
+            "subscription": subscription.id,
+            "train_model": subscription.train_model,
+            "date": subscription.journey_date,
+            "at": int(time.time()),
+            **data
+        }
+        conn.execute("INSERT INTO watch_events (watch, id, event) VALUES (?, ?, ?)", (subscription.id, event_id, json.dumps(event)))
+        conn.execute("DELETE FROM watch_events WHERE watch = ? AND id <= ?", (subscription.id, event_id - EVENTS_KEPT))
+        conn.execute("UPDATE watches SET next_event_id = ?, closed_at = ? WHERE id = ?",
+                     (event_id + 1, self.clock() if close else None, subscription.id))
+        return subscription.webhook_url, event
+
+    def _delivered(self, appended):
+        # After the commit: wake this process's streams and hand the event to its webhook
+        if appended is None:
+            return None
+        webhook_url, event = appended
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+        with self.lock:
+            self.notifications += 1
+        if webhook_url and self.executor:
+            self.executor.submit(self._deliver_webhook, webhook_url, event)
+        return event
+
+    def _events(self, subscription_id, after_id):
+        # -> (events newer than after_id, still open), or None for an unknown watch
+        with self.lock:
+            conn = self._connection()
+            row = conn.execute("SELECT closed_at FROM watches WHERE id = ?", (subscription_id,)).fetchone()
+            if not row:
+                return None
+            events = [json.loads(event) for event, in conn.execute(
+                "SELECT event FROM watch_events WHERE watch = ? AND id > ? ORDER BY id", (subscription_id, after_id)
+            )]
+        return events, row[0] is None
+
+    def _deliver_webhook(self, url, event):
+        try:
+            requests.post(url, json=event, timeout=5).raise_for_status()
+        except requests.RequestException as e:
+            with self.lock:
+                self.webhook_failures += 1
+            logger.warning(f"Watch: webhook delivery to {url} failed: {e}")
+
+    def _credentials(self, poller):
+        # Each distinct credential pair once, with the watches that rely on it
+        with self.lock:
+            by_credentials = {}
+            for subscription_id in sorted(poller.subscribers):
+                by_credentials.setdefault(self.watched[subscription_id].credentials, []).append(subscription_id)
+        return [(subscription_ids, credentials) for credentials, subscription_ids in by_credentials.items()]
+
+    def _sync_pollers(self, now):
+        # Brings the pollers in line with the open watches, whichever worker created or closed them
+        with self.lock:
+            conn = self._connection()
+            watched = {
+                subscription_id: Subscription.from_record(subscription_id, record)
+                for subscription_id, record in conn.execute("SELECT id, record FROM watches WHERE closed_at IS NULL")
+            }
+            conn.execute("DELETE FROM watches WHERE closed_at < ?", (now - CLOSED_RETENTION_SECONDS,))
+            conn.execute("DELETE FROM watch_events WHERE watch NOT IN (SELECT id FROM watches)")
+
+            subscribers = {}
+            for subscription in watched.values():
+                for lookup in subscription.lookups.values():
+                    subscribers.setdefault(lookup, set()).add(subscription.id)
+            for lookup in list(self.pollers):
+                if lookup not in subscribers:
+                    del self.pollers[lookup]
+            for lookup, subscription_ids in subscribers.items():
+                poller = self.pollers.get(lookup)
+                if poller is None:
+                    # The watcher has just seen a fresh matrix, so the first poll can wait an interval
+                    first = min(watched[subscription_id].created_at for subscription_id in subscription_ids)
+                    poller = self.pollers[lookup] = Poller(lookup, self.min_interval, first + self.min_interval)
+                poller.subscribers = subscription_ids
+            self.watched = watched
+
+    def _expired(self, now):
+        with self.lock:
+            return [row[0] for row in self._connection().execute(
+                "SELECT id FROM watches WHERE closed_at IS NULL AND expires_at <= ?", (now,)
+            )]
+
+    def _transaction(self, work):
+        with self.lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _connection(self):
+        # One connection per process behind the lock, as in SqliteBucketStore; a forked child opens its own
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.conn = sqlite3.connect(self.store_path or ":memory:", timeout=5, isolation_level=None, check_same_thread=False)
+            self.conn_pid = os.getpid()
+            if self.store_path:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+        return self.conn
+
+    def _holds_poller_lock(self):
+        # Only one process polls a shared store; the others take over if it goes away
+        if not self.store_path or not fcntl:
+            return True
+        if self.poller_lock_pid == os.getpid():
+            return True
+        lock_file = open(f"{self.store_path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.poller_lock_file, self.poller_lock_pid = lock_file, os.getpid()
+        return True
+
+    def _schedule_loop(self):
+        while True:
+            wait = self.min_interval
+            try:
+                if self._holds_poller_lock():
+                    # New pollers are first due a full min_interval after they subscribe
+                    wait = min(self.run_due(), self.min_interval)
+            except Exception as e:
+                logger.warning(f"Watch: scheduler pass failed: {e}")
+            self.wakeup.wait(wait)
+            self.wakeup.clear()